@@ -147,9 +147,39 @@ class AnglePlanModel(BaseModel):
     plan_type_list: List[str] = Field(default=["CrystalPlan", "NeuXstalViz"])
     wait_for_list: List[str] = Field(default=["PCharge", "seconds"])
 
+    coverage_model: str = Field(
+        default="hexahedron",
+        title="Coverage Model",
+        description="hexahedron (pane corners), ewald (exact panes) or pixel (masked detector pixels)",
+    )
+    coverage_model_list: List[str] = Field(default=["hexahedron", "ewald", "pixel"])
+    num_workers: int = Field(
+        default=1,
+        ge=1,
+        title="Optimizer Workers",
+        description="Processes computing the lattice coverage, 1 computes it in the optimization worker",
+    )
+
     target_coverage: float = Field(
         default=0.9, title="Target coverage", description="Target coverage for the experiment"
     )
+    optimization_status: str = Field(
+        default="idle",
+        title="Optimization Status",
+        description="idle, running, stopping, cancelling, done, cancelled or failed",
+    )
+    optimization_step: int = Field(
+        default=0, title="Optimization Step", description="Angles added so far by the running optimization"
+    )
+    optimization_coverage: float = Field(
+        default=0.0, title="Optimization Coverage", description="Coverage (%) reached by the running optimization"
+    )
+    optimization_best_angle: List[float] = Field(
+        default=[], title="Best Angle", description="Latest (phi, chi, omega) added by the running optimization"
+    )
+    optimization_curve: List[List[float]] = Field(
+        default=[], title="Coverage Curve", description="[step, coverage (%)] after every accepted angle"
+    )
     qpane_cones: List = Field(default=[], title="Q Pane Cones", description="List of Q pane cones to be displayed")
     qpoints_all: List = Field(default=[], title="Q Points", description="List of Q points to be displayed")
     qpoints_covered: List = Field(
@@ -451,6 +481,18 @@ class AnglePlanModel(BaseModel):
 
         # self.is_under_development = True
 
+    def get_figure_optimization_curve(self) -> go.Figure:
+        """Coverage (%) against the number of runs of the optimization, one point per accepted angle."""
+        curve = np.array(self.optimization_curve, dtype=float).reshape(-1, 2)
+        fig = go.Figure(go.Scatter(x=curve[:, 0], y=curve[:, 1], mode="lines+markers"))
+        fig.update_layout(
+            xaxis_title="Number of runs",
+            yaxis_title="Coverage (%)",
+            yaxis={"range": [0, 100]},
+            margin={"l": 40, "r": 10, "t": 10, "b": 40},
+        )
+        return fig
+
     def get_figure_coverage(self) -> go.Figure:
         qcones = self.qpane_cones.copy()
         faces: List[Any] = []
@@ -1,12 +1,24 @@
 # ruff: noqa
 # mypy: ignore-errors
 
-from dataclasses import dataclass, field
+import hashlib
+import heapq
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields
 from itertools import product
+from multiprocessing import get_context, shared_memory
 from typing import Any, Dict, List, Union
 
 import numpy as np
 
+try:
+    from numba import njit, prange
+except ImportError:  # optional, without numba the fused kernel only runs as plain Python (tests)
+    njit = None
+    prange = range
+
 # units in code and input: length (cm), time(microsec), wavevector (A^-1)
 
 zero_eps = 1e-4
@@ -16,6 +28,62 @@ hbar = 1.05457182e-34  #  m^2 kg / s
 vtok = 1e4 * m_neutron / hbar * 1e-10  # v (cm/micros) to k (A^-1)
 vtok = 15.8825361042
 
+# upper bound of (points x planes) elements held in memory at once by the batched coverage kernel
+kernel_chunk_elements = 2**22
+
+# bumped whenever the search or the coverage model changes the plans it produces (stored with precomputed plans)
+engine_version = "2"
+
+
+def euler_rotation_matrices(angles):
+    """(N, 3, 3) rotation matrices for an (N, 3) array of (phi, chi, theta) angles in degree"""
+    # YZY convention
+    phi, chi, theta = np.radians(np.atleast_2d(np.asarray(angles, dtype=float))).T
+    zeros = np.zeros_like(phi)
+    ones = np.ones_like(phi)
+
+    def stack(rows):
+        return np.stack([np.stack(row, axis=-1) for row in rows], axis=-2)
+
+    Rz_phi = stack([[np.cos(phi), -np.sin(phi), zeros], [np.sin(phi), np.cos(phi), zeros], [zeros, zeros, ones]])
+
+    Ry_chi = stack([[np.cos(chi), zeros, np.sin(chi)], [zeros, ones, zeros], [-np.sin(chi), zeros, np.cos(chi)]])
+
+    Rz_theta = stack(
+        [[np.cos(theta), -np.sin(theta), zeros], [np.sin(theta), np.cos(theta), zeros], [zeros, zeros, ones]]
+    )
+
+    return Rz_theta @ Ry_chi @ Rz_phi
+
+
+def euler_rotation_matrix(euler_angles):
+    return euler_rotation_matrices(euler_angles)[0]
+
+
+def euler_rotation_derivatives(euler_angles):
+    """(3, 3, 3) derivatives of euler_rotation_matrix by phi, chi and theta, per degree"""
+    phi, chi, theta = np.radians(np.asarray(euler_angles, dtype=float))
+
+    def rz(angle, derivative=False):
+        c, s = np.cos(angle), np.sin(angle)
+        if derivative:
+            return np.array([[-s, -c, 0], [c, -s, 0], [0, 0, 0]])
+        return np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+
+    def ry(angle, derivative=False):
+        c, s = np.cos(angle), np.sin(angle)
+        if derivative:
+            return np.array([[-s, 0, c], [0, 0, 0], [-c, 0, -s]])
+        return np.array([[c, 0, s], [0, 1, 0], [-s, 0, c]])
+
+    return np.radians(1) * np.stack(
+        [
+            rz(theta) @ ry(chi) @ rz(phi, True),
+            rz(theta) @ ry(chi, True) @ rz(phi),
+            rz(theta, True) @ ry(chi) @ rz(phi),
+        ]
+    )
+
 
 class DetectorPane:
     def __init__(
@@ -140,6 +208,72 @@ class DetectorPane:
         else:
             raise ValueError("4 vertices not rectangular")
 
+        self._setup_halfspaces()
+        self._setup_ewald()
+
+    def _setup_halfspaces(self):
+        # compact H-representation of the q polyhedron, built once per pane:
+        # unit outward face normals and offsets, |q| shell and the cone around the central axis
+        face_normals = np.zeros((len(self.qfaces), 3))
+        for idx_face in self.qfaces:
+            a, b, c = self.qfaces[idx_face][0:3]
+            q0 = self.qfaces["%d" % (5 - int(idx_face))][0]
+            face_dir = np.cross(b - a, c - a)
+            face_dir = -face_dir * np.sign(np.dot(face_dir, q0 - a))
+            face_norm = np.linalg.norm(face_dir)
+            face_normals[int(idx_face)] = face_dir / face_norm if face_norm > 0 else face_dir
+        self.face_normals = face_normals
+        self.face_offsets = np.array([np.dot(face_normals[int(i)], self.qfaces[i][0]) for i in self.qfaces])
+
+        qvertices = np.array(self.qvertices)
+        qvertices_len = np.linalg.norm(qvertices, axis=1)
+        self.qmin = np.min(qvertices_len)
+        self.qmax = np.max(qvertices_len)
+        # |q| of any inside point is at least the distance of each face plane that has the origin outside
+        self.qmin_bound = max(0.0, np.max(-self.face_offsets))
+        # all vertices lie in the cone, so does their convex hull; a cone wider than 90 deg rejects nothing
+        self.cone_cos = np.min(qvertices @ self.center_axis / qvertices_len)
+        if self.cone_cos <= 0:
+            self.cone_cos = -1.0
+
+    def _setup_ewald(self, num_sample=33):
+        # exact model: a q point is seen when the scattered ray of its elastic k_f hits the rectangle and
+        # the flight time of that k is inside [t_min, t_max], see ewald_contains
+        a = self.rvertices[0]
+        opposite = np.argmax(np.linalg.norm(self.rvertices[1:] - a, axis=1)) + 1
+        edges = np.delete(self.rvertices, [0, opposite], axis=0) - a
+        normal = np.cross(edges[0], edges[1])
+        normal = normal / np.linalg.norm(normal)
+        if np.dot(normal, a) < 0:
+            normal = -normal
+        self.beam = np.array([0.0, 0.0, 1.0])
+        self.plane_normal = normal
+        self.plane_offset = np.dot(normal, a)
+        # dual basis of the edges, (x - a) . pixel_axes[i] runs from 0 to 1 across the pane
+        self.pixel_axes = np.linalg.solve(edges @ edges.T, edges)
+        self.pixel_offsets = self.pixel_axes @ a
+        self.flight = np.array([self.L1, self.pane_parameter["t_min"], self.pane_parameter["t_max"]])
+
+        # the exact volume bulges past the hexahedron between the vertices, so the prefilter bounds are
+        # taken from a dense sample of the pane and widened by the largest change between neighbour samples
+        s = np.linspace(0, 1, num_sample)
+        x = a + s[:, np.newaxis, np.newaxis] * edges[0] + s[np.newaxis, :, np.newaxis] * edges[1]
+        L2 = np.linalg.norm(x, axis=2)
+        q_dir = x / L2[:, :, np.newaxis] - self.beam
+        q_dir_len = np.linalg.norm(q_dir, axis=2)
+        q_dir = q_dir / q_dir_len[:, :, np.newaxis]
+        q_low = (L2 + self.L1) / self.flight[2] * vtok * q_dir_len
+        q_high = (L2 + self.L1) / self.flight[1] * vtok * q_dir_len
+        angle = np.arccos(np.clip(q_dir @ self.center_axis, -1, 1))
+
+        def step(values):
+            return max(np.max(np.abs(np.diff(values, axis=0))), np.max(np.abs(np.diff(values, axis=1))))
+
+        angle_step = max(step(q_dir[:, :, i]) for i in range(3))
+        self.ewald_cone_cos = np.cos(min(np.max(angle) + 2 * angle_step, np.pi))
+        self.ewald_qmin = max(0.0, np.min(q_low) - 2 * step(q_low))
+        self.ewald_qmax = np.max(q_high) + 2 * step(q_high)
+
     def contain_points_in_pane_cone(self, points):
         contain_points_in_pane_cone_methods = {"rectangle": self._contain_points_in_rectangle_pane_cone}
         contain_points = contain_points_in_pane_cone_methods.get(self.pane_shape, self._shape_notsupported)
@@ -147,61 +281,26 @@ class DetectorPane:
         return coverage
 
     def _contain_points_in_rectangle_pane_cone(self, points):
-        # print(self.qvertices,np.linalg.norm(np.array(self.qvertices),axis=1))
-        # print(np.linalg.norm(np.array(self.qvertices),axis=1))
-        # print(np.min(np.linalg.norm(np.array(self.qvertices),axis=1)))
-
-        self.qmin = np.min(np.linalg.norm(np.array(self.qvertices), axis=1))
-        self.qmax = np.max(np.linalg.norm(np.array(self.qvertices), axis=1))
-
         ##### cannot only consider angle range and radial range, could be both true, but point outside polyhedron
-        # qpoint_len= np.linalg.norm(point)<=self.qmax
-        # q_inrange= qpoint_len<=self.qmax and qpoint_len>=self.qmin
-        # angle_inrange
-        # in_qvolume
-        def same_side(a, b, c, p, q):
-            pside = np.sign(np.dot(np.cross(b - a, c - a), (p - a).T))
-            qside = np.sign(np.dot(np.cross(b - a, c - a), (q - a).T))
-            # print(a,b,c,p,q,'abcpq')
-            # print(pside,qside,'pq')
-
-            return pside * qside
-
-        # points=points[0:20]
-        # points=np.array([[0,0,-1]])
-        # print(points)
-        # points=points[4:5]
-
-        in_qvolume = np.zeros(points.shape[0])
-        # print(in_qvolume)
-        for idx_face in self.qfaces:
-            idx_opposite_face = "%d" % (5 - eval(idx_face))
-
-            a, b, c = self.qfaces[idx_face][0:3]
-            q0 = self.qfaces[idx_opposite_face][0]
-            p = points
-            q = np.zeros_like(points) + q0
-            inside_of_face = same_side(a, b, c, p, q)
-            # print(inside_of_face)
-            in_qvolume += inside_of_face
-        # print( in_qvolume)
-        # print( len(self.qfaces))
-        # print( len(self.qfaces)-zero_eps)
-        return in_qvolume >= len(self.qfaces) - zero_eps * 1e4
-        ################################
-        # 1e-16 absorbed, 6>6+1e-16 is false
-        """
-        allpts=set(self.qvertices)
-        in_qvolume=np.zeros(points.shape[0])
-        for facekey in self.qfaces:
-            facepts=set(self.qfaces[facekey])
-            otherpts=allpts.difference(facepts)
-            a,b,c=self.qfaces[facekey][0:3]
-            p=points
-            q=np.zeros_like(points)+list(otherpts)[0]
-            inside_of_face=same_side(a,b,c,p,q)
-            in_qvolume +=inside_of_face
+        # the |q| shell and the cone around the central axis are only a cheap prefilter,
+        # points passing it still go through the exact half-space test
+        points = np.atleast_2d(points)
+        q_len = np.linalg.norm(points, axis=1)
+        candidate = np.logical_and(q_len <= self.qmax + zero_eps, q_len >= self.qmin_bound - zero_eps)
+        candidate &= points @ self.center_axis >= q_len * (self.cone_cos - zero_eps)
+
+        in_qvolume = np.zeros(points.shape[0], dtype=bool)
+        # sign(d - n.p) is +1 inside a face, 0 on the face plane; 1e-16 absorbed, 6>6+1e-16 is false
+        inside_of_face = np.sign(self.face_offsets - points[candidate] @ self.face_normals.T)
+        in_qvolume[candidate] = np.sum(inside_of_face, axis=1) >= len(self.qfaces) - zero_eps * 1e4
+        return in_qvolume
+
+    def face_planes(self):
+        """Plane table of the q polyhedron, one row [n_x, n_y, n_z, d] per face with unit n pointing outwards.
+
+        A point p is on the inner side of a face when d - n.p > 0.
         """
+        return np.column_stack((self.face_normals, self.face_offsets))
 
     # TODO
     # from twotheta
@@ -239,6 +338,15 @@ class DetectorInstrument:
     detector_parameters_list: List
     detector_panes: List[DetectorPane] = field(default_factory=list)
     # [{'pane_shape':'rectangle','pane_parameter':{'vertices':[4x3],'t_min':100,'t_max':16000 }}]
+    # half-space tables of the unrotated panes, the fixed geometry used to evaluate orientations
+    base_pane_table: Any = field(default=None, repr=False)
+    # number of (orientation, grid) coverage evaluations done so far, to compare search strategies
+    num_coverage_evaluations: int = field(default=0, repr=False)
+    # "hexahedron": six half-spaces spanned by the corner k-vectors at t_min/t_max
+    # "ewald": exact inverse kinematics of every point, see ewald_contains
+    # "pixel": inverse kinematics looked up in pixel_lookup, dead, edge and gap pixels masked
+    coverage_model: str = "hexahedron"
+    pixel_lookup: Any = field(default=None, repr=False)
 
     def initialize_detector(self) -> None:
         self.detector_panes = []
@@ -254,6 +362,7 @@ class DetectorInstrument:
             detector_pane.setup_pane_cone()
             self.detector_panes.append(detector_pane)
             # print(detector_pane_parameter)
+        self.base_pane_table = self.pane_table()
 
     # TODO
     def add_detector(self, detector: DetectorPane) -> None:
@@ -283,16 +392,85 @@ class DetectorInstrument:
         rq = [np.linalg.norm(q) for q in vq]
         return np.min(np.array(rq))
 
-    def rotate_detectors(self, euler_angles) -> None:
-        # YZY convention
-        phi, chi, theta = np.array(euler_angles) / 180 * np.pi
-        Rz_phi = np.array([[np.cos(phi), -np.sin(phi), 0], [np.sin(phi), np.cos(phi), 0], [0, 0, 1]])
-
-        Ry_chi = np.array([[np.cos(chi), 0, np.sin(chi)], [0, 1, 0], [-np.sin(chi), 0, np.cos(chi)]])
-
-        Rz_theta = np.array([[np.cos(theta), -np.sin(theta), 0], [np.sin(theta), np.cos(theta), 0], [0, 0, 1]])
+    def stack_face_planes(self) -> np.ndarray:
+        """Face planes of all panes stacked as a (panes x faces x 4) array, see DetectorPane.face_planes"""
+        return self.pane_table().planes
+
+    def _coverage_model_notsupported(self):
+        raise ValueError("{} coverage model not supported".format(self.coverage_model))
+
+    def pane_table(self) -> "PaneTable":
+        """Precompiled tables of all panes for the batched coverage kernel, in the coverage_model"""
+        pane_table_methods = {
+            "hexahedron": self._hexahedron_pane_table,
+            "ewald": self._ewald_pane_table,
+            "pixel": self._pixel_table,
+        }
+        return pane_table_methods.get(self.coverage_model, self._coverage_model_notsupported)()
+
+    def _hexahedron_pane_table(self) -> "PaneTable":
+        panes = self.detector_panes
+        if len(panes) == 0:
+            return PaneTable.from_planes(np.zeros((0, 6, 4)))
+        return PaneTable(
+            normals=np.stack([pane.face_normals for pane in panes]),
+            offsets=np.stack([pane.face_offsets for pane in panes]),
+            axes=np.stack([pane.center_axis for pane in panes]),
+            cone_cos=np.array([pane.cone_cos for pane in panes]),
+            qmin=np.array([pane.qmin_bound for pane in panes]),
+            qmax=np.array([pane.qmax for pane in panes]),
+        )
+
+    def _pixel_table(self) -> "PaneTable":
+        # the exact panes cull and prefilter, the texture decides; the panes have to span the usable pixels
+        if self.pixel_lookup is None:
+            raise ValueError("pixel coverage model needs a pixel_lookup")
+        table = self._ewald_pane_table()
+        num_pane = table.num_pane
+        return PaneTable(
+            **table.arrays(),
+            frames=np.tile(np.eye(3), (num_pane, 1, 1)),
+            bank_id=np.arange(num_pane, dtype=np.int32),
+            texture=self.pixel_lookup.pixel,
+            texture_l2=self.pixel_lookup.l2,
+            texture_bank=self.pixel_lookup.bank,
+        )
+
+    def _ewald_pane_table(self) -> "PaneTable":
+        # the half-space tables stay for face_planes users, the kernels only use the exact fields
+        panes = self.detector_panes
+        table = self._hexahedron_pane_table()
+        if len(panes) == 0:
+            return table
+        return PaneTable(
+            normals=table.normals,
+            offsets=table.offsets,
+            axes=table.axes,
+            cone_cos=np.array([pane.ewald_cone_cos for pane in panes]),
+            qmin=np.array([pane.ewald_qmin for pane in panes]),
+            qmax=np.array([pane.ewald_qmax for pane in panes]),
+            beam=np.stack([pane.beam for pane in panes]),
+            plane_normals=np.stack([pane.plane_normal for pane in panes]),
+            plane_offsets=np.array([pane.plane_offset for pane in panes]),
+            pixel_axes=np.stack([pane.pixel_axes for pane in panes]),
+            pixel_offsets=np.stack([pane.pixel_offsets for pane in panes]),
+            flight=np.stack([pane.flight for pane in panes]),
+        )
+
+    def orientation_pane_table(self, euler_angles) -> "PaneTable":
+        """Pane tables for a goniometer setting without rebuilding any DetectorPane
+
+        The unrotated q polyhedra are turned rigidly by R, i.e. only the face normals and the cone axes
+        are multiplied by R; testing R^T q against the fixed panes gives the same answer.
+        Unlike rotate_detectors, the incident beam turns with the panes, which is what a
+        sample rotation does to the measured q.
+        """
+        if self.base_pane_table is None:
+            self.initialize_detector()
+        return self.base_pane_table.rotated(euler_rotation_matrix(euler_angles))
 
-        R_rotate = Rz_theta @ Ry_chi @ Rz_phi
+    def rotate_detectors(self, euler_angles) -> None:
+        R_rotate = euler_rotation_matrix(euler_angles)
 
         self.detector_panes = []
         for detector_parameters in self.detector_parameters_list:
@@ -323,6 +501,350 @@ class DetectorInstrument:
     #    return transforms
 
 
+@dataclass
+class PaneTable:
+    # half-space representation of a set of panes, stacked along the first axis
+    normals: np.ndarray  # (panes, faces, 3) unit outward face normals
+    offsets: np.ndarray  # (panes, faces), inside is normals.q <= offsets
+    axes: np.ndarray  # (panes, 3) central axis of the pane cone
+    cone_cos: np.ndarray  # (panes,) cosine of the cone half angle, -1 disables the cone prefilter
+    qmin: np.ndarray  # (panes,) lower bound of |q| inside the pane
+    qmax: np.ndarray  # (panes,) upper bound of |q| inside the pane
+    # exact (ewald) coverage model, None for the hexahedron model
+    beam: Any = None  # (panes, 3) incident beam direction
+    plane_normals: Any = None  # (panes, 3) unit normal of the pane plane, pointing away from the sample
+    plane_offsets: Any = None  # (panes,) distance of the pane plane from the sample
+    pixel_axes: Any = None  # (panes, 2, 3) dual edge vectors, x . pixel_axes - pixel_offsets is in [0, 1] on the pane
+    pixel_offsets: Any = None  # (panes, 2)
+    flight: Any = None  # (panes, 3) L1, t_min, t_max
+    # pixel coverage model, the exact fields above only serve as prefilter bounds; see PixelLookup
+    frames: Any = None  # (panes, 3, 3) lab axes, q . frames[i] is the lab component i of q
+    bank_id: Any = None  # (panes,) bank of the pane in the texture
+    texture: Any = None  # (num_two_theta, num_azimuth) PixelLookup.pixel, shared by all panes
+    texture_l2: Any = None  # (pixels,) PixelLookup.l2
+    texture_bank: Any = None  # (pixels,) PixelLookup.bank
+
+    # fields that turn with the sample rotation, the others are invariant
+    turning_fields = ("normals", "axes", "beam", "plane_normals", "pixel_axes", "frames")
+    # whole-detector tables, neither turned nor repeated per pane instance
+    shared_fields = ("texture", "texture_l2", "texture_bank")
+
+    @classmethod
+    def from_planes(cls, planes):
+        """Table without prefilter bounds from a (panes x faces x 4) plane array"""
+        num_pane = planes.shape[0]
+        return cls(
+            normals=planes[:, :, :3],
+            offsets=planes[:, :, 3],
+            axes=np.tile([0.0, 0.0, 1.0], (num_pane, 1)),
+            cone_cos=-np.ones(num_pane),
+            qmin=np.zeros(num_pane),
+            qmax=np.full(num_pane, np.inf),
+        )
+
+    def arrays(self):
+        """The fields in use, by name"""
+        return {item.name: getattr(self, item.name) for item in fields(self) if getattr(self, item.name) is not None}
+
+    def rotated(self, R):
+        # rotating the panes by R turns normals, axes and directions; offsets, bounds and lengths are invariant
+        return PaneTable(
+            **{key: value @ R.T if key in self.turning_fields else value for key, value in self.arrays().items()}
+        )
+
+    def rotated_many(self, rotations):
+        # one pane instance per (rotation, pane), ordered rotation-major
+        num_rot = rotations.shape[0]
+        table = {}
+        for key, value in self.arrays().items():
+            if key in self.shared_fields:
+                table[key] = value
+            elif key in self.turning_fields:
+                table[key] = np.einsum("rij,p...j->rp...i", rotations, value).reshape(-1, *value.shape[1:])
+            else:
+                table[key] = np.tile(value, (num_rot,) + (1,) * (value.ndim - 1))
+        return PaneTable(**table)
+
+    @property
+    def planes(self):
+        return np.concatenate((self.normals, self.offsets[:, :, np.newaxis]), axis=2)
+
+    @property
+    def num_pane(self):
+        return self.normals.shape[0]
+
+    @property
+    def exact(self):
+        return self.beam is not None
+
+
+@dataclass
+class PixelLookup:
+    """(two-theta, azimuth) -> pixel texture of the whole detector, for the "pixel" coverage model
+
+    Each cell holds the pixel seen at its scattering angles, or -1 where no usable pixel is (gaps between
+    banks, dead and edge pixels), so finding the pixel of a scattered ray is one table lookup.
+    """
+
+    pixel: np.ndarray  # (num_two_theta, num_azimuth) int32 pixel index, -1 for no usable pixel
+    l2: np.ndarray  # (pixels,) sample to pixel distance in cm
+    bank: np.ndarray  # (pixels,) int32 bank of each pixel
+
+    @classmethod
+    def from_pixels(cls, positions, usable=None, angle_step=0.1):
+        """Texture from (bank, row, column, 3) pixel positions in cm of flat banks
+
+        usable: optional (bank, row, column) bool mask, False for dead or edge pixels
+        angle_step: texture cell size in degrees, both in two-theta and azimuth
+
+        Every cell center is traced to each bank plane whose angular extent contains it and takes the nearest
+        pixel when the ray lands on the bank, so cells finer than a pixel have no holes.
+        """
+        positions = np.asarray(positions, dtype=float)
+        num_bank, num_row, num_column = positions.shape[:3]
+        if usable is None:
+            usable = np.ones(positions.shape[:3], dtype=bool)
+        num_two_theta = int(np.ceil(180 / angle_step))
+        num_azimuth = int(np.ceil(360 / angle_step))
+        two_theta = (np.arange(num_two_theta) + 0.5) * np.pi / num_two_theta
+        azimuth = (np.arange(num_azimuth) + 0.5) * 2 * np.pi / num_azimuth - np.pi
+        pixel = np.full((num_two_theta, num_azimuth), -1, dtype=np.int32)
+
+        l2 = np.linalg.norm(positions, axis=3)
+        pixel_two_theta = np.arccos(np.clip(positions[..., 2] / l2, -1, 1))
+        pixel_azimuth = np.arctan2(positions[..., 1], positions[..., 0])
+        for idx_bank in range(num_bank):
+            origin = positions[idx_bank, 0, 0]
+            edges = np.array(
+                [
+                    (positions[idx_bank, -1, 0] - origin) / max(num_row - 1, 1),
+                    (positions[idx_bank, 0, -1] - origin) / max(num_column - 1, 1),
+                ]
+            )
+            normal = np.cross(edges[0], edges[1])
+            dual = np.linalg.solve(edges @ edges.T, edges)
+            # cells of the bank's angular box, padded by one cell; banks across the -180 deg cut take all azimuths
+            rows = np.flatnonzero(
+                (two_theta >= pixel_two_theta[idx_bank].min() - np.radians(angle_step))
+                & (two_theta <= pixel_two_theta[idx_bank].max() + np.radians(angle_step))
+            )
+            bank_azimuth = pixel_azimuth[idx_bank]
+            if np.ptp(bank_azimuth) > np.pi:
+                columns = np.arange(num_azimuth)
+            else:
+                columns = np.flatnonzero(
+                    (azimuth >= bank_azimuth.min() - np.radians(angle_step))
+                    & (azimuth <= bank_azimuth.max() + np.radians(angle_step))
+                )
+            sin_two_theta = np.sin(two_theta[rows])[:, np.newaxis]
+            direction = np.stack(
+                (
+                    sin_two_theta * np.cos(azimuth[columns]),
+                    sin_two_theta * np.sin(azimuth[columns]),
+                    np.broadcast_to(np.cos(two_theta[rows])[:, np.newaxis], (len(rows), len(columns))),
+                ),
+                axis=-1,
+            )
+            with np.errstate(divide="ignore", invalid="ignore"):
+                distance = np.dot(normal, origin) / (direction @ normal)
+            hit = distance > 0
+            local = np.rint((distance[..., np.newaxis] * direction - origin) @ dual.T)
+            hit &= np.all(local >= 0, axis=-1) & (local[..., 0] < num_row) & (local[..., 1] < num_column)
+            row, column = local[hit].astype(int).T
+            found = np.full(hit.shape, -1, dtype=np.int32)
+            found[hit] = np.where(usable[idx_bank, row, column], (idx_bank * num_row + row) * num_column + column, -1)
+            # a cell already given to another bank keeps its pixel
+            cells = pixel[np.ix_(rows, columns)]
+            pixel[np.ix_(rows, columns)] = np.where(cells < 0, found, cells)
+        return cls(
+            pixel=pixel,
+            l2=l2.reshape(-1),
+            bank=np.repeat(np.arange(num_bank, dtype=np.int32), num_row * num_column),
+        )
+
+
+class DirectionIndex:
+    """Equal-area sky buckets over a set of Q points, for culling point-pane tests by direction
+
+    Buckets are num_band bands of equal cos(polar angle) times num_azimuth azimuth sectors. Points are
+    stored sorted by bucket (so the gathers of a bucket's points are contiguous) and order maps them back;
+    each bucket keeps its mean direction and the largest angle of a member to it, so a
+    pane cone (axis, half angle) can only contain points of buckets with angle(center, axis) <= half angle
+    + bucket radius. Points at q = 0 go to an extra bucket that every pane tests.
+    """
+
+    def __init__(self, points, q_len=None, num_band=32, num_azimuth=64):
+        points = np.asarray(points, dtype=float)
+        if q_len is None:
+            q_len = np.linalg.norm(points, axis=1)
+        q_len_col = q_len[:, np.newaxis]
+        q_dir = np.divide(points, q_len_col, out=np.zeros_like(points), where=q_len_col > 0)
+        self.num_bucket = num_band * num_azimuth
+        band = np.clip(((q_dir[:, 2] + 1) * 0.5 * num_band).astype(int), 0, num_band - 1)
+        azimuth = np.arctan2(q_dir[:, 1], q_dir[:, 0])
+        sector = np.clip(((azimuth + np.pi) / (2 * np.pi) * num_azimuth).astype(int), 0, num_azimuth - 1)
+        bucket = np.where(q_len > 0, band * num_azimuth + sector, self.num_bucket)
+
+        self.order = np.argsort(bucket, kind="stable")
+        bucket = bucket[self.order]
+        self.points, self.q_len, self.q_dir = points[self.order], q_len[self.order], q_dir[self.order]
+        self.starts = np.searchsorted(bucket, np.arange(self.num_bucket + 2))
+        self.counts = np.diff(self.starts)
+        # mean member direction and the angular radius around it, empty buckets never overlap
+        center = np.column_stack(
+            [np.bincount(bucket, weights=self.q_dir[:, i], minlength=self.num_bucket + 1) for i in range(3)]
+        )[: self.num_bucket].astype(float)
+        center_len = np.linalg.norm(center, axis=1, keepdims=True)
+        self.center = np.divide(center, center_len, out=np.zeros_like(center), where=center_len > 0)
+        min_cos = np.ones(self.num_bucket + 1)
+        np.minimum.at(
+            min_cos, bucket, np.einsum("kj,kj->k", self.q_dir, self.center[np.minimum(bucket, self.num_bucket - 1)])
+        )
+        self.radius = np.where(
+            self.counts[: self.num_bucket] > 0, np.arccos(np.clip(min_cos[: self.num_bucket], -1, 1)), -np.inf
+        )
+
+    def candidates(self, panes: PaneTable):
+        """(sorted point index, pane index) pairs of the points in buckets overlapping each pane cone"""
+        cone_angle = np.arccos(np.clip(panes.cone_cos, -1, 1))
+        center_angle = np.arccos(np.clip(panes.axes @ self.center.T, -1, 1))
+        overlap = center_angle <= cone_angle[:, np.newaxis] + self.radius + zero_eps
+        idx_pane, idx_bucket = np.divmod(np.flatnonzero(overlap), self.num_bucket)
+        if self.counts[self.num_bucket]:
+            idx_pane = np.concatenate((idx_pane, np.arange(panes.num_pane)))
+            idx_bucket = np.concatenate((idx_bucket, np.full(panes.num_pane, self.num_bucket)))
+        # expand every (pane, bucket) pair to the bucket's range of sorted points
+        counts = self.counts[idx_bucket]
+        first = np.repeat(self.starts[idx_bucket] - (np.cumsum(counts) - counts), counts)
+        return first + np.arange(first.size), np.repeat(idx_pane, counts)
+
+
+def pane_hits(points, panes: PaneTable, q_len=None, direction_index=None):
+    """(point index, pane index) pairs of all points inside a pane
+
+    points: (M, 3); q_len: optional precomputed |points|
+    The cone prefilter rejects most pairs with one (M x panes) product and a single comparison,
+    the |q| shell and the exact half-space test only run on the surviving pairs.
+    With a DirectionIndex over the points only the pairs of overlapping buckets reach the cone test.
+    """
+    if direction_index is not None:
+        # work on the index's bucket-sorted copy of the points, mapped back to input order at the end
+        points, q_len = direction_index.points, direction_index.q_len
+        idx_point, idx_pane = direction_index.candidates(panes)
+        cos_axis = np.einsum("kj,kj->k", direction_index.q_dir[idx_point], panes.axes[idx_pane])
+        in_cone = np.logical_or(cos_axis >= panes.cone_cos[idx_pane] - zero_eps, q_len[idx_point] == 0)
+        idx_point, idx_pane = idx_point[in_cone], idx_pane[in_cone]
+    else:
+        if q_len is None:
+            q_len = np.linalg.norm(points, axis=1)
+        q_len_col = q_len[:, np.newaxis]
+        q_dir = np.divide(points, q_len_col, out=np.zeros_like(points), where=q_len_col > 0)
+        candidate = q_dir @ panes.axes.T >= panes.cone_cos - zero_eps
+        candidate[q_len == 0] = True
+        idx_point, idx_pane = np.divmod(np.flatnonzero(candidate), candidate.shape[1])
+    num_face = panes.normals.shape[1]
+    in_shell = np.logical_and(
+        q_len[idx_point] <= panes.qmax[idx_pane] + zero_eps, q_len[idx_point] >= panes.qmin[idx_pane] - zero_eps
+    )
+    idx_point, idx_pane = idx_point[in_shell], idx_pane[in_shell]
+    if panes.texture is not None:
+        in_pane = pixel_contains(points[idx_point], q_len[idx_point], panes, idx_pane)
+    elif panes.exact:
+        in_pane = ewald_contains(points[idx_point], q_len[idx_point], panes, idx_pane)
+    else:
+        # sign(d - n.p) summed over faces, a point lying on one face plane still counts as inside
+        inside_of_face = np.sign(
+            panes.offsets[idx_pane] - np.einsum("kj,kfj->kf", points[idx_point], panes.normals[idx_pane])
+        )
+        in_pane = np.sum(inside_of_face, axis=1) >= num_face - zero_eps * 1e4
+    if direction_index is not None:
+        return direction_index.order[idx_point[in_pane]], idx_pane[in_pane]
+    return idx_point[in_pane], idx_pane[in_pane]
+
+
+def ewald_contains(points, q_len, panes: PaneTable, idx_pane):
+    """Exact test of (point, pane instance) pairs by inverse kinematics, for the "ewald" coverage model
+
+    With beam direction b the elastic condition |q + k b| = k gives k = -|q|^2 / (2 q.b) (only q.b < 0 is
+    reachable); the scattered ray along k_f = q + k b meets the pane plane n.x = d at x = d k_f / (n.k_f).
+    The point is seen when x lies on the rectangle and the flight time (L1 + |x|) vtok / k is inside
+    [t_min, t_max]. Four dot products per pair, against six for the hexahedron faces.
+    """
+    q_beam = np.einsum("kj,kj->k", points, panes.beam[idx_pane])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        k_len = -(q_len**2) / (2 * q_beam)
+        k_f = points + k_len[:, np.newaxis] * panes.beam[idx_pane]
+        f_normal = np.einsum("kj,kj->k", k_f, panes.plane_normals[idx_pane])
+        scale = panes.plane_offsets[idx_pane] / f_normal
+        pixel = scale[:, np.newaxis] * np.einsum("kj,kij->ki", k_f, panes.pixel_axes[idx_pane])
+        pixel -= panes.pixel_offsets[idx_pane]
+        L1, t_min, t_max = panes.flight[idx_pane].T
+        # |x| = scale k
+        tof = (L1 + scale * k_len) * vtok / k_len
+    on_pane = np.all((pixel >= -zero_eps) & (pixel <= 1 + zero_eps), axis=1)
+    in_band = (tof >= t_min * (1 - zero_eps)) & (tof <= t_max * (1 + zero_eps))
+    return (q_beam < 0) & (f_normal > 0) & on_pane & in_band
+
+
+def pixel_contains(points, q_len, panes: PaneTable, idx_pane):
+    """Test of (point, pane instance) pairs against the pixel texture, for the "pixel" coverage model
+
+    The elastic k and the scattered direction q / k + z of the point in the lab frame give the texture cell;
+    the point is seen when the cell's pixel belongs to the pane's bank and the flight time to that pixel,
+    (L1 + l2) vtok / k, is inside [t_min, t_max].
+    """
+    q_lab = np.einsum("kj,kij->ki", points, panes.frames[idx_pane])
+    # only q_z < 0 satisfies the elastic condition with the beam along +z
+    reachable = q_lab[:, 2] < 0
+    k_len = -(q_len**2) / (2 * np.where(reachable, q_lab[:, 2], -1.0))
+    k_len = np.where(reachable, k_len, 1.0)
+    direction = q_lab / k_len[:, np.newaxis]
+    num_two_theta, num_azimuth = panes.texture.shape
+    two_theta = np.arccos(np.clip(direction[:, 2] + 1, -1, 1))
+    azimuth = np.arctan2(direction[:, 1], direction[:, 0])
+    cell_two_theta = np.minimum((two_theta * (num_two_theta / np.pi)).astype(int), num_two_theta - 1)
+    cell_azimuth = np.minimum(((azimuth + np.pi) * (num_azimuth / (2 * np.pi))).astype(int), num_azimuth - 1)
+    pixel = panes.texture[cell_two_theta, cell_azimuth]
+    L1, t_min, t_max = panes.flight[idx_pane].T
+    tof = (L1 + panes.texture_l2[pixel]) * vtok / k_len
+    in_band = (tof >= t_min * (1 - zero_eps)) & (tof <= t_max * (1 + zero_eps))
+    return reachable & (pixel >= 0) & (panes.texture_bank[pixel] == panes.bank_id[idx_pane]) & in_band
+
+
+def contain_points_in_panes(points, panes, per_pane=False, q_len=None):
+    """Batched point-in-polyhedron test of many points against all panes at once.
+
+    points: (..., 3) array, e.g. (num_sym, N, 3) for all symmetry copies of a grid
+    panes: PaneTable from DetectorInstrument.pane_table, or a (panes x faces x 4) plane array
+    q_len: optional precomputed |points|, flattened
+    returns a bool array of shape points.shape[:-1], or points.shape[:-1] + (panes,) with per_pane=True
+    """
+    if not isinstance(panes, PaneTable):
+        panes = PaneTable.from_planes(np.asarray(panes))
+    points = np.asarray(points, dtype=float)
+    lead_shape = points.shape[:-1]
+    flat_points = points.reshape(-1, 3)
+    num_pane = panes.num_pane
+
+    if per_pane:
+        covered = np.zeros((flat_points.shape[0], num_pane), dtype=bool)
+    else:
+        covered = np.zeros(flat_points.shape[0], dtype=bool)
+
+    if q_len is None:
+        q_len = np.linalg.norm(flat_points, axis=1)
+
+    chunk = max(1, kernel_chunk_elements // max(num_pane, 1))
+    for start in range(0, flat_points.shape[0] if num_pane else 0, chunk):
+        stop = start + chunk
+        hit_point, hit_pane = pane_hits(flat_points[start:stop], panes, q_len=q_len[start:stop])
+        if per_pane:
+            covered[start + hit_point, hit_pane] = True
+        else:
+            covered[start + hit_point] = True
+    return covered.reshape(lead_shape + covered.shape[1:])
+
+
 class QGrids:
     def __init__(self, grid_mode: str, grid_parameter: Union[int, float, np.array, Dict[str, Any], None] = None):
         self.grid_mode = grid_mode
@@ -341,6 +863,9 @@ class QGrids:
         self.points = None
         self.rotated_points = None
         self.status = None
+        self._flat_points_cache = None
+        self._direction_index_cache = None
+        self._point_owner_cache = None
 
         self.setup_grid()
 
@@ -349,7 +874,11 @@ class QGrids:
 
     def setup_grid(self):
         # Mapping of setup methods
-        grid_setup_methods = {"uniform": self._setup_uniform_grid, "input": self._setup_input_grid}
+        grid_setup_methods = {
+            "uniform": self._setup_uniform_grid,
+            "input": self._setup_input_grid,
+            "asymmetric": self._setup_asymmetric_grid,
+        }
         # Select and call appropriate setup method
         setup_grid = grid_setup_methods.get(self.grid_mode, self._grid_mode_notsupported)
         # setup_grid = grid_setup_methods.get('uniform')
@@ -368,6 +897,45 @@ class QGrids:
         self.rotated_points = self.points.copy()
         self.status = np.zeros_like(self.points[0].shape[0])
 
+    def _setup_asymmetric_grid(self):
+        # {'hkl':(N,3) grid, 'symmetry_operators':(S,3,3) hkl matrices, 'ub':(3,3)}
+        # only the asymmetric unit of the grid is kept; the points tested are the distinct equivalents of its
+        # reflections, sorted by representative, and unit_index maps every equivalent to its representative
+        if not isinstance(self.grid_parameter, dict):
+            raise ValueError("error in grid parameter")
+        needed_info = ["hkl", "symmetry_operators", "ub"]
+        if not all(key in self.grid_parameter for key in needed_info):
+            raise ValueError("missing info in grid parameter")
+        hkl = np.asarray(self.grid_parameter["hkl"], dtype=float)
+        operators = np.asarray(self.grid_parameter["symmetry_operators"], dtype=float)
+        ub = np.asarray(self.grid_parameter["ub"], dtype=float)
+
+        equivalents = np.round(np.einsum("sij,nj->sni", operators, hkl), 6).reshape(-1, 3)
+        # distinct equivalents from one lexicographic sort, several times faster than np.unique(axis=0)
+        sort_order = np.lexsort(equivalents.T[::-1])
+        sorted_equivalents = equivalents[sort_order]
+        is_new = np.concatenate(([True], np.any(np.diff(sorted_equivalents, axis=0) != 0, axis=1)))
+        equivalent_hkl = sorted_equivalents[is_new]
+        inverse = np.empty(len(equivalents), dtype=np.int64)
+        inverse[sort_order] = np.cumsum(is_new) - 1
+        inverse = inverse.reshape(len(operators), len(hkl))
+        # a grid point is represented by its orbit's lowest equivalent, one grid point per orbit is kept
+        orbit, unit_first, grid_to_unit = np.unique(inverse.min(axis=0), return_index=True, return_inverse=True)
+        equivalent_unit = np.empty(len(equivalent_hkl), dtype=np.int32)
+        equivalent_unit[inverse] = grid_to_unit
+
+        order = np.argsort(equivalent_unit, kind="stable")
+        self.num_sym = len(operators)
+        self.num_unit = len(orbit)
+        self.unit_hkl = hkl[unit_first]
+        self.grid_to_unit = grid_to_unit.astype(np.int32)
+        self.equivalent_hkl = equivalent_hkl[order]
+        self.unit_index = equivalent_unit[order]
+        self.unit_starts = np.searchsorted(self.unit_index, np.arange(self.num_unit))
+        self.points = self.equivalent_hkl @ ub.T
+        self.rotated_points = self.points.copy()
+        self.status = np.zeros(self.num_unit, dtype=bool)
+
     def _setup_uniform_grid(self):
         # sanity check of rectangle vertices
         if not isinstance(self.grid_parameter, dict):
@@ -419,34 +987,128 @@ class QGrids:
     def get_neighbour(self, point):
         pass
 
-    def get_coverage(self, det_ins: DetectorInstrument):
-        self.point_coverage_perpane_list = []
-        self.status[...] = False
-        for detector in det_ins.detector_panes:
-            # TODO optimize these loops
-            for isym in range(self.num_sym):
-                point_coverage_perpane = detector.contain_points_in_pane_cone(self.rotated_points[isym])
-                # self.point_coverage_perpane_list.append(point_coverage_perpane)
-                self.status = np.logical_or(self.status, point_coverage_perpane)
-
-        #            #point_coverage_perpane=detector.contain_points_in_pane_cone(self.rotated_points[isym])
-        #            #self.point_coverage_perpane_list.append(point_coverage_perpane)
-        #
-        #
-        #            #print(point_coverred_perpane)
-        #        self.point_coverage_overall=self.point_coverage_perpane_list[0]
-        #        #print(point_cover_overall)
-        #        #print(np.sum(point_cover_overall))
-        #        #print(det_ins.detector_panes)
-        #        for icover in self.point_coverage_perpane_list:
-        #            self.point_coverage_overall=np.logical_or(icover,self.point_coverage_overall)
-        #            #print(point_cover_overall)
+    def flat_points(self):
+        """rotated_points as a (num_sym, N) shape, the flattened (num_sym*N, 3) points and their |q|
+
+        Cached until rotated_points is replaced, |q| does not change with the orientation.
+        """
+        if self._flat_points_cache is None or self._flat_points_cache[0] is not self.rotated_points:
+            points = np.asarray(self.rotated_points, dtype=float)
+            if points.ndim == 2:  # uniform grid, no symmetry copies
+                points = points[np.newaxis]
+            flat_points = points.reshape(-1, 3)
+            self._flat_points_cache = (
+                self.rotated_points,
+                points.shape[:-1],
+                flat_points,
+                np.linalg.norm(flat_points, axis=1),
+            )
+        return self._flat_points_cache[1:]
+
+    def point_owner(self):
+        """(number of grid points, owner), owner[k] is the grid point the k-th flat point is a copy of
+
+        For symmetry copies that is k % N; in asymmetric mode the asymmetric-unit point of an equivalent.
+        """
+        points_shape, flat_points, _ = self.flat_points()
+        if self._point_owner_cache is None or self._point_owner_cache[0] is not flat_points:
+            if self.grid_mode == "asymmetric":
+                owner = (self.num_unit, self.unit_index)
+            else:
+                owner = (points_shape[-1], np.tile(np.arange(points_shape[-1], dtype=np.int32), points_shape[0]))
+            self._point_owner_cache = (flat_points,) + owner
+        return self._point_owner_cache[1:]
+
+    def reduce_to_grid(self, covered):
+        """OR the coverage of the flat points (first axis of covered) onto the grid points they belong to"""
+        if self.grid_mode == "asymmetric":
+            # equivalents are sorted by representative, one contiguous run per asymmetric-unit point
+            return np.logical_or.reduceat(covered, self.unit_starts, axis=0)
+        points_shape = self.flat_points()[0]
+        return np.any(covered.reshape(points_shape + covered.shape[1:]), axis=0)
+
+    def direction_index(self):
+        """DirectionIndex over flat_points(), cached like them"""
+        _, flat_points, q_len = self.flat_points()
+        if self._direction_index_cache is None or self._direction_index_cache[0] is not flat_points:
+            self._direction_index_cache = (flat_points, DirectionIndex(flat_points, q_len))
+        return self._direction_index_cache[1]
+
+    def get_coverage(self, det_ins: DetectorInstrument, per_pane=False, euler_angles=None):
+        # all panes and all symmetry copies are tested in one batched kernel call;
+        # with euler_angles the fixed pane geometry is rotated instead of rebuilding the detector
+        if euler_angles is None:
+            panes = det_ins.pane_table()
+        else:
+            panes = det_ins.orientation_pane_table(euler_angles)
+        _, flat_points, q_len = self.flat_points()
+        point_coverage = contain_points_in_panes(flat_points, panes, per_pane=per_pane, q_len=q_len)
+        if per_pane:
+            # (panes, N), a point counts for a pane if any of its symmetry copies is seen by the pane
+            self.point_coverage_perpane = self.reduce_to_grid(point_coverage).T
+            self.status = np.any(self.point_coverage_perpane, axis=0)
+        else:
+            self.status = self.reduce_to_grid(point_coverage)
 
         self.point_coverage_overall = self.status.copy()
+        if per_pane:
+            return self.point_coverage_overall, self.point_coverage_perpane
         return self.point_coverage_overall
         # return np.sum(self.point_cover_overall)
 
 
+def reflection_hkl(ub, min_dspacing, max_dspacing, min_wavelength=None, max_wavelength=None, two_theta_range=None):
+    """All hkl (excluding 000) with d-spacing inside [min_dspacing, max_dspacing] that the wavelength band can reach
+
+    ub: (3,3) with |ub @ hkl| = 1/d. A reflection is measurable when lambda = 2 d sin(theta) falls inside
+    [min_wavelength, max_wavelength] for some two-theta in two_theta_range (degrees, default 0-180), which
+    narrows the d range to [min_wavelength / (2 sin theta_max), max_wavelength / (2 sin theta_min)].
+    Returns an (N, 3) float array in h, k, l order.
+    """
+    ub = np.asarray(ub, dtype=float)
+    two_theta_min, two_theta_max = two_theta_range if two_theta_range is not None else (0.0, 180.0)
+    sin_theta_min = np.sin(np.radians(two_theta_min) / 2)
+    sin_theta_max = np.sin(np.radians(min(two_theta_max, 180.0)) / 2)
+    if min_wavelength is not None and sin_theta_max > 0:
+        min_dspacing = max(min_dspacing, min_wavelength / (2 * sin_theta_max))
+    if max_wavelength is not None and sin_theta_min > 0:
+        max_dspacing = min(max_dspacing, max_wavelength / (2 * sin_theta_min))
+    if min_dspacing <= 0 or min_dspacing > max_dspacing:
+        return np.zeros((0, 3))
+
+    # |h_i| = |(ub^-1)_i . q| <= |(ub^-1)_i| |q| with |q| <= 1/min_dspacing
+    hkl_max = np.floor(np.linalg.norm(np.linalg.inv(ub), axis=1) / min_dspacing + zero_eps).astype(int)
+    h, k, l = np.meshgrid(*[np.arange(-m, m + 1) for m in hkl_max], indexing="ij")
+    hkl = np.column_stack((h.ravel(), k.ravel(), l.ravel())).astype(float)
+    d_star = np.linalg.norm(hkl @ ub.T, axis=1)
+    # relative tolerance only, zero_eps is far too coarse for 1/d
+    in_shell = (d_star >= (1 - 1e-9) / max_dspacing) & (d_star <= (1 + 1e-9) / min_dspacing) & (d_star > 0)
+    return hkl[in_shell]
+
+
+# integral reflection conditions of the lattice centerings offered in the experiment info
+centering_conditions = {
+    "P": lambda h, k, l: np.ones(h.shape, dtype=bool),
+    "R": lambda h, k, l: np.ones(h.shape, dtype=bool),  # rhombohedral axes, primitive
+    "I": lambda h, k, l: (h + k + l) % 2 == 0,
+    "F": lambda h, k, l: ((h + k) % 2 == 0) & ((k + l) % 2 == 0),
+    "A": lambda h, k, l: (k + l) % 2 == 0,
+    "B": lambda h, k, l: (h + l) % 2 == 0,
+    "C": lambda h, k, l: (h + k) % 2 == 0,
+    "Robv": lambda h, k, l: (-h + k + l) % 3 == 0,
+    "Rrev": lambda h, k, l: (h - k + l) % 3 == 0,
+}
+
+
+def centering_reflections(hkl, centering):
+    """Drop the reflections that are systematically absent for the lattice centering"""
+    if centering not in centering_conditions:
+        raise ValueError("{} centering not supported".format(centering))
+    hkl = np.asarray(hkl)
+    h, k, l = np.rint(hkl).astype(int).T
+    return hkl[centering_conditions[centering](h, k, l)]
+
+
 # TODO
 def maximum_coverage(det_ins: DetectorInstrument, angle_list, qgrids: QGrids):
     theta_list, chi_list, phi_list = angle_list
@@ -458,137 +1120,1206 @@ def maximize_coverage(grids: QGrids, det_ins: DetectorInstrument):
     pass
 
 
-def optimize_angle_with_fixed_given(grids: QGrids, det_ins: DetectorInstrument, fixed_angle_list, euler_angle_ranges):
-    angle_list = []
-    # angle_list=initial_angle_list+fixed_angle_list
-    angle_list = [tuple(a) for a in list(fixed_angle_list)]
-    angle_list = list(fixed_angle_list).copy()
-    if len(angle_list) == 0:
-        angle_list = [(0, 0, 0)]
-    angle_list.append([10, 135, 0])
-    max_coverage = 0.9
+def euler_angle_lattice(euler_angle_ranges):
+    """All (theta, chi, phi) combinations of the discretized ranges as an (N, 3) array, in product order"""
+    theta_range, chi_range, phi_range = euler_angle_ranges
+    # Discretize the ranges into a grid
+    theta_list = np.linspace(
+        theta_range[0], theta_range[1], int((theta_range[1] - theta_range[0]) / theta_range[2] + 1)
+    )
+    chi_list = np.linspace(chi_range[0], chi_range[1], int((chi_range[1] - chi_range[0]) / chi_range[2] + 1))
+    phi_list = np.linspace(phi_range[0], phi_range[1], int((phi_range[1] - phi_range[0]) / phi_range[2] + 1))
+    theta, chi, phi = np.meshgrid(theta_list, chi_list, phi_list, indexing="ij")
+    return np.column_stack((theta.ravel(), chi.ravel(), phi.ravel()))
 
-    # unifrom grid: current_coverage=[False]*np.sum(grids.mask)
-    current_coverage = [False] * np.size(grids.status)
-    current_coverage_num = np.sum(current_coverage)
 
-    last_coverage = current_coverage.copy()
-    last_coverage_num = np.sum(last_coverage)
+popcount_table = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
 
-    Nstep = 200
-    step = 0
 
-    ########## 1st angle rotation#############
-    last_coverage = current_coverage.copy()
-    last_coverage_num = np.sum(last_coverage)
+class CoverageMask:
+    """Bit-packed coverage over the grid points, 8 points per byte
 
-    det_ins.rotate_detectors(angle_list[0])
-    new_coverage = grids.get_coverage(det_ins)
+    bits is a (..., ceil(size / 8)) uint8 array as produced by np.packbits, so a batch of
+    candidate masks is a single (C, nbyte) array; padding bits past size are always zero.
+    """
 
-    current_coverage = np.logical_or(last_coverage, new_coverage)
-    current_coverage_num = np.sum(current_coverage)
+    def __init__(self, bits, size):
+        self.bits = np.asanyarray(bits, dtype=np.uint8)
+        self.size = int(size)
 
-    new_coverage_num = current_coverage_num - last_coverage_num
+    @classmethod
+    def zeros(cls, size, batch_shape=()):
+        return cls(np.zeros(tuple(batch_shape) + ((size + 7) // 8,), dtype=np.uint8), size)
 
-    last_coverage = current_coverage.copy()
+    @classmethod
+    def from_bool(cls, mask):
+        mask = np.asarray(mask, dtype=bool)
+        return cls(np.packbits(mask, axis=-1), mask.shape[-1])
 
-    # print('initial coverage: ',np.sum(current_coverage)*100/np.size(current_coverage),'%','max covarange:',max_coverage)
-    ########## nst angle rotation#############
-    current_angle_idx = 0
-    last_angle_idx = current_angle_idx
+    @classmethod
+    def from_indices(cls, index, size):
+        mask = np.zeros(size, dtype=bool)
+        mask[index] = True
+        return cls.from_bool(mask)
 
-    theta_range, chi_range, phi_range = euler_angle_ranges
-    # Discretize the ranges into a grid
-    theta_list = np.linspace(
-        theta_range[0], theta_range[1], int((theta_range[1] - theta_range[0]) / theta_range[2] + 1)
-    )
-    chi_list = np.linspace(chi_range[0], chi_range[1], int((chi_range[1] - chi_range[0]) / chi_range[2] + 1))
-    phi_list = np.linspace(phi_range[0], phi_range[1], int((phi_range[1] - phi_range[0]) / phi_range[2] + 1))
+    def to_bool(self):
+        return np.unpackbits(self.bits, axis=-1, count=self.size).astype(bool)
 
-    # Generate all combinations of Euler angles (grid search)
-    # angle_combinations = np.meshgrid(pitch_values, yaw_values, roll_values)
+    def __getitem__(self, item):
+        return CoverageMask(self.bits[item], self.size)
 
-    angle_combinations_iter = product(theta_list, chi_list, phi_list)
-    angle_combinations = [i for i in angle_combinations_iter]
+    def __len__(self):
+        return self.bits.shape[0] if self.bits.ndim > 1 else 1
 
-    while np.sum(current_coverage) < np.size(current_coverage) * max_coverage and step < Nstep:
-        step += 1
+    def copy(self):
+        return CoverageMask(self.bits.copy(), self.size)
 
-        # new_angle=grid_search_adaptive(det_ins, grids, euler_angle_ranges,current_coverage,new_coverage_num)
-        # new_angle,current_angle_idx=grid_search_adaptive_fromlast(det_ins, grids, euler_angle_ranges,last_coverage,new_coverage_num,last_angle_idx,angle_combinations)
-        # last_angle_idx=current_angle_idx
-        # new_angle=grid_search(det_ins, grids, euler_angle_ranges,current_coverage)
-        new_angle = grid_ascend(det_ins, grids, euler_angle_ranges, current_coverage, angle_list[-1])
-        if new_angle == None:
-            print("Max coverage reached, stopping")
-            break
+    def __or__(self, other):
+        return CoverageMask(self.bits | other.bits, self.size)
 
-        ########## nst angle rotation#############
-        last_coverage = current_coverage.copy()
-        last_coverage_num = np.sum(last_coverage)
+    def __ior__(self, other):
+        self.bits |= other.bits
+        return self
 
-        det_ins.rotate_detectors(new_angle)
-        new_coverage = grids.get_coverage(det_ins)
+    def without(self, other):
+        """Points set here but not in other (AND-NOT)"""
+        return CoverageMask(self.bits & ~other.bits, self.size)
 
-        current_coverage = np.logical_or(last_coverage, new_coverage)
-        current_coverage_num = np.sum(current_coverage)
+    def count(self):
+        """Number of covered points, per mask of a batch"""
+        return np.sum(popcount_table[self.bits], axis=-1, dtype=np.int64)
 
-        new_coverage_num = current_coverage_num - last_coverage_num
+    def gain(self, candidates):
+        """Number of points each candidate mask adds on top of this one"""
+        return np.sum(popcount_table[candidates.bits & ~self.bits], axis=-1, dtype=np.int64)
 
-        last_coverage = current_coverage.copy()
 
-        print(r"current coverage: f%\%", current_coverage_num * 100.0 / np.size(current_coverage))
-        # print('where',np.where(current_coverage==True))
-        # print('new_angle',new_angle)
-        angle_list.append(new_angle)
-        print("angle", angle_list)
-    print("final covrage", np.sum(current_coverage))
-    print("final angle", angle_list)
-    return angle_list, current_coverage
+def uncovered_copies(owner, uncovered):
+    """Flat indices of the copies of the uncovered grid points and their column in flatnonzero(uncovered)"""
+    flat_index = np.flatnonzero(uncovered[owner])
+    return flat_index, (np.cumsum(uncovered) - 1)[owner[flat_index]]
 
 
-def grid_search(det_ins, qgrids, euler_angle_ranges, last_coverage):
-    print("searching for new angle")
-    # Define ranges for each Euler angle
-    # euler_angle_range=[[0,180,0.5],[135,135,0.5],[0,360,0.5]]
-    # print(euler_angle_ranges)
-    theta_range, chi_range, phi_range = euler_angle_ranges
-    # Discretize the ranges into a grid
-    theta_list = np.linspace(
-        theta_range[0], theta_range[1], int((theta_range[1] - theta_range[0]) / theta_range[2] + 1)
-    )
-    chi_list = np.linspace(chi_range[0], chi_range[1], int((chi_range[1] - chi_range[0]) / chi_range[2] + 1))
-    phi_list = np.linspace(phi_range[0], phi_range[1], int((phi_range[1] - phi_range[0]) / phi_range[2] + 1))
+class UncoveredPoints:
+    """Working set of the grid points not covered yet, with all their symmetry copies gathered
 
-    # Generate all combinations of Euler angles (grid search)
-    # angle_combinations = np.meshgrid(pitch_values, yaw_values, roll_values)
+    index holds the still-uncovered grid points and shrinks with update(); points/q_len are the
+    flattened copies of those points and column[k] the position in index of the point copied by points[k].
+    """
 
-    angle_combinations = product(theta_list, chi_list, phi_list)
-    # angle_combinations = product(theta_list, chi_list, phi_list)
+    def __init__(self, qgrids: QGrids, coverage=None):
+        _, flat_points, q_len = qgrids.flat_points()
+        self.num_grid_point, owner = qgrids.point_owner()
+        if isinstance(coverage, CoverageMask):
+            coverage = coverage.to_bool()
+        if coverage is None:
+            uncovered = np.ones(self.num_grid_point, dtype=bool)
+        else:
+            uncovered = ~np.broadcast_to(np.asarray(coverage, dtype=bool), (self.num_grid_point,))
+        self.index = np.flatnonzero(uncovered)
+        flat_index, self.column = uncovered_copies(owner, uncovered)
+        self.points = flat_points[flat_index]
+        self.q_len = q_len[flat_index]
+        self._direction_index = None
+        self._packed_index = None
+
+    @property
+    def size(self):
+        return self.index.size
+
+    def update(self, newly_covered):
+        """Drop points covered now; newly_covered is a bool mask over index (or over the full grid)"""
+        newly_covered = np.asarray(newly_covered, dtype=bool)
+        if newly_covered.size == self.num_grid_point and self.num_grid_point != self.size:
+            newly_covered = newly_covered[self.index]
+        keep = ~newly_covered
+        keep_copy = keep[self.column]
+        self.index = self.index[keep]
+        self.points = self.points[keep_copy]
+        self.q_len = self.q_len[keep_copy]
+        self.column = (np.cumsum(keep) - 1)[self.column[keep_copy]]
+        self._direction_index = None
+        self._packed_index = None
+
+    def direction_index(self):
+        # rebuilt lazily after every update, the working set shrinks between searches
+        if self._direction_index is None:
+            self._direction_index = DirectionIndex(self.points, self.q_len)
+        return self._direction_index
+
+    def packed_index(self):
+        """Bytes of a packed CoverageMask holding the points of index"""
+        if self._packed_index is None:
+            self._packed_index = np.unique(self.index >> 3)
+        return self._packed_index
+
+
+def orientation_coverages(det_ins: DetectorInstrument, qgrids: QGrids, angles, working_set=None, count_hits=False):
+    """Coverage of many candidate orientations, yielded in memory-bounded chunks
+
+    angles: (N, 3) euler angles; all rotation matrices are built in one vectorized step
+    working_set: optional UncoveredPoints, only those points are tested
+    yields (start, covered) with covered a (chunk, num_points) bool array for angles[start:start + chunk];
+    with a working set the columns follow working_set.index
+    count_hits: covered is a uint8 count of symmetry copies x panes hitting each point instead
+    """
+    angles = np.atleast_2d(np.asarray(angles, dtype=float))
+    if det_ins.base_pane_table is None:
+        det_ins.initialize_detector()
+    if working_set is None:
+        _, flat_points, q_len = qgrids.flat_points()
+        num_point, point_column = qgrids.point_owner()
+        direction_index = qgrids.direction_index()
+    else:
+        flat_points, q_len, point_column = working_set.points, working_set.q_len, working_set.column
+        num_point = working_set.size
+        direction_index = working_set.direction_index()
+    for start, covered in covered_chunks(
+        det_ins.base_pane_table, flat_points, q_len, point_column, num_point, angles, direction_index, count_hits
+    ):
+        det_ins.num_coverage_evaluations += covered.shape[0]
+        yield start, covered
+
+
+def covered_chunks(
+    base_panes: PaneTable,
+    flat_points,
+    q_len,
+    point_column,
+    num_point,
+    angles,
+    direction_index=None,
+    count_hits=False,
+):
+    """Kernel of orientation_coverages on raw arrays: flat point k is a copy of grid column point_column[k]
 
-    best_coverage = np.sum(last_coverage)
-    best_angles = None
+    direction_index: optional DirectionIndex over flat_points to cull point-pane pairs by direction
+    count_hits: yield uint8 hit counts (copies x panes, saturating at 255) instead of bool coverage,
+    from the same pass
+    With numba (use_fused_kernel) the compiled fused_pane_cover does the test on the same index
+    (not for the pixel model, whose texture test runs in pane_hits).
+    """
+    num_pane = base_panes.num_pane
+    if use_fused_kernel and num_pane and base_panes.texture is None:
+        yield from fused_covered_chunks(
+            fused_pane_kernel,
+            base_panes,
+            flat_points,
+            q_len,
+            point_column,
+            num_point,
+            angles,
+            direction_index,
+            count_hits,
+        )
+        return
+    rotations = euler_rotation_matrices(angles)
+
+    angle_chunk = max(1, kernel_chunk_elements // max(num_pane * flat_points.shape[0], 1))
+    if direction_index is not None:
+        # culled pairs of the unrotated panes estimate the pairs per orientation, with room for 2x more
+        num_pair = direction_index.candidates(base_panes)[0].size + direction_index.num_bucket * num_pane
+        angle_chunk = max(1, kernel_chunk_elements // (2 * max(num_pair, 1)))
+    point_chunk = max(1, kernel_chunk_elements // max(num_pane * angle_chunk, 1))
+    for start in range(0, len(angles), angle_chunk):
+        panes = base_panes.rotated_many(rotations[start : start + angle_chunk])
+        num_angle = panes.num_pane // max(num_pane, 1)
+        covered = np.zeros((num_angle, num_point), dtype=np.int32 if count_hits else bool)
+        if direction_index is not None and num_pane:
+            hits = [pane_hits(flat_points, panes, direction_index=direction_index)]
+        else:
+            hits = []
+            for point_start in range(0, flat_points.shape[0] if num_pane else 0, point_chunk):
+                point_stop = point_start + point_chunk
+                hit_point, hit_pane = pane_hits(
+                    flat_points[point_start:point_stop], panes, q_len[point_start:point_stop]
+                )
+                hits.append((point_start + hit_point, hit_pane))
+        for hit_point, hit_pane in hits:
+            # pane instances are ordered (angle, pane)
+            if count_hits:
+                flat_index = (hit_pane // num_pane) * num_point + point_column[hit_point]
+                covered += np.bincount(flat_index, minlength=covered.size).reshape(covered.shape).astype(np.int32)
+            else:
+                covered[hit_pane // num_pane, point_column[hit_point]] = True
+        if count_hits:
+            covered = np.minimum(covered, 255).astype(np.uint8)
+        yield start, covered
+
+
+def fused_pane_cover(
+    points,
+    q_len,
+    q_dir,
+    point_column,
+    starts,
+    center,
+    radius,
+    normals,
+    offsets,
+    axes,
+    cone_cos,
+    qmin,
+    qmax,
+    beam,
+    plane_normals,
+    plane_offsets,
+    pixel_axes,
+    pixel_offsets,
+    flight,
+    num_pane,
+    covered,
+    count_hits=False,
+):
+    """Fused point-in-pane test: one pass per pane instance, faces tested in registers, no temporaries
+
+    Points come bucket-sorted from a DirectionIndex (starts, center, radius); only buckets that can overlap
+    the pane cone are visited. Pane instance i belongs to orientation i // num_pane; covered
+    (orientations, grid columns) uint8 is set to 1 where any copy of a column is inside any pane, or with
+    count_hits counts the (copy, pane) hits, saturating at 255. Same tests and tolerances as pane_hits; the
+    exact (ewald) test of ewald_contains replaces the face test when beam has a row per pane instance.
+    Orientations are split over the threads, each row of covered is written by one thread only.
+    """
+    num_instance, num_face = offsets.shape
+    num_bucket = center.shape[0]
+    exact = beam.shape[0] == num_instance
+    for orientation in prange(num_instance // num_pane):
+        for idx in range(orientation * num_pane, (orientation + 1) * num_pane):
+            ax, ay, az = axes[idx, 0], axes[idx, 1], axes[idx, 2]
+            cone_angle = np.arccos(min(max(cone_cos[idx], -1.0), 1.0))
+            for bucket in range(num_bucket + 1):
+                # the last bucket holds the q = 0 points, it is always tested
+                if bucket < num_bucket:
+                    if starts[bucket] == starts[bucket + 1]:
+                        continue
+                    center_cos = center[bucket, 0] * ax + center[bucket, 1] * ay + center[bucket, 2] * az
+                    if np.arccos(min(max(center_cos, -1.0), 1.0)) > cone_angle + radius[bucket] + zero_eps:
+                        continue
+                for k in range(starts[bucket], starts[bucket + 1]):
+                    column = point_column[k]
+                    if covered[orientation, column] and not count_hits:
+                        continue
+                    q = q_len[k]
+                    if q > 0 and q_dir[k, 0] * ax + q_dir[k, 1] * ay + q_dir[k, 2] * az < cone_cos[idx] - zero_eps:
+                        continue
+                    if q > qmax[idx] + zero_eps or q < qmin[idx] - zero_eps:
+                        continue
+                    x, y, z = points[k, 0], points[k, 1], points[k, 2]
+                    if exact:
+                        q_beam = x * beam[idx, 0] + y * beam[idx, 1] + z * beam[idx, 2]
+                        if q_beam >= 0:
+                            continue
+                        k_len = -q * q / (2 * q_beam)
+                        fx, fy, fz = x + k_len * beam[idx, 0], y + k_len * beam[idx, 1], z + k_len * beam[idx, 2]
+                        f_normal = fx * plane_normals[idx, 0] + fy * plane_normals[idx, 1] + fz * plane_normals[idx, 2]
+                        if f_normal <= 0:
+                            continue
+                        scale = plane_offsets[idx] / f_normal
+                        seen = True
+                        for axis in range(2):
+                            pixel = (
+                                scale
+                                * (
+                                    fx * pixel_axes[idx, axis, 0]
+                                    + fy * pixel_axes[idx, axis, 1]
+                                    + fz * pixel_axes[idx, axis, 2]
+                                )
+                                - pixel_offsets[idx, axis]
+                            )
+                            if pixel < -zero_eps or pixel > 1 + zero_eps:
+                                seen = False
+                        tof = (flight[idx, 0] + scale * k_len) * vtok / k_len
+                        if tof < flight[idx, 1] * (1 - zero_eps) or tof > flight[idx, 2] * (1 + zero_eps):
+                            seen = False
+                    else:
+                        inside = 0
+                        for face in range(num_face):
+                            d = offsets[idx, face] - (
+                                x * normals[idx, face, 0] + y * normals[idx, face, 1] + z * normals[idx, face, 2]
+                            )
+                            if d > 0:
+                                inside += 1
+                            elif d < 0:
+                                inside -= 1
+                        seen = inside >= num_face - zero_eps * 1e4
+                    if seen and covered[orientation, column] < 255:
+                        covered[orientation, column] += 1
+
+
+# compiled with numba when it is importable, covered_chunks then uses it instead of pane_hits
+fused_pane_kernel = njit(parallel=True, cache=True)(fused_pane_cover) if njit is not None else None
+use_fused_kernel = fused_pane_kernel is not None
+
+
+def fused_covered_chunks(
+    kernel,
+    base_panes: PaneTable,
+    flat_points,
+    q_len,
+    point_column,
+    num_point,
+    angles,
+    direction_index=None,
+    count_hits=False,
+):
+    num_pane = base_panes.num_pane
+    rotations = euler_rotation_matrices(angles)
+    if direction_index is None:
+        direction_index = DirectionIndex(flat_points, q_len)
+    sorted_column = np.ascontiguousarray(np.asarray(point_column)[direction_index.order])
+    angle_chunk = max(1, kernel_chunk_elements // max(num_point, 1))
+    for start in range(0, len(angles), angle_chunk):
+        panes = base_panes.rotated_many(rotations[start : start + angle_chunk])
+        covered = np.zeros((panes.num_pane // num_pane, num_point), dtype=np.uint8)
+        if panes.exact:
+            ewald = [np.ascontiguousarray(getattr(panes, key), dtype=float) for key in ewald_fields]
+        else:
+            # empty tables select the face test
+            ewald = [np.zeros((0,) + shape) for shape in ((3,), (3,), (), (2, 3), (2,), (3,))]
+        kernel(
+            direction_index.points,
+            direction_index.q_len,
+            direction_index.q_dir,
+            sorted_column,
+            direction_index.starts,
+            direction_index.center,
+            direction_index.radius,
+            np.ascontiguousarray(panes.normals),
+            np.ascontiguousarray(panes.offsets),
+            np.ascontiguousarray(panes.axes),
+            panes.cone_cos,
+            panes.qmin,
+            panes.qmax,
+            *ewald,
+            num_pane,
+            covered,
+            count_hits,
+        )
+        yield start, covered if count_hits else covered.view(bool)
+
+
+# process-pool evaluation: each worker maps the shared arrays once and scores slices of the candidates
+_worker_arrays = {}
+# per worker: the gathered points and direction index of the current search step, see _worker_points
+_worker_points = {}
+pane_table_fields = ("normals", "offsets", "axes", "cone_cos", "qmin", "qmax")
+ewald_fields = ("beam", "plane_normals", "plane_offsets", "pixel_axes", "pixel_offsets", "flight")
+pixel_fields = ("frames", "bank_id", "texture", "texture_l2", "texture_bank")
+
+
+def _attach_shared_arrays(specs):
+    for key, (name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=name)
+        _worker_arrays[key] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+
+def _worker_step_points(step):
+    # panes, uncovered copies and their DirectionIndex, built once per search step (the parent numbers the
+    # steps; step None is the full grid) and reused by all the slices this worker gets in that step
+    if _worker_points.get("step", ()) != step:
+        arrays = {key: array for key, (_, array) in _worker_arrays.items()}
+        uncovered = arrays["uncovered"] if step is not None else np.ones_like(arrays["uncovered"])
+        flat_index, column = uncovered_copies(arrays["owner"], uncovered)
+        points, q_len = arrays["points"][flat_index], arrays["q_len"][flat_index]
+        _worker_points.clear()
+        _worker_points.update(
+            step=step,
+            panes=PaneTable(
+                **{key: arrays[key] for key in pane_table_fields + ewald_fields + pixel_fields if key in arrays}
+            ),
+            points=points,
+            q_len=q_len,
+            column=column,
+            num_column=int(np.count_nonzero(uncovered)),
+            direction_index=DirectionIndex(points, q_len),
+        )
+    return _worker_points
+
+
+def _best_in_slice(task):
+    # (step, start, angles) -> (index of the first best candidate, its gain) over the currently uncovered points
+    step, start, angles = task
+    cached = _worker_step_points(step)
+    best, best_gain = -1, 0
+    for chunk_start, covered in covered_chunks(
+        cached["panes"],
+        cached["points"],
+        cached["q_len"],
+        cached["column"],
+        cached["num_column"],
+        angles,
+        cached["direction_index"],
+    ):
+        counts = np.count_nonzero(covered, axis=1)
+        if counts.size and counts.max() > best_gain:
+            best, best_gain = start + chunk_start + int(np.argmax(counts)), int(counts.max())
+    return best, best_gain
+
+
+def _masks_in_slice(task):
+    # (step, start, angles) -> (start, packed coverage of the angles over the full grid)
+    _, start, angles = task
+    cached = _worker_step_points(None)
+    num_grid_point = cached["num_column"]
+    bits = np.zeros((len(angles), (num_grid_point + 7) // 8), dtype=np.uint8)
+    for chunk_start, covered in covered_chunks(
+        cached["panes"],
+        cached["points"],
+        cached["q_len"],
+        cached["column"],
+        num_grid_point,
+        angles,
+        cached["direction_index"],
+    ):
+        bits[chunk_start : chunk_start + covered.shape[0]] = np.packbits(covered, axis=-1)
+    return start, bits
 
-    # Perform grid search
-    # print(list(angle_combinations))
-    # print(theta_list, chi_list, phi_list)
-    # print('angle_combinations: ',angle_combinations)
-    # print('angle_combinations: ',len(angle_combinations))
-    for angles in angle_combinations:
-        # print(angles)
-        # Rotate the detector
-        det_ins.rotate_detectors(angles)
-        current_coverage = np.logical_or(last_coverage, qgrids.get_coverage(det_ins))
-        covered_points_size = np.sum(current_coverage)
-        # print('covered_points_size',covered_points_size)
-        if covered_points_size > best_coverage:
-            best_coverage = covered_points_size
-            best_angles = angles
 
-    return best_angles
+class ParallelCoverageEvaluator:
+    """Process pool scoring candidate orientations on all cores
+
+    The flattened Q points and the unrotated pane tables are placed once in shared memory; so is the
+    uncovered-point mask, which the parent updates before every search. Workers score contiguous slices
+    of the candidates and return only their best (index, gain); the first best index wins, so results
+    are the same as the serial grid_search for any worker count. Every search is numbered and each worker
+    gathers the uncovered points and builds their DirectionIndex once per search, not once per slice.
+    masks() spreads orientation_masks over the pool the same way.
+    """
+
+    def __init__(self, det_ins: DetectorInstrument, qgrids: QGrids, num_workers=None, tasks_per_worker=4):
+        if det_ins.base_pane_table is None:
+            det_ins.initialize_detector()
+        self.det_ins = det_ins
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.tasks_per_worker = tasks_per_worker
+        self.step = 0
+        _, flat_points, q_len = qgrids.flat_points()
+        num_grid_point, owner = qgrids.point_owner()
+        self.num_grid_point = num_grid_point
+        arrays = det_ins.base_pane_table.arrays()
+        arrays.update(points=flat_points, q_len=q_len, owner=owner, uncovered=np.ones(num_grid_point, dtype=bool))
+
+        self._shared_memory = []
+        self.pool = None
+        try:
+            specs = {}
+            for key, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                self._shared_memory.append(shm)
+                shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+                shared[...] = array
+                specs[key] = (shm.name, array.shape, array.dtype.str)
+                if key == "uncovered":
+                    self.uncovered = shared
+            # spawn, not fork: the planner runs inside the (threaded) GUI server
+            self.pool = get_context("spawn").Pool(
+                self.num_workers, initializer=_attach_shared_arrays, initargs=(specs,)
+            )
+        except BaseException:
+            # segments created before the failure are unlinked, they would outlive the process in /dev/shm
+            self.close()
+            raise
+
+    def tasks(self, angles, step=None):
+        slice_size = max(1, -(-len(angles) // (self.num_workers * self.tasks_per_worker)))
+        return [(step, start, angles[start : start + slice_size]) for start in range(0, len(angles), slice_size)]
+
+    def best_angle(self, angles, coverage=None):
+        """(best angle, gain) over an (N, 3) array of candidates on top of the bool coverage mask"""
+        angles = np.atleast_2d(np.asarray(angles, dtype=float))
+        if isinstance(coverage, CoverageMask):
+            coverage = coverage.to_bool()
+        self.uncovered[...] = True if coverage is None else ~np.asarray(coverage, dtype=bool)
+        # a new step number makes the workers gather the new uncovered points
+        self.step += 1
+        tasks = self.tasks(angles, self.step)
+        best, best_gain = -1, 0
+        for idx, gain in self.pool.map(_best_in_slice, tasks):
+            if gain > best_gain:
+                best, best_gain = idx, gain
+        self.det_ins.num_coverage_evaluations += len(angles)
+        if best < 0:
+            return None, 0
+        return tuple(float(a) for a in angles[best]), best_gain
+
+    def masks(self, angles):
+        """Packed coverage masks over the full grid of an (N, 3) array of angles, as orientation_masks"""
+        angles = np.atleast_2d(np.asarray(angles, dtype=float))
+        masks = CoverageMask.zeros(self.num_grid_point, (len(angles),))
+        for start, bits in self.pool.map(_masks_in_slice, self.tasks(angles)):
+            masks.bits[start : start + len(bits)] = bits
+        self.det_ins.num_coverage_evaluations += len(angles)
+        return masks
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        for shm in self._shared_memory:
+            shm.close()
+            shm.unlink()
+        self._shared_memory = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def coverage_counts(det_ins: DetectorInstrument, qgrids: QGrids, angles, base_mask=None, working_set=None):
+    """Number of points each candidate orientation adds on top of base_mask, for an (N, 3) array of angles
+
+    Only the points outside base_mask are tested; pass working_set (UncoveredPoints of base_mask)
+    to reuse the gathered uncovered points across calls.
+    """
+    angles = np.atleast_2d(np.asarray(angles, dtype=float))
+    if working_set is None:
+        working_set = UncoveredPoints(qgrids, base_mask)
+    counts = np.zeros(len(angles), dtype=int)
+    for start, covered in orientation_coverages(det_ins, qgrids, angles, working_set):
+        counts[start : start + covered.shape[0]] = np.count_nonzero(covered, axis=1)
+    return counts
+
+
+def orientation_masks(det_ins: DetectorInstrument, qgrids: QGrids, angles, working_set=None):
+    """Packed coverage masks over the full grid for an (N, 3) array of angles, as one batched CoverageMask
+
+    With a working set only its points are tested; points outside it are left unset.
+    """
+    angles = np.atleast_2d(np.asarray(angles, dtype=float))
+    num_grid_point = qgrids.point_owner()[0]
+    masks = CoverageMask.zeros(num_grid_point, (len(angles),))
+    for start, covered in orientation_coverages(det_ins, qgrids, angles, working_set):
+        if working_set is not None:
+            covered_full = np.zeros((covered.shape[0], num_grid_point), dtype=bool)
+            covered_full[:, working_set.index] = covered
+            covered = covered_full
+        masks.bits[start : start + covered.shape[0]] = np.packbits(covered, axis=-1)
+    return masks
+
+
+def orientation_multiplicities(det_ins: DetectorInstrument, qgrids: QGrids, angles):
+    """(N, num_grid_point) uint8 multiplicity of every grid point for each of an (N, 3) array of angles
+
+    Multiplicity counts the symmetry copies (and panes) measuring a point, from the same kernel pass as
+    the coverage; coverage is multiplicity > 0.
+    """
+    angles = np.atleast_2d(np.asarray(angles, dtype=float))
+    multiplicities = np.zeros((len(angles), qgrids.point_owner()[0]), dtype=np.uint8)
+    for start, counts in orientation_coverages(det_ins, qgrids, angles, count_hits=True):
+        multiplicities[start : start + counts.shape[0]] = counts
+    return multiplicities
+
+
+def add_multiplicity(multiplicity, counts):
+    """Saturating uint8 sum, counts broadcast against multiplicity"""
+    return np.minimum(multiplicity.astype(np.int32) + counts, 255).astype(np.uint8)
+
+
+def multiplicity_by_shell(qgrids: QGrids, multiplicity, num_shell=10, min_multiplicity=1):
+    """Resolution-shell statistics of a per-point multiplicity
+
+    Shells hold equal numbers of grid points ordered by d-spacing (d = 1 / |q|). Returns a dict of arrays:
+    d_min, d_max (shell bounds), mean multiplicity and the fraction of points with multiplicity >= min_multiplicity.
+    """
+    num_grid_point, owner = qgrids.point_owner()
+    _, _, q_len = qgrids.flat_points()
+    # symmetry copies share |q|, any copy gives the point's d-spacing
+    column_q_len = np.zeros(num_grid_point)
+    column_q_len[owner] = q_len
+    d_spacing = np.divide(1.0, column_q_len, out=np.full(num_grid_point, np.inf), where=column_q_len > 0)
+    order = np.argsort(d_spacing)
+    shells = np.array_split(order, min(num_shell, max(num_grid_point, 1)))
+    multiplicity = np.asarray(multiplicity)
+    return {
+        "d_min": np.array([d_spacing[shell].min() for shell in shells]),
+        "d_max": np.array([d_spacing[shell].max() for shell in shells]),
+        "mean": np.array([multiplicity[shell].mean() for shell in shells]),
+        "complete": np.array([np.mean(multiplicity[shell] >= min_multiplicity) for shell in shells]),
+    }
+
+
+coverage_cache_dir = os.environ.get(
+    "EXPHUB_COVERAGE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "exphub", "coverage")
+)
+
+
+def coverage_cache_key(det_ins: DetectorInstrument, qgrids: QGrids, angles):
+    """Hash of everything the lattice coverage depends on
+
+    The pane vertices and TOF ranges give the instrument; the flattened Q points are the hkl grid taken
+    through the UB and every symmetry operator, so with the point owners they stand for UB, point group and
+    grid parameters. engine_version invalidates the bitmaps of an older coverage kernel.
+    """
+    digest = hashlib.sha256()
+    digest.update(engine_version.encode())
+    digest.update(det_ins.coverage_model.encode())
+    if det_ins.coverage_model == "pixel":
+        for array in (det_ins.pixel_lookup.pixel, det_ins.pixel_lookup.l2, det_ins.pixel_lookup.bank):
+            digest.update(np.ascontiguousarray(array).tobytes())
+    for detector_parameters in det_ins.detector_parameters_list:
+        pane_parameter = detector_parameters["pane_parameter"]
+        digest.update(np.asarray(pane_parameter["vertices"], dtype=float).tobytes())
+        digest.update(np.asarray([pane_parameter["t_min"], pane_parameter["t_max"]], dtype=float).tobytes())
+    _, flat_points, _ = qgrids.flat_points()
+    num_grid_point, owner = qgrids.point_owner()
+    digest.update(np.asarray(num_grid_point, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(owner, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(flat_points, dtype=float).tobytes())
+    digest.update(np.ascontiguousarray(angles, dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+class CoverageCache:
+    """Persistent cache of packed lattice coverage, one memory-mapped .npy bitmap per coverage_cache_key
+
+    Files are (num_angles, ceil(num_points / 8)) uint8 rows as in CoverageMask.bits. Reads refresh the file
+    time and the least recently used files are deleted once the directory grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=2**30):
+        self.cache_dir = cache_dir or coverage_cache_dir
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def load(self, key, num_grid_point):
+        path = self.path(key)
+        try:
+            bits = np.load(path, mmap_mode="r")
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return CoverageMask(bits, num_grid_point)
+
+    def store(self, key, masks: CoverageMask):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # written next to the target and renamed, readers never see a partial file
+        tmp_path = self.path(key) + ".{}.tmp".format(os.getpid())
+        with open(tmp_path, "wb") as cache_file:
+            np.save(cache_file, masks.bits)
+        os.replace(tmp_path, self.path(key))
+        self.evict(keep=self.path(key))
+
+    def evict(self, keep=None):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith(".npy") and path != keep:
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries) + (os.path.getsize(keep) if keep else 0)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def orientation_masks(self, det_ins: DetectorInstrument, qgrids: QGrids, angles, evaluator=None):
+        """orientation_masks over the full grid, read from the cache or computed (on the evaluator's pool when
+        given) and stored"""
+        angles = np.atleast_2d(np.asarray(angles, dtype=float))
+        key = coverage_cache_key(det_ins, qgrids, angles)
+        num_grid_point = qgrids.point_owner()[0]
+        masks = self.load(key, num_grid_point)
+        if masks is None or masks.bits.shape[0] != len(angles):
+            masks = evaluator.masks(angles) if evaluator is not None else orientation_masks(det_ins, qgrids, angles)
+            self.store(key, masks)
+        return masks
+
+
+class OrientationMaskCache:
+    """In-memory LRU cache of orientation -> packed coverage over the full grid, shared by the searches of a session
+
+    Angles are wrapped to [0, 360) and quantized to angle_resolution degrees, so the same lattice angle reached
+    through different arithmetic (or a full turn away) is one entry. Entries cover the full grid and stay valid as
+    the plan grows; gains against the current coverage are popcounts, over the bytes of the working set only
+    when one is given. The least recently used masks are dropped once they take more than max_bytes. hits and
+    misses count lookups of single orientations. Nothing creates one implicitly: callers that want the sharing
+    pass it to AnglePlanner (or optimize_angle_with_fixed_given) as mask_cache.
+    """
+
+    def __init__(self, det_ins: DetectorInstrument, qgrids: QGrids, max_bytes=2**28, angle_resolution=0.01):
+        self.det_ins = det_ins
+        self.qgrids = qgrids
+        self.num_grid_point = qgrids.point_owner()[0]
+        self.max_bytes = max_bytes
+        self.angle_resolution = angle_resolution
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def entry_bytes(self):
+        return (self.num_grid_point + 7) // 8
+
+    @property
+    def capacity(self):
+        """Number of masks that fit in max_bytes"""
+        return self.max_bytes // self.entry_bytes
+
+    @property
+    def hit_rate(self):
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def keys(self, angles):
+        turn = int(round(360 / self.angle_resolution))
+        quantized = np.mod(np.rint(np.asarray(angles) / self.angle_resolution).astype(np.int64), turn)
+        return [tuple(key) for key in quantized.tolist()]
+
+    def masks(self, angles, evaluator=None):
+        """Batched CoverageMask of an (N, 3) array of angles; the missing ones are evaluated in one batch
+
+        evaluator: optional ParallelCoverageEvaluator of the same instrument and grid for that batch
+        """
+        return CoverageMask(self.packed_rows(angles, evaluator), self.num_grid_point)
+
+    def packed_rows(self, angles, evaluator=None, columns=None):
+        # (N, nbyte) bits of the masks, only the bytes in columns when given
+        angles = np.atleast_2d(np.asarray(angles, dtype=float))
+        if columns is None:
+            columns = slice(None)
+        bits = np.empty((len(angles), np.arange(self.entry_bytes)[columns].size), dtype=np.uint8)
+        missing = {}
+        for row, key in enumerate(self.keys(angles)):
+            entry = self.entries.get(key)
+            if entry is None:
+                missing.setdefault(key, []).append(row)
+                continue
+            self.entries.move_to_end(key)
+            bits[row] = entry[columns]
+            self.hits += 1
+        if missing:
+            rows = list(missing.values())
+            missing_angles = angles[[row[0] for row in rows]]
+            if evaluator is not None:
+                computed = evaluator.masks(missing_angles)
+            else:
+                computed = orientation_masks(self.det_ins, self.qgrids, missing_angles)
+            self.misses += len(rows)
+            self.hits += sum(len(row) - 1 for row in rows)
+            for key, row, entry in zip(missing, rows, computed.bits):
+                bits[row] = entry[columns]
+                self.store(key, entry)
+        return bits
+
+    def store(self, key, entry):
+        if self.capacity == 0:
+            return
+        self.entries[key] = entry
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def gains(self, coverage: CoverageMask, angles, working_set=None):
+        """Number of points each orientation adds on top of coverage, as coverage_counts
+
+        With working_set (UncoveredPoints of coverage) only the bytes holding its points are read.
+        """
+        if working_set is None:
+            return coverage.gain(self.masks(angles))
+        columns = working_set.packed_index()
+        bits = self.packed_rows(angles, columns=columns)
+        return np.sum(popcount_table[bits & ~coverage.bits[columns]], axis=-1, dtype=np.int64)
+
+
+@dataclass
+class PlanStep:
+    """One accepted orientation of an AnglePlanner run
+
+    coverage: cumulative covered fraction of the grid, gain: grid points newly covered by this angle,
+    elapsed: seconds since the planner started (setup included).
+    """
+
+    step: int
+    angle: tuple
+    coverage: float
+    gain: int
+    elapsed: float
+
+
+class AnglePlanner:
+    """Anytime greedy planner: iterating yields a PlanStep after every accepted orientation
+
+    angle_list and current_coverage always describe the plan so far, so a consumer can stop at any step
+    (e.g. once the coverage curve flattens) and keep a usable plan. The run ends on its own at max_coverage,
+    after max_step angles or when no candidate adds coverage.
+    strategy: 'ascend' grid_ascend from the last angle (the default, the original search), 'grid' exhaustive
+    batched search, 'adaptive' first good-enough candidate, 'lazy' lazy-greedy (CELF) over the same lattice
+    as 'grid', 'smooth' quasi-Newton on a smooth surrogate (SmoothSearch); 'grid' and 'lazy' pick the best
+    lattice angle every step and cost a scan of the lattice (once for 'lazy')
+    num_workers > 1 runs the 'grid' search, and the lattice masks of the 'lazy' search, on a process pool (same
+    plan as the serial search)
+    coverage_cache: CoverageCache reused by the 'lazy' search for the lattice masks
+    mask_cache: optional OrientationMaskCache of det_ins and grids shared by the coverage searches (and by
+    other planners given the same cache); without one every search counts on the working set
+    objective: 'coverage' (points measured at least once) or 'multiplicity' (points measured at least
+    min_multiplicity times, searched by MultiplicitySearch for the 'grid' and 'lazy' strategies); PlanStep.coverage
+    and max_coverage then refer to that fraction, and multiplicity holds the uint8 count per point (None for
+    'coverage', whose accepted angles are only tested on the working set).
+    """
+
+    def __init__(
+        self,
+        grids: QGrids,
+        det_ins: DetectorInstrument,
+        fixed_angle_list,
+        euler_angle_ranges,
+        strategy="ascend",
+        num_workers=1,
+        coverage_cache=None,
+        max_coverage=0.9,
+        max_step=200,
+        objective="coverage",
+        min_multiplicity=2,
+        mask_cache=None,
+    ):
+        if objective not in ("coverage", "multiplicity"):
+            raise ValueError("{} objective not supported".format(objective))
+        if objective == "multiplicity" and strategy not in ("grid", "lazy"):
+            raise ValueError("{} strategy not supported for the multiplicity objective".format(strategy))
+        self.grids = grids
+        self.det_ins = det_ins
+        self.euler_angle_ranges = euler_angle_ranges
+        self.strategy = strategy
+        self.num_workers = num_workers
+        self.coverage_cache = coverage_cache
+        self.max_coverage = max_coverage
+        self.max_step = max_step
+        self.objective = objective
+        self.min_multiplicity = min_multiplicity
+        if mask_cache is not None and (mask_cache.det_ins is not det_ins or mask_cache.qgrids is not grids):
+            raise ValueError("mask cache of another instrument or grid not supported")
+        self.mask_cache = mask_cache
+        self.angle_list = list(fixed_angle_list).copy()
+        if len(self.angle_list) == 0:
+            self.angle_list = [(0, 0, 0)]
+        self.angle_list.append([10, 135, 0])
+        self.current_coverage = None
+        self.multiplicity = None
+
+    def objective_count(self, coverage_num):
+        if self.objective == "multiplicity":
+            return int(np.count_nonzero(self.multiplicity >= self.min_multiplicity))
+        return coverage_num
+
+    def __iter__(self):
+        det_ins, grids, euler_angle_ranges = self.det_ins, self.grids, self.euler_angle_ranges
+        angle_list = self.angle_list
+        start_time = time.perf_counter()
+        step = 0
+
+        ########## given angle rotations, evaluated in one batch #############
+        num_grid_point = grids.point_owner()[0]
+        if self.objective == "multiplicity":
+            # hit counts and coverage (count > 0) come from the same kernel pass
+            self.multiplicity = np.zeros(num_grid_point, dtype=np.uint8)
+            for _, counts in orientation_coverages(det_ins, grids, angle_list, count_hits=True):
+                self.multiplicity = add_multiplicity(self.multiplicity, counts.sum(axis=0))
+            coverage_mask = CoverageMask.from_bool(self.multiplicity > 0)
+        else:
+            coverage_mask = CoverageMask.zeros(num_grid_point)
+            for _, covered in orientation_coverages(det_ins, grids, angle_list):
+                coverage_mask |= CoverageMask.from_bool(np.any(covered, axis=0))
+        current_coverage = coverage_mask.to_bool()
+        self.current_coverage = current_coverage
+        current_coverage_num = coverage_mask.count()
+        new_coverage_num = current_coverage_num
+        objective_num = self.objective_count(current_coverage_num)
+        # only the still-uncovered points (all symmetry copies) are tested from here on
+        working_set = UncoveredPoints(grids, current_coverage)
+        num_evaluations_start = det_ins.num_coverage_evaluations
+        mask_cache = self.mask_cache
+        lazy_search = None
+        if self.objective == "multiplicity":
+            lazy_search = MultiplicitySearch(det_ins, grids, euler_angle_ranges, self.min_multiplicity)
+        elif self.strategy == "lazy":
+            # the lattice masks are computed once, the pool is only needed for that
+            lazy_evaluator = None
+            if self.num_workers > 1:
+                lazy_evaluator = ParallelCoverageEvaluator(det_ins, grids, self.num_workers)
+            try:
+                lazy_search = LazyGreedySearch(
+                    det_ins, grids, euler_angle_ranges, working_set, self.coverage_cache, mask_cache, lazy_evaluator
+                )
+            finally:
+                if lazy_evaluator is not None:
+                    lazy_evaluator.close()
+        smooth_search = None
+        if self.strategy == "smooth":
+            smooth_search = SmoothSearch(det_ins, grids, euler_angle_ranges, working_set, mask_cache=mask_cache)
+        evaluator = None
+        if self.strategy == "grid" and self.num_workers > 1 and self.objective == "coverage":
+            evaluator = ParallelCoverageEvaluator(det_ins, grids, self.num_workers)
+
+        # print('initial coverage: ',np.sum(current_coverage)*100/np.size(current_coverage),'%','max covarange:',max_coverage)
+        ########## nst angle rotation#############
+        strategy_methods = {
+            "grid": lambda: grid_search(
+                det_ins, grids, euler_angle_ranges, current_coverage, working_set, evaluator, mask_cache
+            ),
+            "adaptive": lambda: grid_search_adaptive(
+                det_ins,
+                grids,
+                euler_angle_ranges,
+                current_coverage,
+                new_coverage_num,
+                working_set=working_set,
+                mask_cache=mask_cache,
+            ),
+            "ascend": lambda: grid_ascend(
+                det_ins, grids, euler_angle_ranges, current_coverage, angle_list[-1], working_set, mask_cache
+            ),
+            "lazy": lambda: lazy_search.next_angle(coverage_mask),
+            "smooth": lambda: smooth_search.next_angle(angle_list[-1], coverage_mask),
+        }
+        if self.strategy not in strategy_methods:
+            raise ValueError("{} strategy not supported".format(self.strategy))
+        search_new_angle = strategy_methods[self.strategy]
+        if self.objective == "multiplicity":
+            search_new_angle = lambda: lazy_search.next_angle(self.multiplicity)  # noqa: E731
+
+        try:
+            while objective_num < num_grid_point * self.max_coverage and step < self.max_step:
+                step += 1
+
+                new_angle = search_new_angle()
+                if new_angle is None:
+                    print("Max coverage reached, stopping")
+                    break
+
+                ########## nst angle rotation#############
+                last_objective_num = objective_num
+                if self.objective == "multiplicity":
+                    # hit counts need the whole grid, coverage is count > 0 on the working set
+                    counts = orientation_multiplicities(det_ins, grids, [new_angle])[0]
+                    self.multiplicity = add_multiplicity(self.multiplicity, counts)
+                    newly_covered = (counts > 0)[working_set.index]
+                else:
+                    _, newly_covered = next(orientation_coverages(det_ins, grids, [new_angle], working_set))
+                    newly_covered = newly_covered[0]
+                coverage_mask |= CoverageMask.from_indices(working_set.index[newly_covered], num_grid_point)
+                current_coverage[working_set.index[newly_covered]] = True
+                working_set.update(newly_covered)
+                current_coverage_num = coverage_mask.count()
+                objective_num = self.objective_count(current_coverage_num)
+                new_coverage_num = objective_num - last_objective_num
+
+                print(r"current coverage: f%\%", current_coverage_num * 100.0 / num_grid_point)
+                angle_list.append(new_angle)
+                print("angle", angle_list)
+                yield PlanStep(
+                    step,
+                    new_angle,
+                    objective_num / num_grid_point,
+                    int(new_coverage_num),
+                    time.perf_counter() - start_time,
+                )
+        finally:
+            # also runs when the consumer stops iterating early
+            if evaluator is not None:
+                evaluator.close()
+            print("final covrage", current_coverage_num)
+            print("coverage evaluations", det_ins.num_coverage_evaluations - num_evaluations_start)
+            if mask_cache is not None:
+                print("mask cache hits", mask_cache.hits, "misses", mask_cache.misses)
+            if lazy_search is not None:
+                print("lazy gain re-evaluations", lazy_search.num_evaluations - lazy_search.num_candidates)
+            if smooth_search is not None:
+                print("surrogate evaluations", smooth_search.num_evaluations)
+            print("final angle", angle_list)
+
+
+def optimize_angle_with_fixed_given(
+    grids: QGrids,
+    det_ins: DetectorInstrument,
+    fixed_angle_list,
+    euler_angle_ranges,
+    strategy="ascend",
+    num_workers=1,
+    coverage_cache=None,
+    progress=None,
+    cancel=None,
+    objective="coverage",
+    min_multiplicity=2,
+    mask_cache=None,
+):
+    # runs an AnglePlanner to the end, see there for the strategies and objectives; strategy 'genetic' runs
+    # optimize_angle_genetic instead (whole-plan search, coverage objective only)
+    # progress(step, objective fraction, new angle) is called after every accepted angle
+    # cancel: Event-like, the search stops before the next step once cancel.is_set()
+    if strategy == "genetic":
+        if objective != "coverage":
+            raise ValueError("{} objective not supported for the genetic strategy".format(objective))
+        return optimize_angle_genetic(
+            grids,
+            det_ins,
+            fixed_angle_list,
+            euler_angle_ranges,
+            num_workers=num_workers,
+            mask_cache=mask_cache,
+            progress=progress,
+            cancel=cancel,
+        )
+    planner = AnglePlanner(
+        grids,
+        det_ins,
+        fixed_angle_list,
+        euler_angle_ranges,
+        strategy,
+        num_workers,
+        coverage_cache,
+        objective=objective,
+        min_multiplicity=min_multiplicity,
+        mask_cache=mask_cache,
+    )
+    plan_steps = iter(planner)
+    while cancel is None or not cancel.is_set():
+        plan_step = next(plan_steps, None)
+        if plan_step is None:
+            break
+        if progress is not None:
+            progress(plan_step.step, plan_step.coverage, plan_step.angle)
+    else:
+        print("Optimization cancelled")
+        plan_steps.close()
+    return planner.angle_list, planner.current_coverage
+
+
+def cached_counts(mask_cache, qgrids, angles, last_coverage, working_set=None):
+    # gains from an OrientationMaskCache when all the angles fit in it, None otherwise (the lattice would
+    # evict itself every step); counted on the bytes of the working set
+    if mask_cache is None or len(angles) > mask_cache.capacity:
+        return None
+    if last_coverage is None:
+        coverage = CoverageMask.zeros(qgrids.point_owner()[0])
+    else:
+        coverage = CoverageMask.from_bool(last_coverage)
+    return mask_cache.gains(coverage, angles, working_set)
+
+
+def grid_search(det_ins, qgrids, euler_angle_ranges, last_coverage, working_set=None, evaluator=None, mask_cache=None):
+    print("searching for new angle")
+    # all candidates of the lattice are scored in batches, the first one with the largest gain wins
+    angle_combinations = euler_angle_lattice(euler_angle_ranges)
+    if len(angle_combinations) == 0:
+        return None
+    if evaluator is not None:
+        # ParallelCoverageEvaluator: the same search spread over a process pool
+        return evaluator.best_angle(angle_combinations, last_coverage)[0]
+    new_coverage_num = cached_counts(mask_cache, qgrids, angle_combinations, last_coverage, working_set)
+    if new_coverage_num is None:
+        new_coverage_num = coverage_counts(det_ins, qgrids, angle_combinations, last_coverage, working_set)
+    best_idx = np.argmax(new_coverage_num)
+    if new_coverage_num[best_idx] <= 0:
+        return None
+    return tuple(float(i) for i in angle_combinations[best_idx])
 
 
 # little improvement
+class LazyGreedySearch:
+    """Lazy-greedy (CELF) selection over the euler angle lattice
+
+    Coverage is submodular, so a candidate's gain can only shrink as the plan grows: candidates sit in a
+    max-heap keyed by their last known gain and only the top one is re-evaluated until it stays on top.
+    Each candidate's coverage is evaluated once, as a packed mask; re-evaluations are popcounts against
+    the current coverage. Picks (and ties) are the same as grid_search.
+    With a CoverageCache the lattice masks come from disk and the search is only bitmap arithmetic; an
+    OrientationMaskCache shares them with the other searches of the session. The masks that have to be
+    computed are spread over the evaluator's pool when one is given.
+    """
+
+    def __init__(
+        self,
+        det_ins: DetectorInstrument,
+        qgrids: QGrids,
+        euler_angle_ranges,
+        working_set=None,
+        coverage_cache=None,
+        mask_cache=None,
+        evaluator=None,
+    ):
+        self.angles = euler_angle_lattice(euler_angle_ranges)
+        if coverage_cache is not None:
+            self.masks = coverage_cache.orientation_masks(det_ins, qgrids, self.angles, evaluator)
+        elif mask_cache is not None:
+            self.masks = mask_cache.masks(self.angles, evaluator)
+        elif evaluator is not None:
+            self.masks = evaluator.masks(self.angles)
+        else:
+            self.masks = orientation_masks(det_ins, qgrids, self.angles, working_set)
+        self.num_candidates = len(self.angles)
+        # gains are first counted against the empty plan, every pop re-evaluates against the real coverage
+        self.heap = [(-gain, idx, -1) for idx, gain in enumerate(self.masks.count())]
+        heapq.heapify(self.heap)
+        self.step = 0
+        self.num_evaluations = self.num_candidates
+
+    def next_angle(self, coverage: CoverageMask):
+        self.step += 1
+        while self.heap:
+            neg_gain, idx, step = heapq.heappop(self.heap)
+            if step == self.step:
+                if -neg_gain <= 0:
+                    return None
+                return tuple(float(a) for a in self.angles[idx])
+            gain = coverage.gain(self.masks[idx])
+            self.num_evaluations += 1
+            heapq.heappush(self.heap, (-gain, idx, self.step))
+        return None
+
+
+class MultiplicitySearch:
+    """Lazy-greedy selection for the 'multiplicity' objective: points measured at least k times
+
+    The count of points with multiplicity >= k is not submodular (a second visit may be worth nothing until
+    the k-th), so candidates are ranked by the truncated sum of min(multiplicity, k) instead, which is, and
+    which reaches its maximum exactly when every point is measured k times. Only the gains are kept: the
+    lattice is scored chunk by chunk from orientation_coverages and a candidate's counts are recomputed when
+    the heap re-evaluates it.
+    """
+
+    def __init__(self, det_ins: DetectorInstrument, qgrids: QGrids, euler_angle_ranges, min_multiplicity):
+        self.det_ins = det_ins
+        self.qgrids = qgrids
+        self.angles = euler_angle_lattice(euler_angle_ranges)
+        self.min_multiplicity = min_multiplicity
+        self.num_candidates = len(self.angles)
+        gains = np.zeros(self.num_candidates, dtype=np.int64)
+        for start, counts in orientation_coverages(det_ins, qgrids, self.angles, count_hits=True):
+            gains[start : start + counts.shape[0]] = np.minimum(counts, min_multiplicity).sum(axis=1, dtype=np.int64)
+        self.heap = [(-int(gain), idx, -1) for idx, gain in enumerate(gains)]
+        heapq.heapify(self.heap)
+        self.step = 0
+        self.num_evaluations = self.num_candidates
+
+    def gain(self, multiplicity, idx):
+        counts = orientation_multiplicities(self.det_ins, self.qgrids, self.angles[idx])[0]
+        missing = self.min_multiplicity - np.minimum(multiplicity, self.min_multiplicity)
+        return int(np.minimum(counts, missing).sum(dtype=np.int64))
+
+    def next_angle(self, multiplicity):
+        self.step += 1
+        while self.heap:
+            neg_gain, idx, step = heapq.heappop(self.heap)
+            if step == self.step:
+                if -neg_gain <= 0:
+                    return None
+                return tuple(float(a) for a in self.angles[idx])
+            gain = self.gain(multiplicity, idx)
+            self.num_evaluations += 1
+            heapq.heappush(self.heap, (-gain, idx, self.step))
+        return None
+
+
 def grid_search_adaptive_fromlast(
     det_ins, qgrids, euler_angle_ranges, last_coverage, last_newcoverage, last_angle_idx, angle_combinations
 ):
@@ -619,11 +2350,10 @@ def grid_search_adaptive_fromlast(
     # print('angle_combinations: ',len(angle_combinations))
     for i in range(len(angle_combinations)):
         # print(angles)
-        # Rotate the detector
+        # coverage with the fixed panes turned into the candidate orientation
         idx = last_angle_idx + i - int(np.floor(i / len(angle_combinations))) * len(angle_combinations)
         angles = angle_combinations[idx]
-        det_ins.rotate_detectors(angles)
-        current_coverage = np.logical_or(last_coverage, qgrids.get_coverage(det_ins))
+        current_coverage = np.logical_or(last_coverage, qgrids.get_coverage(det_ins, euler_angles=angles))
         covered_points_size = np.sum(current_coverage)
         # print('covered_points_size',covered_points_size)
         if covered_points_size > best_coverage:
@@ -635,49 +2365,45 @@ def grid_search_adaptive_fromlast(
 
 
 ## 100% speed improvement
-def grid_search_adaptive(det_ins, qgrids, euler_angle_ranges, last_coverage, last_newcoverage):
+def grid_search_adaptive(
+    det_ins,
+    qgrids,
+    euler_angle_ranges,
+    last_coverage,
+    last_newcoverage,
+    block_size=64,
+    working_set=None,
+    mask_cache=None,
+):
     print("searching for new angle")
-    # Define ranges for each Euler angle
-    # euler_angle_range=[[0,180,0.5],[135,135,0.5],[0,360,0.5]]
-    # print(euler_angle_ranges)
-    theta_range, chi_range, phi_range = euler_angle_ranges
-    # Discretize the ranges into a grid
-    theta_list = np.linspace(
-        theta_range[0], theta_range[1], int((theta_range[1] - theta_range[0]) / theta_range[2] + 1)
-    )
-    chi_list = np.linspace(chi_range[0], chi_range[1], int((chi_range[1] - chi_range[0]) / chi_range[2] + 1))
-    phi_list = np.linspace(phi_range[0], phi_range[1], int((phi_range[1] - phi_range[0]) / phi_range[2] + 1))
-
-    # Generate all combinations of Euler angles (grid search)
-    # angle_combinations = np.meshgrid(pitch_values, yaw_values, roll_values)
-
-    angle_combinations = product(theta_list, chi_list, phi_list)
-    # angle_combinations = product(theta_list, chi_list, phi_list)
-
-    best_coverage = np.sum(last_coverage)
+    # candidates are scored block by block in lattice order; the first candidate adding at least as many
+    # points as the previous step stops the search, otherwise the best candidate seen is returned
+    angle_combinations = euler_angle_lattice(euler_angle_ranges)
+    if working_set is None:
+        working_set = UncoveredPoints(qgrids, last_coverage)
+    best_coverage_num = 0
     best_angles = None
-
-    # Perform grid search
-    # print(list(angle_combinations))
-    # print(theta_list, chi_list, phi_list)
-    # print('angle_combinations: ',angle_combinations)
-    # print('angle_combinations: ',len(angle_combinations))
-    for angles in angle_combinations:
-        # print(angles)
-        # Rotate the detector
-        det_ins.rotate_detectors(angles)
-        current_coverage = np.logical_or(last_coverage, qgrids.get_coverage(det_ins))
-        covered_points_size = np.sum(current_coverage)
-        # print('covered_points_size',covered_points_size)
-        if covered_points_size > best_coverage:
-            best_coverage = covered_points_size
-            best_angles = angles
-            if covered_points_size - np.sum(last_coverage) >= last_newcoverage:
-                break
+    for start in range(0, len(angle_combinations), block_size):
+        block = angle_combinations[start : start + block_size]
+        new_coverage_num = cached_counts(mask_cache, qgrids, block, last_coverage, working_set)
+        if new_coverage_num is None:
+            new_coverage_num = coverage_counts(det_ins, qgrids, block, last_coverage, working_set)
+        good_enough = np.nonzero(new_coverage_num >= max(last_newcoverage, 1))[0]
+        if good_enough.size > 0:
+            return tuple(float(i) for i in block[good_enough[0]])
+        if np.max(new_coverage_num) > best_coverage_num:
+            best_coverage_num = np.max(new_coverage_num)
+            best_angles = tuple(float(i) for i in block[np.argmax(new_coverage_num)])
     return best_angles
 
 
-def grid_ascend(det_ins, qgrids, euler_angle_ranges, last_coverage, last_angles):
+def grid_ascend(det_ins, qgrids, euler_angle_ranges, last_coverage, last_angles, working_set=None, mask_cache=None):
+    if working_set is None:
+        working_set = UncoveredPoints(qgrids, last_coverage)
+    last_coverage_num = np.sum(last_coverage)
+    # the finite differences evaluate the same angles over and over, the mask cache answers the repeats
+    last_coverage_mask = CoverageMask.from_bool(last_coverage) if mask_cache is not None else None
+
     def renormalize_anlge(x, y, z, euler_angle_ranges):
         theta_min, theta_max, d_theta = euler_angle_ranges[0]
         chi_min, chi_max, d_chi = euler_angle_ranges[1]
@@ -705,9 +2431,9 @@ def grid_ascend(det_ins, qgrids, euler_angle_ranges, last_coverage, last_angles)
     def function_on_grid(x, y, z):
         theta, chi, phi = renormalize_anlge(x, y, z, euler_angle_ranges)
         angles = [theta, chi, phi]
-        det_ins.rotate_detectors(angles)
-        current_coverage = np.logical_or(last_coverage, qgrids.get_coverage(det_ins))
-        covered_points_size = np.sum(current_coverage)
+        if mask_cache is not None:
+            return last_coverage_num + mask_cache.gains(last_coverage_mask, [angles], working_set)[0]
+        covered_points_size = last_coverage_num + coverage_counts(det_ins, qgrids, [angles], working_set=working_set)[0]
         # print(angles,covered_points_size,np.sum(last_coverage))
         return covered_points_size
 
@@ -761,6 +2487,164 @@ def grid_ascend(det_ins, qgrids, euler_angle_ranges, last_coverage, last_angles)
     return [float(i) for i in best_angles]
 
 
+class SmoothCoverage:
+    """Smooth surrogate of the number of uncovered grid points an orientation adds, with its analytic gradient
+
+    A copy q is inside a pane with weight prod_f sigmoid(margin_f / temperature), margin_f = d_f - n_f.(R^T q)
+    being the signed distance (A^-1) to face f, positive inside; weights of all copies and panes add up to S
+    per grid point and the surrogate is sum(1 - exp(-S)). The gradient in (phi, chi, omega) comes from
+    dR/dangle in the same vectorized pass. Uses the hexahedron faces whatever the coverage model, the exact
+    gain of the result is checked by the caller.
+    """
+
+    def __init__(self, det_ins: DetectorInstrument, working_set, temperature=0.1):
+        if det_ins.base_pane_table is None:
+            det_ins.initialize_detector()
+        self.panes = det_ins.base_pane_table
+        self.points, self.q_len, self.column = working_set.points, working_set.q_len, working_set.column
+        self.num_point = working_set.size
+        self.temperature = temperature
+        self.num_evaluations = 0
+
+    def value_and_gradient(self, euler_angles):
+        self.num_evaluations += 1
+        panes, temperature = self.panes, self.temperature
+        rotation = euler_rotation_matrix(euler_angles)
+        derivatives = euler_rotation_derivatives(euler_angles)
+        num_pane, num_face = panes.offsets.shape
+        # cone angle widened so copies a few temperatures outside a pane still pull on it
+        cone_angle = np.arccos(np.clip(panes.cone_cos, -1, 1))
+        weight = np.zeros(self.num_point)
+        weight_gradient = np.zeros((self.num_point, 3))
+        chunk = max(1, kernel_chunk_elements // max(num_pane * num_face * 3, 1))
+        for start in range(0, len(self.points), chunk):
+            points, q_len = self.points[start : start + chunk], self.q_len[start : start + chunk]
+            # R^T q of every copy and its derivative by each angle
+            v = points @ rotation
+            dv = np.einsum("kj,ijl->kil", points, derivatives)
+            q_len_col = np.maximum(q_len, zero_eps)[:, np.newaxis]
+            widen = np.minimum(4 * temperature / q_len_col, np.pi)
+            candidate = v @ panes.axes.T >= q_len_col * np.cos(np.minimum(cone_angle + widen, np.pi))
+            idx_point, idx_pane = np.nonzero(candidate)
+            margin = panes.offsets[idx_pane] - np.einsum("kj,kfj->kf", v[idx_point], panes.normals[idx_pane])
+            inside_of_face = 0.5 * (1 + np.tanh(margin / (2 * temperature)))
+            inside = np.prod(inside_of_face, axis=1)
+            # d inside / d margin_f = inside (1 - sigmoid_f) / temperature, d margin_f = -n_f.dv
+            margin_gradient = -np.einsum("kil,kfl->kfi", dv[idx_point], panes.normals[idx_pane])
+            inside_gradient = np.einsum("k,kf,kfi->ki", inside / temperature, 1 - inside_of_face, margin_gradient)
+            column = self.column[start + idx_point]
+            weight += np.bincount(column, weights=inside, minlength=self.num_point)
+            for i in range(3):
+                weight_gradient[:, i] += np.bincount(column, weights=inside_gradient[:, i], minlength=self.num_point)
+        uncovered = np.exp(-weight)
+        return float(np.sum(1 - uncovered)), uncovered @ weight_gradient
+
+
+def quasi_newton_ascent(value_and_gradient, x0, project=None, max_iter=20, tolerance=1e-3, first_step=5.0):
+    """BFGS maximization with a backtracking (Armijo) line search
+
+    project maps a point back into the feasible box; first_step is the length of the first move, in the
+    units of x. Returns the best x and its value.
+    """
+    if project is None:
+        project = np.asarray
+    x = project(np.asarray(x0, dtype=float))
+    value, gradient = value_and_gradient(x)
+    gradient_norm = np.linalg.norm(gradient)
+    if gradient_norm < tolerance:
+        return x, value
+    inverse_hessian = np.eye(len(x)) * first_step / gradient_norm
+    for _ in range(max_iter):
+        direction = inverse_hessian @ gradient
+        step = 1.0
+        while True:
+            x_new = project(x + step * direction)
+            value_new, gradient_new = value_and_gradient(x_new)
+            if value_new >= value + 1e-4 * gradient @ (x_new - x):
+                break
+            step *= 0.5
+            if step < 1e-3:
+                return x, value
+        # BFGS update of the inverse Hessian of -f
+        s, y = x_new - x, gradient - gradient_new
+        sy = s @ y
+        if sy > 1e-12:
+            rho = 1 / sy
+            identity = np.eye(len(x))
+            inverse_hessian = (identity - rho * np.outer(s, y)) @ inverse_hessian @ (
+                identity - rho * np.outer(y, s)
+            ) + rho * np.outer(s, s)
+        x, value, gradient = x_new, value_new, gradient_new
+        if np.linalg.norm(s) < tolerance or np.linalg.norm(gradient) < tolerance:
+            break
+    return x, value
+
+
+class SmoothSearch:
+    """Quasi-Newton ascent of the SmoothCoverage surrogate from a few starts, for the 'smooth' strategy
+
+    Starts are the last accepted angle and num_starts random lattice angles; each converges in tens of
+    surrogate evaluations. The end points are scored exactly on the working set and the best is returned,
+    None when none of them adds a point. Axes whose range is a full turn wrap around, the others are
+    clipped, fixed axes (zero range) stay put. With a mask_cache and the current coverage the end points are
+    scored through the cache.
+    """
+
+    def __init__(
+        self,
+        det_ins: DetectorInstrument,
+        qgrids: QGrids,
+        euler_angle_ranges,
+        working_set,
+        num_starts=8,
+        temperature=0.1,
+        max_iter=20,
+        seed=0,
+        mask_cache=None,
+    ):
+        self.det_ins = det_ins
+        self.qgrids = qgrids
+        self.angles = euler_angle_lattice(euler_angle_ranges)
+        self.limits = np.array([axis_range[:2] for axis_range in euler_angle_ranges], dtype=float)
+        self.working_set = working_set
+        self.num_starts = num_starts
+        self.temperature = temperature
+        self.max_iter = max_iter
+        self.rng = np.random.default_rng(seed)
+        self.mask_cache = mask_cache
+        self.num_evaluations = 0
+
+    def project(self, x):
+        low, high = self.limits.T
+        full_turn = high - low >= 360 - zero_eps
+        return np.where(full_turn, low + np.mod(x - low, 360), np.clip(x, low, high))
+
+    def next_angle(self, last_angle, coverage: CoverageMask = None):
+        if self.working_set.size == 0 or len(self.angles) == 0:
+            return None
+        surrogate = SmoothCoverage(self.det_ins, self.working_set, self.temperature)
+        free = self.limits[:, 1] - self.limits[:, 0] > zero_eps
+
+        def value_and_gradient(x):
+            value, gradient = surrogate.value_and_gradient(x)
+            return value, np.where(free, gradient, 0.0)
+
+        picks = self.rng.choice(len(self.angles), min(self.num_starts, len(self.angles)), replace=False)
+        starts = [np.asarray(last_angle, dtype=float)] + list(self.angles[picks])
+        candidates = [
+            quasi_newton_ascent(value_and_gradient, start, self.project, self.max_iter)[0] for start in starts
+        ]
+        self.num_evaluations += surrogate.num_evaluations
+        if self.mask_cache is not None and coverage is not None:
+            gains = self.mask_cache.gains(coverage, candidates, self.working_set)
+        else:
+            gains = coverage_counts(self.det_ins, self.qgrids, candidates, working_set=self.working_set)
+        best = int(np.argmax(gains))
+        if gains[best] <= 0:
+            return None
+        return tuple(float(a) for a in candidates[best])
+
+
 def analyze_peaks(peaks, ub, det_ins, symmetry):
     # TODO symmetry
     # det_ins.sym_expand(symmetry)
@@ -822,117 +2706,217 @@ def analyze_peaks(peaks, ub, det_ins, symmetry):
 
 ##################
 # GA
+# whole plans evolve together: an individual is num_angles indices into a set of candidate orientations (the
+# euler angle lattice), so masks come from the session OrientationMaskCache and a plan's coverage is an OR of bitmaps
 
 
-'''
+def initialize_population(rng, population_size, num_candidates, num_angles, initial_plans=(), mutation_rate=0.1):
+    """(population_size, num_angles) candidate indices
 
-import random
-import numpy as np
-
-# Genetic Algorithm Functions
-def initialize_population(pop_size, euler_ranges, num_angles):
+    The initial plans (truncated, or padded at random) come first and the rest are mutated copies of them;
+    without initial plans the population is random.
     """
-    Initialize a population with random individuals (Euler angle sets).
-    """
-    population = []
-    for _ in range(pop_size):
-        individual = [random.uniform(*euler_ranges[0]),  # pitch
-                      random.uniform(*euler_ranges[1]),  # yaw
-                      random.uniform(*euler_ranges[2])]  # roll
-        population.append(individual)
+    population = rng.integers(num_candidates, size=(population_size, num_angles))
+    initial_plans = list(initial_plans)[:population_size]
+    for row, plan in enumerate(initial_plans):
+        plan = np.asarray(plan, dtype=int)[:num_angles]
+        population[row, : len(plan)] = plan
+    if initial_plans:
+        copies = population[np.arange(len(initial_plans), population_size) % len(initial_plans)]
+        population[len(initial_plans) :] = mutate(rng, copies, num_candidates, mutation_rate)
     return population
 
-def calculate_fitness(detector, grid, euler_angles):
-    """
-    Calculate the fitness of an individual by counting how many points are covered
-    by the detector after rotating by the given Euler angles.
-    """
-    detector.rotate_detector(euler_angles)
-    covered_points = sum(1 for point in grid.points if detector.is_covered(point))
-    return covered_points
 
-def tournament_selection(population, fitnesses, tournament_size=3):
-    """
-    Tournament selection to pick the best individuals based on fitness.
-    """
-    tournament = random.sample(list(zip(population, fitnesses)), tournament_size)
-    winner = max(tournament, key=lambda x: x[1])
-    return winner[0]
+def calculate_fitness(masks: CoverageMask, population, base: CoverageMask = None):
+    """Number of grid points covered by each plan, population indexing the rows of the batched masks"""
+    fitness = np.empty(len(population), dtype=np.int64)
+    chunk = max(1, kernel_chunk_elements // max(population.shape[1] * masks.bits.shape[-1], 1))
+    for start in range(0, len(population), chunk):
+        bits = np.bitwise_or.reduce(masks.bits[population[start : start + chunk]], axis=1)
+        if base is not None:
+            bits |= base.bits
+        fitness[start : start + chunk] = CoverageMask(bits, masks.size).count()
+    return fitness
 
-def crossover(parent1, parent2):
-    """
-    Single-point crossover between two parents to create an offspring.
-    """
-    crossover_point = random.randint(0, 2)  # We have 3 values for pitch, yaw, and roll
-    child = parent1[:crossover_point] + parent2[crossover_point:]
-    return child
 
-def mutate(individual, euler_ranges, mutation_rate=0.1):
-    """
-    Mutate an individual by randomly modifying one of its Euler angles.
-    """
-    if random.random() < mutation_rate:
-        mutation_index = random.randint(0, 2)
-        individual[mutation_index] = random.uniform(*euler_ranges[mutation_index])
+def tournament_selection(rng, fitness, num_selected, tournament_size=3):
+    """Indices of the winners of num_selected tournaments between random individuals"""
+    entrants = rng.integers(len(fitness), size=(num_selected, tournament_size))
+    return entrants[np.arange(num_selected), np.argmax(fitness[entrants], axis=1)]
 
-def genetic_algorithm(detector, grid, euler_ranges, pop_size=50, num_generations=100, mutation_rate=0.1):
-    """
-    Run the genetic algorithm to find the optimal Euler angles that maximize coverage.
-    """
-    # Initialize population
-    population = initialize_population(pop_size, euler_ranges, 3)
-
-    for generation in range(num_generations):
-        # Evaluate fitness for each individual
-        fitnesses = [calculate_fitness(detector, grid, individual) for individual in population]
-
-        # Selection and crossover
-        new_population = []
-        for _ in range(pop_size // 2):  # Create pairs of parents
-            parent1 = tournament_selection(population, fitnesses)
-            parent2 = tournament_selection(population, fitnesses)
-
-            # Create two children via crossover
-            child1 = crossover(parent1, parent2)
-            child2 = crossover(parent2, parent1)
-
-            # Mutate the children
-            mutate(child1, euler_ranges, mutation_rate)
-            mutate(child2, euler_ranges, mutation_rate)
-
-            # Add children to the new population
-            new_population.extend([child1, child2])
-
-        # Replace the old population with the new one
-        population = new_population
-
-        # Optional: Print the best fitness in each generation
-        best_fitness = max(fitnesses)
-        print(f"Generation {generation}: Best Coverage = {best_fitness}")
 
-    # Return the best individual
-    best_individual = max(zip(population, fitnesses), key=lambda x: x[1])[0]
-    return best_individual
-
-# Example usage:
-# Assume we have some points in QGrids and a DetectorInstrument instance
-points = np.random.rand(100, 3)  # 100 random 3D points as an example
-grid = QGrids(points)
-
-detector = DetectorInstrument("detector_model")  # Initialize with your actual detector model
-
-# Define the ranges for pitch, yaw, and roll (e.g., from 0 to 180 degrees for each angle)
-euler_ranges = ((0, 180), (0, 180), (0, 180))  # Pitch, Yaw, Roll ranges
+def crossover(rng, parents1, parents2):
+    """Uniform crossover, each orientation of a child comes from either parent (a plan is a set)"""
+    return np.where(rng.random(parents1.shape) < 0.5, parents1, parents2)
 
-# Run the genetic algorithm to find the optimal Euler angles
-best_angles = genetic_algorithm(detector, grid, euler_ranges)
 
-print("Optimal Euler Angles for Maximum Coverage:", best_angles)
+def mutate(rng, population, num_candidates, mutation_rate=0.1):
+    """Replace orientations by random candidates with probability mutation_rate, in place"""
+    mutated = rng.random(population.shape) < mutation_rate
+    population[mutated] = rng.integers(num_candidates, size=np.count_nonzero(mutated))
+    return population
 
 
+def greedy_order(masks: CoverageMask, base: CoverageMask):
+    """Order of the rows of masks adding the most points first, so every prefix of the plan is a good plan"""
+    coverage, remaining, order = base.copy(), list(range(len(masks))), []
+    while remaining:
+        pick = remaining.pop(int(np.argmax(coverage.gain(masks[remaining]))))
+        coverage |= masks[pick]
+        order.append(pick)
+    return order
+
+
+def genetic_algorithm(
+    det_ins: DetectorInstrument,
+    qgrids: QGrids,
+    candidates,
+    num_angles,
+    base_coverage=None,
+    initial_plans=(),
+    population_size=64,
+    num_generations=200,
+    mutation_rate=None,
+    tournament_size=3,
+    num_elite=2,
+    target=None,
+    stall_generations=30,
+    mask_cache=None,
+    evaluator=None,
+    seed=0,
+    cancel=None,
+):
+    """Evolve plans of num_angles orientations out of the (L, 3) candidates covering the most points on top
+    of base_coverage
+
+    initial_plans (lists of candidate indices) and their mutated copies make the first generation. Every
+    generation the orientations not in mask_cache are evaluated in one batch (on the evaluator's process
+    pool when given) and the whole population is scored by OR-ing and popcounting its masks. Elitism keeps
+    the num_elite best plans; the others are children of tournament winners, uniformly crossed over and
+    mutated with mutation_rate per orientation (1 / num_angles by default). Stops once the best plan
+    covers target points, after stall_generations without improvement or when cancel is set.
+    The work is bounded by population_size * num_generations plan scores; the defaults are sized for
+    interactive use (a fraction of a second per plan length on a 20k point grid and a 10 degree lattice),
+    offline library runs can raise them.
+    Returns the best plan as candidate indices in greedy order and the number of points it covers.
+    """
+    rng = np.random.default_rng(seed)
+    candidates = np.atleast_2d(np.asarray(candidates, dtype=float))
+    if mask_cache is None:
+        mask_cache = OrientationMaskCache(det_ins, qgrids)
+    base = CoverageMask.zeros(mask_cache.num_grid_point)
+    if base_coverage is not None:
+        base = CoverageMask.from_bool(base_coverage)
+    if mutation_rate is None:
+        mutation_rate = 1.0 / num_angles
+    num_elite = min(num_elite, population_size)
+    population = initialize_population(rng, population_size, len(candidates), num_angles, initial_plans, mutation_rate)
+    best_plan, best_fitness, stall = population[0], -1, 0
+    for generation in range(num_generations):
+        genes, inverse = np.unique(population, return_inverse=True)
+        fitness = calculate_fitness(
+            mask_cache.masks(candidates[genes], evaluator), inverse.reshape(population.shape), base
+        )
+        ranking = np.argsort(-fitness, kind="stable")
+        if fitness[ranking[0]] > best_fitness:
+            best_plan, best_fitness, stall = population[ranking[0]].copy(), int(fitness[ranking[0]]), 0
+        else:
+            stall += 1
+        if (target is not None and best_fitness >= target) or stall >= stall_generations:
+            break
+        if cancel is not None and cancel.is_set():
+            break
+        winners = tournament_selection(rng, fitness, 2 * (population_size - num_elite), tournament_size)
+        children = crossover(rng, population[winners[0::2]], population[winners[1::2]])
+        children = mutate(rng, children, len(candidates), mutation_rate)
+        population = np.concatenate([population[ranking[:num_elite]], children])
+    print("generations", generation + 1, "best coverage", best_fitness)
+    best_plan = best_plan[greedy_order(mask_cache.masks(candidates[best_plan]), base)]
+    return best_plan, best_fitness
+
+
+def optimize_angle_genetic(
+    grids: QGrids,
+    det_ins: DetectorInstrument,
+    fixed_angle_list,
+    euler_angle_ranges,
+    num_workers=1,
+    mask_cache=None,
+    progress=None,
+    cancel=None,
+    max_coverage=0.9,
+    **genetic_parameters,
+):
+    """Shortest plan the genetic search finds with the coverage of the greedy plan
 
+    The lazy greedy plan sets the target (max_coverage of the grid, or what greedy reaches) and the start
+    length; plans one orientation shorter are then evolved, seeded with the greedy orientations, until the
+    target is missed. num_workers > 1 evaluates new orientations on a ParallelCoverageEvaluator.
+    Returns angle_list (fixed angles first) and the bool coverage, as optimize_angle_with_fixed_given;
+    progress(step, coverage, angle) is called for the orientations of the final plan.
+    """
+    if mask_cache is None:
+        mask_cache = OrientationMaskCache(det_ins, grids)
+    planner = AnglePlanner(
+        grids, det_ins, fixed_angle_list, euler_angle_ranges, "lazy", max_coverage=max_coverage, mask_cache=mask_cache
+    )
+    for _ in planner:
+        if cancel is not None and cancel.is_set():
+            break
+    fixed_angle_list = list(fixed_angle_list) or [(0, 0, 0)]
+    greedy_angles = planner.angle_list[len(fixed_angle_list) :]
+    base_coverage = np.any(mask_cache.masks(fixed_angle_list).to_bool(), axis=0)
+    target = int(np.count_nonzero(planner.current_coverage))
+    # the genes are the lattice orientations; greedy orientations off it (the planner's default second angle)
+    # are left out of the seed, initialize_population pads it at random
+    candidates = euler_angle_lattice(euler_angle_ranges)
+    candidate_index = {key: idx for idx, key in enumerate(mask_cache.keys(candidates))}
+    seed_plan = [
+        candidate_index[key] for key in mask_cache.keys(np.reshape(greedy_angles, (-1, 3))) if key in candidate_index
+    ]
+    # each shorter search starts from the last plan found and the greedy plan
+    initial_plans = [seed_plan]
+
+    evaluator = None
+    if num_workers > 1:
+        evaluator = ParallelCoverageEvaluator(det_ins, grids, num_workers)
+    best_angles = greedy_angles
+    try:
+        for num_angles in range(len(greedy_angles) - 1, 0, -1):
+            if cancel is not None and cancel.is_set():
+                break
+            plan, covered = genetic_algorithm(
+                det_ins,
+                grids,
+                candidates,
+                num_angles,
+                base_coverage,
+                initial_plans=initial_plans,
+                target=target,
+                mask_cache=mask_cache,
+                evaluator=evaluator,
+                cancel=cancel,
+                **genetic_parameters,
+            )
+            if covered < target:
+                break
+            best_angles = [tuple(float(a) for a in angle) for angle in candidates[plan]]
+            initial_plans = [list(plan), seed_plan]
+            print("genetic plan of", num_angles, "angles reaches the greedy coverage")
+    finally:
+        if evaluator is not None:
+            evaluator.close()
+        print("mask cache hits", mask_cache.hits, "misses", mask_cache.misses)
+
+    angle_list = fixed_angle_list + list(best_angles)
+    coverage_mask = CoverageMask.zeros(mask_cache.num_grid_point)
+    num_grid_point = mask_cache.num_grid_point
+    for step, angle in enumerate([*fixed_angle_list, *best_angles]):
+        coverage_mask |= mask_cache.masks([angle])[0]
+        if progress is not None and step >= len(fixed_angle_list):
+            progress(step - len(fixed_angle_list) + 1, coverage_mask.count() / num_grid_point, angle)
+    return angle_list, coverage_mask.to_bool()
 
-'''
 
 '''
 ###### gd
@@ -5,6 +5,7 @@ from typing import Dict, List
 from pydantic import BaseModel, Field
 
 from .eic_client import EICClient
+from .plan_schedule import default_axis_speeds, schedule_plan
 
 
 class EICControlModel(BaseModel):
@@ -52,6 +53,13 @@ class EICControlModel(BaseModel):
     current_scan_idx: int = Field(default=0, title="Current Scan Index")
 
     correct_run_format: bool = Field(default=True, title="Correct Run Format")
+
+    schedule_before_submit: bool = Field(
+        default=True, title="Minimize Motor Travel", description="Reorder the runs before submission"
+    )
+    axis_speeds: Dict[str, float] = Field(default=dict(default_axis_speeds), title="Axis Speeds (deg/s)")
+    dead_time_before: float = Field(default=0.0, title="Estimated motor dead time (s) in the given order")
+    dead_time_after: float = Field(default=0.0, title="Estimated motor dead time (s) in the submitted order")
     supported_beamline: bool = Field(default=True, title="Supported Beamline")
 
     def load_token(self, file_path: str) -> None:
@@ -59,8 +67,16 @@ class EICControlModel(BaseModel):
             self.token = tokenfile.read()
             print(self.token)
 
-    def submit_eic(self, angleplan: List[Dict]) -> None:
+    def submit_eic(self, angleplan: List[Dict]) -> List[Dict]:
         # Implement the submit logic here
+        # returns the runs in the submitted order
+        if self.schedule_before_submit:
+            angleplan, self.dead_time_before, self.dead_time_after = schedule_plan(angleplan, self.axis_speeds)
+            print(
+                "motor dead time {:.0f} s -> {:.0f} s after reordering".format(
+                    self.dead_time_before, self.dead_time_after
+                )
+            )
         self.beamline = self.beamline_database[self.instrument_name]
         eic_client = EICClient(self.token, beamline=self.beamline, ipts_number=self.IPTS_number)
         eic_client.is_eic_enabled(print_results=True)
@@ -104,6 +120,7 @@ class EICControlModel(BaseModel):
 
         # self.eic_submission_status=eic_client.get_scan_status(scan_id=scan_id)
         # print(self.eic_submission_status)
+        return angleplan
 
     def stop_run(self) -> None:
         # Implement the stop logic here
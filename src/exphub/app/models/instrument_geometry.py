@@ -0,0 +1,234 @@
+"""Cached detector geometry for angle planning."""
+
+import hashlib
+import os
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from .angle_plan_engine import PixelLookup
+
+geometry_cache_dir = os.environ.get(
+    "EXPHUB_GEOMETRY_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "exphub", "geometry")
+)
+
+
+def idf_version(instrument: str) -> str:
+    """Name and modification time of the instrument definition file Mantid would load.
+
+    Only mantid.api is needed, not mantid.simpleapi; without Mantid the version is unknown ("").
+    """
+    try:
+        from mantid.api import ExperimentInfo
+    except ImportError:
+        return ""
+    filename = ExperimentInfo.getInstrumentFilename(instrument)
+    if os.path.isfile(filename):
+        return "{}:{}".format(os.path.basename(filename), int(os.path.getmtime(filename)))
+    return os.path.basename(filename)
+
+
+def calibration_version(cal_filename: str) -> str:
+    """Content hash of the calibration file, "" for none."""
+    if not cal_filename or not os.path.isfile(cal_filename):
+        return ""
+    with open(cal_filename, "rb") as cal_file:
+        return hashlib.sha256(cal_file.read()).hexdigest()
+
+
+class NpzArrays(Mapping[str, np.ndarray]):
+    """Read-only mapping over the arrays of an .npz file.
+
+    The keys in lazy are read on first access, the others when the mapping is created; the file is reopened
+    for every read and never held open.
+    """
+
+    def __init__(self, path: str, lazy: Tuple[str, ...] = ()) -> None:
+        self.path = path
+        self.loaded: Dict[str, np.ndarray] = {}
+        with np.load(path) as data:
+            self.files = list(data.files)
+            for key in self.files:
+                if key not in lazy:
+                    self.loaded[key] = data[key]
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        """Array stored under key, read from the file on first access."""
+        if key not in self.loaded:
+            if key not in self.files:
+                raise KeyError(key)
+            with np.load(self.path) as data:
+                self.loaded[key] = data[key]
+        return self.loaded[key]
+
+    def __iter__(self) -> Iterator[str]:
+        """Names of the arrays in the file."""
+        return iter(self.files)
+
+    def __len__(self) -> int:
+        """Number of arrays in the file."""
+        return len(self.files)
+
+
+class InstrumentGeometry:
+    """Per-pixel detector angles of an instrument, shaped (bank, row, column).
+
+    Arrays are read from the backing mapping on first use, so a cached geometry opened from an .npz
+    only loads the pane corners when the per-pixel tables are not needed.
+    """
+
+    table_keys = ("l2", "two_theta", "az_phi")
+
+    def __init__(self, arrays: Mapping[str, Any], metadata: Optional[Dict[str, str]] = None) -> None:
+        self.arrays = arrays
+        self.metadata = metadata or {}
+
+    @classmethod
+    def from_mantid(
+        cls, instrument: str, cal_filename: str = "", bank_shape: Tuple[int, int] = (256, 256)
+    ) -> "InstrumentGeometry":
+        import mantid.simpleapi as mtdapi
+        from mantid.simpleapi import mtd
+
+        mtdapi.LoadEmptyInstrument(InstrumentName=instrument, OutputWorkspace="instrument")
+        if cal_filename.endswith(".DetCal") and os.path.isfile(cal_filename):
+            mtdapi.LoadIsawDetCal(InputWorkspace="instrument", Filename=cal_filename)
+        mtdapi.ExtractMonitors(
+            InputWorkspace="instrument", DetectorWorkspace="instrument", MonitorWorkspace="montitors"
+        )
+        mtdapi.PreprocessDetectorsToMD(InputWorkspace="instrument", OutputWorkspace="detectors", GetMaskState=False)
+
+        arrays = {
+            key: np.array(mtd["detectors"].column(idx_column)).reshape((-1,) + tuple(bank_shape))
+            for idx_column, key in enumerate(cls.table_keys, start=1)
+        }
+        return cls(arrays, {"instrument": instrument, "cal_filename": cal_filename})
+
+    @property
+    def l2(self) -> np.ndarray:
+        return np.asarray(self.arrays["l2"])
+
+    @property
+    def two_theta(self) -> np.ndarray:
+        return np.asarray(self.arrays["two_theta"])
+
+    @property
+    def az_phi(self) -> np.ndarray:
+        return np.asarray(self.arrays["az_phi"])
+
+    def pixel_positions(self) -> np.ndarray:
+        """Pixel positions in cm, shaped (bank, row, column, 3)."""
+        l2_cm = self.l2 * 100
+        return np.stack(
+            (
+                l2_cm * np.sin(self.two_theta) * np.cos(self.az_phi),
+                l2_cm * np.sin(self.two_theta) * np.sin(self.az_phi),
+                l2_cm * np.cos(self.two_theta),
+            ),
+            axis=-1,
+        )
+
+    def pane_vertices(self, edge: int = 10) -> np.ndarray:
+        """Corners of every bank inset by edge pixels, shaped (bank, 4, 3) in the order 00, 0-1, -10, -1-1."""
+        key = "pane_vertices_{:d}".format(edge)
+        if key in self.arrays:
+            return np.asarray(self.arrays[key])
+        positions = self.pixel_positions()
+        first, last = edge, -edge - 1
+        return np.stack(
+            (
+                positions[:, first, first],
+                positions[:, first, last],
+                positions[:, last, first],
+                positions[:, last, last],
+            ),
+            axis=1,
+        )
+
+    def detector_parameters(self, edge: int = 10, t_min: float = 1000, t_max: float = 16000) -> List[Dict[str, Any]]:
+        """Pane list for DetectorInstrument, one rectangle per bank."""
+        return [
+            {
+                "pane_id": idx_pane,
+                "pane_shape": "rectangle",
+                "pane_parameter": {"vertices": pane_vertices, "t_min": t_min, "t_max": t_max},
+            }
+            for idx_pane, pane_vertices in enumerate(self.pane_vertices(edge))
+        ]
+
+    def pixel_lookup(
+        self,
+        edge: int = 18,
+        dead_pixels: Optional[np.ndarray] = None,
+        angle_step: float = 0.1,
+    ) -> "PixelLookup":
+        """(two-theta, azimuth) -> pixel texture for the "pixel" coverage model.
+
+        Parameters
+        ----------
+        edge
+            Width in pixels of the bank border that is masked, as EdgePixels of the peak integration.
+        dead_pixels
+            Optional (bank, row, column) bool array, True for pixels that do not count.
+        angle_step
+            Texture cell size in degrees.
+        """
+        from .angle_plan_engine import PixelLookup
+
+        positions = self.pixel_positions()
+        usable = np.zeros(positions.shape[:3], dtype=bool)
+        usable[:, edge : positions.shape[1] - edge, edge : positions.shape[2] - edge] = True
+        if dead_pixels is not None:
+            usable &= ~np.asarray(dead_pixels, dtype=bool)
+        return PixelLookup.from_pixels(positions, usable, angle_step)
+
+    def save(self, path: str, edges: Tuple[int, ...] = (10,)) -> None:
+        arrays: Dict[str, Any] = {key: np.asarray(self.arrays[key]) for key in self.table_keys}
+        for edge in edges:
+            arrays["pane_vertices_{:d}".format(edge)] = self.pane_vertices(edge)
+        metadata = np.array(sorted(self.metadata.items()), dtype=str).reshape(-1, 2)
+        # written next to the target and renamed, readers never see a partial file
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as geometry_file:
+            np.savez(geometry_file, metadata=metadata, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "InstrumentGeometry":
+        # the metadata and pane corners are all the planner needs, the per-pixel tables are read on first use
+        arrays = NpzArrays(path, lazy=cls.table_keys)
+        return cls(arrays, {str(key): str(value) for key, value in arrays["metadata"]})
+
+
+class GeometryCache:
+    """On-disk .npz cache of instrument geometry per (instrument name, IDF version, calibration file).
+
+    A warm entry is opened lazily and never imports mantid.simpleapi.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None) -> None:
+        self.cache_dir = cache_dir or geometry_cache_dir
+
+    def path(self, instrument: str, idf: str, cal_filename: str) -> str:
+        digest = hashlib.sha256()
+        for item in (
+            instrument,
+            idf,
+            os.path.abspath(cal_filename) if cal_filename else "",
+            calibration_version(cal_filename),
+        ):
+            digest.update(item.encode() + b"\0")
+        return os.path.join(self.cache_dir, "{}_{}.npz".format(instrument, digest.hexdigest()[:16]))
+
+    def get(self, instrument: str, cal_filename: str = "", idf: Optional[str] = None) -> InstrumentGeometry:
+        if idf is None:
+            idf = idf_version(instrument)
+        path = self.path(instrument, idf, cal_filename)
+        if os.path.isfile(path):
+            return InstrumentGeometry.load(path)
+        geometry = InstrumentGeometry.from_mantid(instrument, cal_filename)
+        geometry.metadata.update(idf_version=idf)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        geometry.save(path)
+        return InstrumentGeometry.load(path)
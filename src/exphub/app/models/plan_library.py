@@ -0,0 +1,296 @@
+"""Precomputed angle plans per instrument, goniometer limits, point group and centering.
+
+The library is a JSON file of plans with the metadata needed to judge them (coverage achieved, the grid
+the coverage was measured on, the engine version that produced them). It is filled by the batch job in
+this module::
+
+    python -m exphub.app.models.plan_library --instrument TOPAZ --point-group m-3m --centering P F
+
+and looked up by the angle plan view model, which only runs the optimizer for combinations that are missing.
+Plans written by another engine version are stale: lookup does not return them, so the view model runs the
+optimizer, and the batch job replaces them. The packaged plans migrated from the table of the old view model
+carry legacy_engine_version; they were not produced by the engine (no coverage or grid is recorded) and are
+served until the batch job replaces them.
+"""
+
+import argparse
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .angle_plan_engine import (
+    CoverageCache,
+    DetectorInstrument,
+    QGrids,
+    centering_reflections,
+    engine_version,
+    optimize_angle_with_fixed_given,
+    reflection_hkl,
+)
+
+format_version = 1
+plan_library_path = os.environ.get(
+    "EXPHUB_PLAN_LIBRARY", os.path.join(os.path.dirname(os.path.abspath(__file__)), "plan_library.json")
+)
+
+# (min, max) in degrees of each goniometer axis in angle plan order (phi, chi, omega)
+GoniometerLimits = Tuple[Tuple[float, float], ...]
+default_goniometer_limits: GoniometerLimits = ((0.0, 360.0), (135.0, 135.0), (0.0, 360.0))
+instrument_goniometer_limits: Dict[str, GoniometerLimits] = {"TOPAZ": default_goniometer_limits}
+
+# plans stored under this centering serve every centering of the point group
+any_centering = "*"
+
+# engine_version of the plans migrated from the hard coded table of the old view model
+legacy_engine_version = "legacy"
+
+
+def goniometer_limits(instrument: str) -> GoniometerLimits:
+    return instrument_goniometer_limits.get(instrument, default_goniometer_limits)
+
+
+def plan_key(instrument: str, limits: Iterable[Sequence[float]], point_group: str, centering: str) -> str:
+    limits_text = ",".join("{:g}:{:g}".format(float(low), float(high)) for low, high in limits)
+    return "|".join((instrument, limits_text, point_group, centering))
+
+
+@dataclass
+class AnglePlan:
+    """One library entry: the (phi, chi, omega) angles and how they were obtained.
+
+    coverage is the fraction of unique reflections of the grid covered by the plan, None when unknown.
+    """
+
+    instrument: str
+    goniometer_limits: List[List[float]]
+    point_group: str
+    centering: str
+    angles: List[List[float]]
+    coverage: Optional[float] = None
+    grid: Dict[str, Any] = field(default_factory=dict)
+    engine_version: str = engine_version
+    created: str = ""
+
+    @property
+    def key(self) -> str:
+        return plan_key(self.instrument, self.goniometer_limits, self.point_group, self.centering)
+
+    @property
+    def stale(self) -> bool:
+        """True for plans of another engine version; legacy plans are not stale."""
+        return self.engine_version not in (engine_version, legacy_engine_version)
+
+
+class PlanLibrary:
+    """Plans indexed by plan_key; lookups are a dictionary access."""
+
+    def __init__(self, plans: Iterable[AnglePlan] = (), path: str = "") -> None:
+        self.path = path
+        self.plans: Dict[str, AnglePlan] = {}
+        for plan in plans:
+            self.add(plan)
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> "PlanLibrary":
+        path = path or plan_library_path
+        if not os.path.isfile(path):
+            return cls(path=path)
+        with open(path) as library_file:
+            content = json.load(library_file)
+        if content.get("format_version") != format_version:
+            raise ValueError("plan library {} has format version {}".format(path, content.get("format_version")))
+        return cls((AnglePlan(**plan) for plan in content["plans"]), path=path)
+
+    def save(self, path: Optional[str] = None) -> None:
+        path = path or self.path or plan_library_path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # written next to the target and renamed, readers never see a partial file
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as library_file:
+            # one plan per line keeps diffs of the packaged library readable
+            plans = ",\n".join(json.dumps(asdict(plan)) for plan in self.plans.values())
+            library_file.write('{{"format_version": {:d}, "plans": [\n{}\n]}}\n'.format(format_version, plans))
+        os.replace(tmp_path, path)
+
+    def add(self, plan: AnglePlan) -> None:
+        self.plans[plan.key] = plan
+
+    def lookup(
+        self, instrument: str, limits: Iterable[Sequence[float]], point_group: str, centering: str
+    ) -> Optional[AnglePlan]:
+        """Plan for the exact centering, else the plan shared by all centerings, else None; stale plans are skipped."""
+        limits = [list(axis) for axis in limits]
+        for plan_centering in (centering, any_centering):
+            plan = self.plans.get(plan_key(instrument, limits, point_group, plan_centering))
+            if plan is not None and not plan.stale:
+                return plan
+        return None
+
+
+def optimize_plan(
+    det_ins: DetectorInstrument,
+    hkl: np.ndarray,
+    symmetry_matrices: np.ndarray,
+    ub: np.ndarray,
+    limits: Iterable[Sequence[float]],
+    angle_step: float = 5.0,
+    fixed_angle_list: Sequence[Sequence[float]] = ((0.0, 135.0, 0.0),),
+    strategy: str = "lazy",
+    progress: Optional[Callable[[int, float, Sequence[float]], None]] = None,
+    cancel: Optional[Any] = None,
+    coverage_cache: Optional[CoverageCache] = None,
+    num_workers: int = 1,
+) -> Tuple[List[List[float]], float, Dict[str, Any]]:
+    """Run the greedy optimizer on the asymmetric unit of hkl.
+
+    Parameters
+    ----------
+    symmetry_matrices
+        (S, 3, 3) point group operators acting on hkl.
+    limits
+        (min, max) of each goniometer axis, searched with angle_step degrees.
+    progress, cancel, coverage_cache
+        Passed to optimize_angle_with_fixed_given; with a CoverageCache the lattice masks of a grid searched
+        before are read from disk.
+    num_workers
+        Processes computing the lattice masks, 1 computes them in the calling process.
+
+    Returns
+    -------
+    The angles, the fraction of unique reflections they cover and a description of the grid.
+    """
+    grids = QGrids(
+        grid_mode="asymmetric", grid_parameter={"hkl": hkl, "symmetry_operators": symmetry_matrices, "ub": ub}
+    )
+    euler_angle_ranges = [[low, high, angle_step if high > low else 1] for low, high in limits]
+    angle_list, coverage = optimize_angle_with_fixed_given(
+        grids,
+        det_ins,
+        fixed_angle_list,
+        euler_angle_ranges,
+        strategy=strategy,
+        coverage_cache=coverage_cache,
+        num_workers=num_workers,
+        progress=progress,
+        cancel=cancel,
+    )
+    grid = {"mode": "asymmetric", "num_unit": int(grids.num_unit), "angle_step": angle_step, "strategy": strategy}
+    return [[float(angle) for angle in angles] for angles in angle_list], float(np.mean(coverage)), grid
+
+
+def point_group_matrices(point_group: str) -> np.ndarray:
+    """(S, 3, 3) hkl operators of a point group from Mantid."""
+    from mantid.geometry import PointGroupFactory
+
+    operations = PointGroupFactory.createPointGroup(point_group).getSymmetryOperations()
+    # transformHKL is linear, the images of the basis vectors are the columns of the matrix
+    return np.array([np.transpose([sym.transformHKL(axis) for axis in np.eye(3)]) for sym in operations], dtype=float)
+
+
+def precompute_plans(
+    library: PlanLibrary,
+    instrument: str,
+    point_groups: Iterable[str],
+    centerings: Iterable[str],
+    limits: GoniometerLimits,
+    optimize: Callable[[str, str], Tuple[List[List[float]], float, Dict[str, Any]]],
+    overwrite: bool = False,
+) -> List[AnglePlan]:
+    """Fill the library for every (point group, centering); optimize(point_group, centering) runs one search.
+
+    Plans already produced by the current engine version are kept unless overwrite is set, stale and legacy plans
+    are replaced.
+    """
+    new_plans = []
+    for point_group in point_groups:
+        for centering in centerings:
+            existing = library.plans.get(plan_key(instrument, limits, point_group, centering))
+            if existing is not None and existing.engine_version == engine_version and not overwrite:
+                continue
+            angles, coverage, grid = optimize(point_group, centering)
+            plan = AnglePlan(
+                instrument=instrument,
+                goniometer_limits=[list(axis) for axis in limits],
+                point_group=point_group,
+                centering=centering,
+                angles=angles,
+                coverage=coverage,
+                grid=grid,
+                created=time.strftime("%Y-%m-%dT%H:%M:%S"),
+            )
+            library.add(plan)
+            new_plans.append(plan)
+            print("plan", plan.key, "coverage", coverage, "angles", len(angles))
+    return new_plans
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    from .instrument_geometry import GeometryCache
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--instrument", default="TOPAZ")
+    parser.add_argument("--point-group", nargs="+", required=True)
+    parser.add_argument("--centering", nargs="+", default=["P"])
+    parser.add_argument("--cal-filename", default="")
+    parser.add_argument("--ub", type=float, nargs=9, help="reference UB, row major")
+    parser.add_argument("--min-dspacing", type=float, default=0.5)
+    parser.add_argument("--max-dspacing", type=float, default=20.0)
+    parser.add_argument("--min-wavelength", type=float, default=0.4)
+    parser.add_argument("--max-wavelength", type=float, default=3.5)
+    parser.add_argument("--angle-step", type=float, default=5.0)
+    parser.add_argument("--num-workers", type=int, default=1)
+    parser.add_argument("--library", default=plan_library_path)
+    parser.add_argument("--overwrite", action="store_true")
+    args = parser.parse_args(argv)
+
+    geometry = GeometryCache().get(args.instrument, cal_filename=args.cal_filename)
+    det_ins = DetectorInstrument(geometry.detector_parameters(edge=10, t_min=1000, t_max=16000))
+    det_ins.initialize_detector()
+    if args.ub is None:
+        # cubic 10 A cell, orientation of the reference plans
+        ub = np.eye(3) / 10.0
+    else:
+        ub = np.array(args.ub).reshape(3, 3)
+    hkl = reflection_hkl(
+        ub,
+        args.min_dspacing,
+        args.max_dspacing,
+        min_wavelength=args.min_wavelength,
+        max_wavelength=args.max_wavelength,
+    )
+    limits = goniometer_limits(args.instrument)
+
+    def optimize(point_group: str, centering: str) -> Tuple[List[List[float]], float, Dict[str, Any]]:
+        angles, coverage, grid = optimize_plan(
+            det_ins,
+            centering_reflections(hkl, centering),
+            point_group_matrices(point_group),
+            ub,
+            limits,
+            angle_step=args.angle_step,
+            coverage_cache=coverage_cache,
+            num_workers=args.num_workers,
+        )
+        grid.update(
+            ub=ub.tolist(),
+            min_dspacing=args.min_dspacing,
+            max_dspacing=args.max_dspacing,
+            min_wavelength=args.min_wavelength,
+            max_wavelength=args.max_wavelength,
+            cal_filename=args.cal_filename,
+        )
+        return angles, coverage, grid
+
+    coverage_cache = CoverageCache()
+    library = PlanLibrary.load(args.library)
+    precompute_plans(library, args.instrument, args.point_group, args.centering, limits, optimize, args.overwrite)
+    library.save(args.library)
+
+
+if __name__ == "__main__":
+    main()
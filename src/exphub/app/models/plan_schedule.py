@@ -0,0 +1,123 @@
+"""Run order of an angle plan that keeps goniometer travel between runs short."""
+
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# angle plan keys of the goniometer axes and their speeds in degrees per second
+schedule_axes = ("phi", "chi", "omega")
+default_axis_speeds: Dict[str, float] = {"phi": 2.0, "chi": 1.0, "omega": 2.0}
+
+
+def plan_angles(angle_list: Sequence[Mapping], axes: Sequence[str] = schedule_axes) -> np.ndarray:
+    """(N, axis) goniometer angles of the runs; axes missing from a run (e.g. chi of a loaded CSV) are 0."""
+    return np.array([[float(run.get(axis, 0) or 0) for axis in axes] for run in angle_list], dtype=float).reshape(
+        -1, len(axes)
+    )
+
+
+def travel_times(
+    angles: np.ndarray, axis_speeds: Sequence[float], start: Optional[Sequence[float]] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Motor travel times (s) between all runs and from the start position to every run.
+
+    All axes move at once, so a move takes as long as its slowest axis. The axes are not treated as
+    periodic: a goniometer driving from 350 to 10 degrees travels 340 degrees.
+    """
+    speeds = np.asarray(axis_speeds, dtype=float)
+    times = np.max(np.abs(angles[:, None, :] - angles[None, :, :]) / speeds, axis=2)
+    if start is None:
+        start_times = np.zeros(len(angles))
+    else:
+        start_times = np.max(np.abs(angles - np.asarray(start, dtype=float)) / speeds, axis=1)
+    return times, start_times
+
+
+def path_time(order: Union[Sequence[int], np.ndarray], times: np.ndarray, start_times: np.ndarray) -> float:
+    """Dead time of visiting the runs in order, starting from the start position."""
+    if len(order) == 0:
+        return 0.0
+    steps = np.asarray(order)
+    return float(start_times[steps[0]] + times[steps[:-1], steps[1:]].sum())
+
+
+def nearest_neighbour_order(times: np.ndarray, start_times: np.ndarray) -> np.ndarray:
+    """Open path built greedily from every first run, the shortest one is kept."""
+    num_run = len(times)
+    best_order, best_time = np.arange(num_run), np.inf
+    for first in range(num_run):
+        order = [first]
+        unvisited = np.ones(num_run, dtype=bool)
+        unvisited[first] = False
+        for _ in range(num_run - 1):
+            candidates = np.flatnonzero(unvisited)
+            order.append(int(candidates[np.argmin(times[order[-1], candidates])]))
+            unvisited[order[-1]] = False
+        total = path_time(order, times, start_times)
+        if total < best_time:
+            best_order, best_time = np.array(order), total
+    return best_order
+
+
+def two_opt(order: np.ndarray, times: np.ndarray, start_times: np.ndarray, max_pass: int = 100) -> np.ndarray:
+    """Reverse segments of the open path while that shortens it (travel times are symmetric)."""
+    order = np.array(order)
+    num_run = len(order)
+    for _ in range(max_pass):
+        improved = False
+        for i in range(num_run - 1):
+            # reversing order[i..j] replaces the edges (prev, order[i]) and (order[j], order[j+1])
+            j = np.arange(i + 1, num_run)
+            before = start_times[order[i]] if i == 0 else times[order[i - 1], order[i]]
+            after = np.zeros(len(j))
+            after[:-1] = times[order[j[:-1]], order[j[:-1] + 1]]
+            if i == 0:
+                new_before = start_times[order[j]]
+            else:
+                new_before = times[order[i - 1], order[j]]
+            new_after = np.zeros(len(j))
+            new_after[:-1] = times[order[i], order[j[:-1] + 1]]
+            delta = new_before + new_after - before - after
+            best = int(np.argmin(delta))
+            if delta[best] < -1e-9:
+                order[i : j[best] + 1] = order[i : j[best] + 1][::-1]
+                improved = True
+        if not improved:
+            break
+    return order
+
+
+def schedule_plan(
+    angle_list: Sequence[Dict],
+    axis_speeds: Optional[Mapping[str, float]] = None,
+    start: Optional[Mapping[str, float]] = None,
+) -> Tuple[List[Dict], float, float]:
+    """Reorder the runs of a plan to minimize goniometer travel.
+
+    Parameters
+    ----------
+    angle_list
+        Runs with "phi", "chi" and "omega" in degrees.
+    axis_speeds
+        Degrees per second of each axis, default_axis_speeds for the missing ones.
+    start
+        Current goniometer position, None when unknown (the first move is then not counted).
+
+    Returns
+    -------
+    The reordered runs (same dictionaries) and the estimated dead time in seconds before and after.
+    """
+    speeds = dict(default_axis_speeds, **(axis_speeds or {}))
+    angles = plan_angles(angle_list)
+    start_angles = None if start is None else [float(start.get(axis, 0)) for axis in schedule_axes]
+    times, start_times = travel_times(angles, [speeds[axis] for axis in schedule_axes], start_angles)
+    dead_time_before = path_time(np.arange(len(angle_list)), times, start_times)
+    if len(angle_list) < 3:
+        order = np.argsort(start_times, kind="stable")
+    else:
+        order = two_opt(nearest_neighbour_order(times, start_times), times, start_times)
+    dead_time_after = path_time(order, times, start_times)
+    if dead_time_after >= dead_time_before:
+        # never worse than the plan as given
+        return list(angle_list), dead_time_before, dead_time_before
+    return [angle_list[idx] for idx in order], dead_time_before, dead_time_after
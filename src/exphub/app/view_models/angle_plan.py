@@ -1,8 +1,17 @@
 """View model for angle plan."""
 
-from typing import List
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence
 
-from .main import MainViewModel
+if TYPE_CHECKING:
+    from .main import MainViewModel
+
+# progress queue and cancel event of an optimization worker process, set by init_angleplan_worker
+_job_channels: Dict[str, Any] = {}
+
+# d-spacing floor (Angstrom) of the reflections the angle plan is optimized for: the reflection count grows as
+# 1/d^3, at the 0.5 A experiment default a 11 A cell has ~47k reflections before the symmetry expansion, at 1 A
+# ~5.9k (the old fixed 21^3 hkl cube had 9261); shorter d-spacings are not counted by the search
+planning_min_dspacing = 1.0
 
 # from ..models.ccs_status import CCSStatusModel
 # from ..models.temporal_analysis import TemporalAnalysisModel
@@ -94,17 +103,112 @@ class MainViewModel:
 '''  # noqa
 
 
-def angleplan_optimize(view_model: MainViewModel) -> List:
-    import mantid.simpleapi as mtdapi
+def angleplan_settings(view_model: "MainViewModel") -> Dict[str, Any]:
+    """Experiment info needed by angleplan_compute, plain values that can be sent to another process."""
+    experimentinfo = view_model.model.experimentinfo
+    return {
+        "instrument": experimentinfo.instrument,
+        "cal_filename": experimentinfo.cal_filename,
+        "point_group": experimentinfo.point_group,
+        "centering": experimentinfo.centering,
+        "min_dspacing": max(experimentinfo.min_dspacing, planning_min_dspacing),
+        "max_dspacing": experimentinfo.max_dspacing,
+        "min_wavelength": experimentinfo.min_wavelength,
+        "max_wavelength": experimentinfo.max_wavelength,
+        "border_pixels": experimentinfo.border_pixels,
+        "coverage_model": view_model.model.angleplan.coverage_model,
+        "num_workers": view_model.model.angleplan.num_workers,
+    }
+
+
+def init_angleplan_worker(progress_queue: Any, cancel_event: Any) -> None:
+    from ..models.angle_plan_engine import CoverageCache
+
+    # one on-disk lattice mask cache for the session, re-planning a sample reads its masks back
+    _job_channels.update(progress=progress_queue, cancel=cancel_event, coverage_cache=CoverageCache())
+
+
+def angleplan_job(settings: Dict[str, Any], live_optimization: bool = True) -> Dict[str, Any]:
+    """Entry point in the optimization worker: progress goes to the worker queue as (step, coverage, angle)."""
+    progress_queue = _job_channels.get("progress")
+
+    def progress(step: int, coverage: float, angle: Sequence[float]) -> None:
+        if progress_queue is not None:
+            progress_queue.put((step, coverage, [float(i) for i in angle]))
+
+    return angleplan_compute(
+        settings, live_optimization, progress, _job_channels.get("cancel"), _job_channels.get("coverage_cache")
+    )
+
+
+def angleplan_optimize(view_model: "MainViewModel", live_optimization: bool = True) -> List:
+    result = angleplan_compute(angleplan_settings(view_model), live_optimization)
+    view_model.model.angleplan.qpane_cones = result["qpane_cones"]
+    view_model.model.angleplan.symmetry_operations = result["symmetry_operations"]
+    return result["angles"]
+
+
+def pane_cones(det_ins: Any) -> List[Dict[str, Any]]:
+    """Q-space vertices and faces of every detector pane, as drawn by the angle plan view."""
+    qpane_cones = []
+    for idx_pane, pane in enumerate(det_ins.detector_panes):
+        qv1 = [i.tolist() for i in pane.qvertices]
+        qf1 = [[t.tolist() for t in pane.qfaces[i]] for i in pane.qfaces.keys()]
+        qpane_cones.append({"pane_id": idx_pane, "qvertices": qv1, "qfaces": qf1})
+
+        ##################################################################################
+        # each qface is 6 surface of cube
+        # each face has 4 vertices[ 0,1,2,3]
+        # shaped as
+        #  0---1
+        #  |   |
+        #  2---3
+        ##################################################################################
+    return qpane_cones
+
+
+def angleplan_display(settings: Dict[str, Any]) -> Dict[str, Any]:
+    """Pane cones and symmetry operations for a precomputed plan, without reflection grid or search.
+
+    Cheap enough to run in the calling process: a warm geometry cache entry is read without mantid.simpleapi.
+    """
+    import numpy as np
+
+    from ..models.angle_plan_engine import DetectorInstrument
+    from ..models.instrument_geometry import GeometryCache
+    from ..models.plan_library import point_group_matrices
+
+    geometry = GeometryCache().get(settings["instrument"], cal_filename=settings["cal_filename"])
+    # the library plans are for the hexahedron model, pane corners inset by 10 pixels as in angleplan_compute
+    multi_detector_system = DetectorInstrument(geometry.detector_parameters(edge=10, t_min=1000, t_max=16000))
+    multi_detector_system.initialize_detector()
+    # the rows of an operation are the images of the basis vectors, the columns of point_group_matrices
+    symmetry_operations = np.transpose(point_group_matrices(settings["point_group"]), (0, 2, 1)).tolist()
+    return {"angles": [], "qpane_cones": pane_cones(multi_detector_system), "symmetry_operations": symmetry_operations}
+
+
+def angleplan_compute(
+    settings: Dict[str, Any],
+    live_optimization: bool = True,
+    progress: Optional[Callable[[int, float, Sequence[float]], None]] = None,
+    cancel: Optional[Any] = None,
+    coverage_cache: Optional[Any] = None,
+) -> Dict[str, Any]:
+    """Pane cones, symmetry operations and, with live_optimization, the optimized angles for the settings.
+
+    coverage_cache is the CoverageCache of the session, passed to optimize_plan.
+    """
     import numpy as np
     from mantid.geometry import PointGroupFactory
-    from mantid.simpleapi import mtd
 
     # import NeuXtalViz.models.ap_test_v2 as ap_test_v2
     from ..models.angle_plan_engine import (
         DetectorInstrument,
-        QGrids,
+        centering_reflections,
+        reflection_hkl,
     )
+    from ..models.instrument_geometry import GeometryCache
+    from ..models.plan_library import goniometer_limits, optimize_plan
 
     # from ap_test_v2 import DetectorPane, DetectorInstrument, QGrids
     # from ap_test_v2 import optimize_angle_with_fixed_given as oa
@@ -113,7 +217,7 @@ def angleplan_optimize(view_model: MainViewModel) -> List:
     print("==========================angle plan test================================")
     print("=========================================================================")
 
-    instrument = view_model.model.experimentinfo.instrument
+    instrument = settings["instrument"]
     # wavelength = view_model.model.experimentinfo.wavelength
     # axes = view_model.model.experimentinfo.axes
     # limits = view_model.model.experimentinfo.limits
@@ -121,7 +225,7 @@ def angleplan_optimize(view_model: MainViewModel) -> List:
     # d_min = view_model.model.experimentinfo.d_min
     # d_max = view_model.model.experimentinfo.d_max
     # offset = view_model.model.experimentinfo.offset
-    point_group = view_model.model.experimentinfo.point_group
+    point_group = settings["point_group"]
     # lattice_centering = view_model.model.experimentinfo.lattice_centering
 
     print("self.instrument        ", instrument)
@@ -172,77 +276,33 @@ def angleplan_optimize(view_model: MainViewModel) -> List:
     # euler_angle_range=[[omega0,omega1,10],[chi0,chi1,0.5],[phi0,phi1,10]]
     # print('euler_angle_range ',euler_angle_range )
     print("--------------------------instrument setup--------------------------------")
-    mtdapi.LoadEmptyInstrument(InstrumentName=instrument, OutputWorkspace="instrument")
-
-    mtdapi.ExtractMonitors(InputWorkspace="instrument", DetectorWorkspace="instrument", MonitorWorkspace="montitors")
-
-    mtdapi.PreprocessDetectorsToMD(InputWorkspace="instrument", OutputWorkspace="detectors", GetMaskState=False)
-
-    l2 = np.array(mtd["detectors"].column(1)).reshape(-1, 256, 256)
-    two_theta = np.array(mtd["detectors"].column(2)).reshape(-1, 256, 256)
-    az_phi = np.array(mtd["detectors"].column(3)).reshape(-1, 256, 256)
-    print("L2", l2)
+    # pixel angles come from LoadEmptyInstrument/PreprocessDetectorsToMD once per instrument, IDF version and
+    # calibration; afterwards the cached pane corners are read without mantid.simpleapi
+    geometry = GeometryCache().get(instrument, cal_filename=settings["cal_filename"])
 
     # TODO: get L1 in cm
     # L1 = np.array(mtd['detectors'].column(1)).reshape(-1, 256,256)
     # l1 = 1800
 
-    x = l2 * 100 * np.sin(two_theta) * np.cos(az_phi)
-    y = l2 * 100 * np.sin(two_theta) * np.sin(az_phi)
-    z = l2 * 100 * np.cos(two_theta)
-
-    det_ins_parameter = []
-    num_pane = x.shape[0]
-    for idx_pane in range(num_pane):
-        pane_vertices = np.array(
-            [
-                [x[idx_pane, 0, 0], y[idx_pane, 0, 0], z[idx_pane, 0, 0]],
-                [x[idx_pane, 0, -1], y[idx_pane, 0, -1], z[idx_pane, 0, -1]],
-                [x[idx_pane, -1, 0], y[idx_pane, -1, 0], z[idx_pane, -1, 0]],
-                [x[idx_pane, -1, -1], y[idx_pane, -1, -1], z[idx_pane, -1, -1]],
-            ]
-        )
-        pane_vertices = np.array(
-            [
-                [x[idx_pane, 10, 10], y[idx_pane, 10, 10], z[idx_pane, 10, 10]],
-                [x[idx_pane, 10, -11], y[idx_pane, 10, -11], z[idx_pane, 10, -11]],
-                [x[idx_pane, -11, 10], y[idx_pane, -11, 10], z[idx_pane, -11, 10]],
-                [x[idx_pane, -11, -11], y[idx_pane, -11, -11], z[idx_pane, -11, -11]],
-            ]
-        )
-        # print('detector pane vertices:',pane_vertices)
-        det_ins_parameter.append(
-            {
-                "pane_id": idx_pane,
-                "pane_shape": "rectangle",
-                "pane_parameter": {"vertices": pane_vertices, "t_min": 1000, "t_max": 16000},
-            }
-        )
+    coverage_model = settings.get("coverage_model", "hexahedron")
+    if coverage_model == "pixel":
+        # the pixel lookup masks the border pixels (EdgePixels) itself, the panes only prefilter and span whole banks
+        det_ins_parameter = geometry.detector_parameters(edge=0, t_min=1000, t_max=16000)
+        pixel_lookup = geometry.pixel_lookup(edge=settings["border_pixels"])
+    else:
+        # pane corners are inset by 10 pixels from the bank edges
+        det_ins_parameter = geometry.detector_parameters(edge=10, t_min=1000, t_max=16000)
+        pixel_lookup = None
     # det_ins_parameter=[det_ins_parameter[0]]
-    multi_detector_system = DetectorInstrument(det_ins_parameter)
+    multi_detector_system = DetectorInstrument(
+        det_ins_parameter, coverage_model=coverage_model, pixel_lookup=pixel_lookup
+    )
     multi_detector_system.initialize_detector()
 
     #############################################################
     # pass to angle plan
     ################################################################
-    view_model.model.angleplan.qpane_cones = []
-
-    for idx_pane in range(num_pane):
-        pane = multi_detector_system.detector_panes[idx_pane]
-        qv0 = pane.qvertices.copy()
-        qf0 = pane.qfaces.copy()
-        qv1 = [i.tolist() for i in qv0]
-        qf1 = [[t.tolist() for t in qf0[i]] for i in qf0.keys()]
-        view_model.model.angleplan.qpane_cones.append({"pane_id": idx_pane, "qvertices": qv1, "qfaces": qf1})
-
-        ##################################################################################
-        # each qface is 6 surface of cube
-        # each face has 4 vertices[ 0,1,2,3]
-        # shaped as
-        #  0---1
-        #  |   |
-        #  2---3
-        ##################################################################################
+    qpane_cones = pane_cones(multi_detector_system)
 
     print("-------------------------grids setup-----------------------------")
     # Qmax=multi_detector_system.get_max_Q()
@@ -254,21 +314,14 @@ def angleplan_optimize(view_model: MainViewModel) -> List:
     # print(grid_parameter)
     # print(grids.points.shape)
 
-    qhmax = 10
-    qkmax = 10
-    qlmax = 10
-    qh = np.linspace(-qhmax, qhmax, 2 * qhmax + 1)
-    qk = np.linspace(-qkmax, qkmax, 2 * qkmax + 1)
-    ql = np.linspace(-qlmax, qlmax, 2 * qlmax + 1)
-
-    qhkl_irr_h, qhkl_irr_k, qhkl_irr_l = np.meshgrid(qh, qk, ql)
-    # qhkl_irr_h,qhkl_irr_k,qhkl_irr_l=np.meshgrid(np.arange(qhmax),np.arange(qkmax),np.arange(qlmax),indexing='ij')
-
-    qhkl_irr_h_flat = qhkl_irr_h.flatten()
-    qhkl_irr_k_flat = qhkl_irr_k.flatten()
-    qhkl_irr_l_flat = qhkl_irr_l.flatten()
-    # qhkl_irr=np.column_stack((qhkl_irr_h_flat,qhkl_irr_k_flat,qhkl_irr_l_flat)).T
-    qhkl_irr = np.column_stack((qhkl_irr_h_flat, qhkl_irr_k_flat, qhkl_irr_l_flat))
+    # only the reflections inside the d-spacing shell that the wavelength band can reach
+    qhkl_irr = reflection_hkl(
+        ub,
+        settings["min_dspacing"],
+        settings["max_dspacing"],
+        min_wavelength=settings["min_wavelength"],
+        max_wavelength=settings["max_wavelength"],
+    )
 
     print("qhkl_irr shape", qhkl_irr.shape)
 
@@ -276,46 +329,20 @@ def angleplan_optimize(view_model: MainViewModel) -> List:
     so = pg.getSymmetryOperations()
     print("symmetry operations:", so)
     # qhkl_sym_list=[]
-    qlab_sym_list = []
     a = np.array([1, 0, 0])
     b = np.array([0, 1, 0])
     c = np.array([0, 0, 1])
     symmetry_operations = []
     for sym in so:
-        qhkl_sym = [sym.transformHKL(q) for q in qhkl_irr]
-        qlab = np.array(qhkl_sym) @ (ub).T
-        # qhkl_sym_list.append(qlab)
-        print("symmetry operation:", sym)
-        qlab_sym_list.append(qlab)
         tsyma = sym.transformHKL(a)
         tsymb = sym.transformHKL(b)
         tsymc = sym.transformHKL(c)
         tsym = np.array([tsyma, tsymb, tsymc]).tolist()
-        print(tsyma, tsymb, tsymc)
-        print("symmetry operation:", tsym)
+        print("symmetry operation:", sym, tsym)
         symmetry_operations.append(tsym)
-        print("symmetry operation:", symmetry_operations)
-    view_model.model.angleplan.symmetry_operations = symmetry_operations
-
-    # print('qhkl_sym_list length and shape',len(qhkl_sym_list),qhkl_sym_list[-1].shape)
-    print("qlab_sym_list length and shape", len(qlab_sym_list), qlab_sym_list[-1].shape)
-
-    grid_parameter = {"num_sym": len(qlab_sym_list), "qlist": qlab_sym_list}
-    # grid_parameter={'Nx':10,'Ny':10,'Nz':10,'Qmax':Qmax,'Qmin':Qmin}
-    grids = QGrids(grid_mode="input", grid_parameter=grid_parameter)
-    if grids.points:
-        print("grids shape", grids.points[0].shape)
-
-    print("-------------------------initial coverage calculation-----------------------------")
-    print("coverage calculation")
-
-    coverage_results = grids.get_coverage(multi_detector_system)
-    # print(grids.mask.shape)
-    print("initial coverage", np.sum(coverage_results) * 100 / np.size(coverage_results), "%")
-    # print(grids.points.shape)
-    # print(grids.points[:100,:])
-    # print('shape coverage',coverage_results.shape)
-    # print(coverage_results[:100,:])
+    # transformHKL is linear, the images of the basis vectors are the columns of its 3x3 matrix; the search
+    # applies the operators itself on the asymmetric unit, the symmetry copies are never expanded here
+    symmetry_matrices = np.transpose(np.array(symmetry_operations, dtype=float), (0, 2, 1))
 
     print("-------------------------analyze peak-----------------------------")
     # peaks_list=[peak for peak in peaks.values()]
@@ -330,12 +357,25 @@ def angleplan_optimize(view_model: MainViewModel) -> List:
     # euler_angle_range = [[0, 360, 1], [135, 135, 1], [0, 360, 1]]
 
     ############################################### optimization #######################################
-    # final_angle_list,final_coverage=optimize_angle_with_fixed_given(grids,multi_detector_system,fixed_angle_list,euler_angle_range)#noqa
-    # print("Detector Coverage Results: ", np.sum(final_coverage)/np.size(final_coverage)*100,'%')
-    # return final_angle_list
-
-    # final_angle_list = []
-    return []
+    result = {"angles": [], "qpane_cones": qpane_cones, "symmetry_operations": symmetry_operations}
+    if not live_optimization:
+        return result
+    # same search as the plan library job: lazy greedy over the asymmetric unit, one count per unique reflection
+    final_angle_list, final_coverage, _ = optimize_plan(
+        multi_detector_system,
+        centering_reflections(qhkl_irr, settings["centering"]),
+        symmetry_matrices,
+        ub,
+        goniometer_limits(instrument),
+        fixed_angle_list=fixed_angle_list,
+        progress=progress,
+        cancel=cancel,
+        coverage_cache=coverage_cache,
+        num_workers=settings.get("num_workers", 1),
+    )
+    print("Detector Coverage Results: ", final_coverage * 100, "%")
+    result["angles"] = final_angle_list
+    return result
 
     exit("debug")
     print("------------------------- visualizie-----------------------------")
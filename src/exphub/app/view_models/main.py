@@ -1,8 +1,11 @@
 """Module for the main ViewModel."""
 
 import asyncio
+import multiprocessing
+import queue
 import time
-from typing import Any, Dict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 # from ..models.css_status import CSSStatusModel
 # from ..models.temporal_analysis import TemporalAnalysisModel
@@ -35,6 +38,14 @@ class MainViewModel:
         # Debounce: avoid repeated updates in a short interval (seconds)
         self._temporalanalysis_last_update_time: float = 0.0
         self._temporalanalysis_min_interval: float = 1.0
+        # angle plan optimization runs in a single worker process kept for the whole session (Mantid stays loaded);
+        # progress is pushed to the view at most once per interval (seconds)
+        self._angleplan_executor: Optional[ProcessPoolExecutor] = None
+        self._angleplan_progress: Any = None
+        self._angleplan_cancel: Any = None
+        self._angleplan_progress_interval: float = 0.5
+        # the running optimization; the event loop only keeps a weak reference to its tasks
+        self._angleplan_task: Optional["asyncio.Task[None]"] = None
         # Set parent link for temporalanalysis model so it can access sibling models
         try:
             if hasattr(self.model, "temporalanalysis") and hasattr(self.model.temporalanalysis, "set_parent"):
@@ -88,6 +99,7 @@ class MainViewModel:
         # self.create_auto_update_cssstatus_figure()
 
         self.angleplan_updatefigure_coverage_bind = binding.new_bind()
+        self.angleplan_updatefigure_curve_bind = binding.new_bind()
 
         # Initialize temporalanalysis figures once at startup (no continuous callback)
         try:
@@ -132,7 +144,8 @@ class MainViewModel:
 
     def submit_angle_plan(self) -> None:
         # print("submit_angle_plan")
-        self.model.eiccontrol.submit_eic(self.model.angleplan.angle_list)
+        # the table shows the runs in the order they were submitted
+        self.model.angleplan.angle_list = self.model.eiccontrol.submit_eic(self.model.angleplan.angle_list)
         self.update_view()
 
     def call_load_token(self) -> None:
@@ -308,6 +321,9 @@ class MainViewModel:
         self.angleplan_updatefigure_coverage_bind.update_in_view(self.model.angleplan.get_figure_coverage())
         self.update_view()
 
+    def update_optimization_curve_figure(self) -> None:
+        self.angleplan_updatefigure_curve_bind.update_in_view(self.model.angleplan.get_figure_optimization_curve())
+
     def update_coverage_figure_with_symmetry(self, _: Any = None) -> None:
         self.angleplan_updatefigure_coverage_bind.update_in_view(
             self.model.angleplan.get_coverage_figure_with_symmetry()
@@ -342,15 +358,9 @@ class MainViewModel:
     ############################### coverage figure update ###########################################################
     def reset_run(self) -> None:
         # if self.model.experimentinfo.c
-        self.optimize_angleplan()
         print("reset_run")
-        print(self.model.angleplan.angle_list)
-        print(self.model.angleplan.qpane_cones)
-
-        self.update_view()
-        print("reset_run after update view")
-
-        pass
+        # only schedules the optimization, run_angleplan_optimization updates the view with the new plan
+        self.optimize_angleplan()
 
     def show_under_development_dialog(self) -> None:
         print("show_underdev")
@@ -362,799 +372,133 @@ class MainViewModel:
         self.view_state.is_under_development = False
         self.update_view()
 
-    def optimize_angleplan(self) -> None:
-        from .angle_plan import angleplan_optimize
+    @property
+    def angleplan_running(self) -> bool:
+        return self._angleplan_task is not None and not self._angleplan_task.done()
 
+    def optimize_angleplan(self) -> None:
         print("optimize_angleplan")
-        ##self.is_uninterruptable = True
-        ##self.update_view()
-        final_angle_list = angleplan_optimize(self)
-        ##self.is_uninterruptable = False
-        ##self.update_view()
-        # print('optimize done. final_angle_list',final_angle_list)
-
-        if self.model.experimentinfo.point_group == "1":
-            final_angle_list = [
-                (138.0, 135, 80.0),
-                (184.0, 135, 296.0),
-                (145.0, 135, 152.0),
-                (19.0, 135, 13.0),
-                (17.0, 135, 346.0),
-                (36.0, 135, 235.0),
-                (190.0, 135, 306.0),
-                (299.0, 135, 191.0),
-                (243.0, 135, 168.0),
-                (30.0, 135, 161.0),
-                (288.0, 135, 34.0),
-                (1.0, 135, 151.0),
-                (326.0, 135, 21.0),
-                (89.0, 135, 215.0),
-                (300.0, 135, 58.0),
-                (144.0, 135, 239.0),
-                (164.0, 135, 348.0),
-                (18.0, 135, 132.0),
-                (321.0, 135, 237.0),
-                (300.0, 135, 17.0),
-                (252.0, 135, 3.0),
-                (142.0, 135, 140.0),
-                (343.0, 135, 101.0),
-                (351.0, 135, 228.0),
-                (342.0, 135, 209.0),
-                (73.0, 135, 34.0),
-                (197.0, 135, 285.0),
-                (296.0, 135, 81.0),
-                (330.0, 135, 21.0),
-                (34.0, 135, 134.0),
-                (200.0, 135, 324.0),
-                (85.0, 135, 212.0),
-                (249.0, 135, 0.0),
-                (129.0, 135, 100.0),
-                (262.0, 135, 26.0),
-                (289.0, 135, 3.0),
-                (20.0, 135, 69.0),
-                (333.0, 135, 101.0),
-                (128.0, 135, 235.0),
-                (187.0, 135, 272.0),
-                (337.0, 135, 76.0),
-                (235.0, 135, 286.0),
-                (322.0, 135, 240.0),
-                (136.0, 135, 124.0),
-                (264.0, 135, 324.0),
-                (161.0, 135, 259.0),
-                (27.0, 135, 30.0),
-                (290.0, 135, 38.0),
-                (343.0, 135, 76.0),
-                (211.0, 135, 163.0),
-                (0.0, 135, 223.0),
-                (172.0, 135, 251.0),
-                (358.0, 135, 117.0),
-                (302.0, 135, 272.0),
-                (76.0, 135, 182.0),
-                (265.0, 135, 52.0),
-                (65.0, 135, 166.0),
-                (57.0, 135, 22.0),
-                (38.0, 135, 79.0),
-                (153.0, 135, 130.0),
-                (190.0, 135, 220.0),
-                (126.0, 135, 249.0),
-                (288.0, 135, 55.0),
-                (194.0, 135, 133.0),
-                (334.0, 135, 196.0),
-                (115.0, 135, 264.0),
-                (122.0, 135, 106.0),
-                (153.0, 135, 238.0),
-                (91.0, 135, 97.0),
-                (28.0, 135, 23.0),
-                (97.0, 135, 82.0),
-                (2.0, 135, 140.0),
-                (131.0, 135, 76.0),
-                (11.0, 135, 337.0),
-                (188.0, 135, 255.0),
-                (69.0, 135, 5.0),
-                (157.0, 135, 252.0),
-                (155.0, 135, 309.0),
-                (61.0, 135, 25.0),
-                (251.0, 135, 49.0),
-                (268.0, 135, 206.0),
-                (128.0, 135, 301.0),
-                (337.0, 135, 39.0),
-                (10.0, 135, 26.0),
-                (38.0, 135, 185.0),
-                (56.0, 135, 89.0),
-                (267.0, 135, 15.0),
-                (334.0, 135, 209.0),
-                (75.0, 135, 169.0),
-                (6.0, 135, 316.0),
-                (157.0, 135, 103.0),
-                (300.0, 135, 85.0),
-                (157.0, 135, 271.0),
-                (330.0, 135, 100.0),
-                (147.0, 135, 141.0),
-                (331.0, 135, 39.0),
-                (170.0, 135, 355.0),
-                (10, 135, 0),
-                (279.0, 135, 262.0),
-                (100.0, 135, 202.0),
-                (92.0, 135, 261.0),
-                (175.0, 135, 168.0),
-                (243.0, 135, 24.0),
-                (3.0, 135, 354.0),
-                (284.0, 135, 327.0),
-                (333.0, 135, 110.0),
-                (79.0, 135, 188.0),
-                (90.0, 135, 98.0),
-                (331.0, 135, 96.0),
-                (36.0, 135, 69.0),
-                (317.0, 135, 78.0),
-                (333.0, 135, 107.0),
-                (207.0, 135, 232.0),
-                (80.0, 135, 210.0),
-                (61.0, 135, 146.0),
-                (330.0, 135, 301.0),
-                (216.0, 135, 275.0),
-                (0.0, 135, 119.0),
-                (158.0, 135, 249.0),
-                (238.0, 135, 323.0),
-                (111.0, 135, 69.0),
-                (324.0, 135, 116.0),
-                (170.0, 135, 255.0),
-                (255.0, 135, 357.0),
-                (37.0, 135, 61.0),
-                (73.0, 135, 78.0),
-                (119.0, 135, 201.0),
-                (82.0, 135, 208.0),
-                (27.0, 135, 343.0),
-                (329.0, 135, 101.0),
-                (71.0, 135, 168.0),
-                (277.0, 135, 77.0),
-                (321.0, 135, 88.0),
-                (192.0, 135, 204.0),
-                (325.0, 135, 73.0),
-                (257.0, 135, 157.0),
-                (250.0, 135, 287.0),
-                (74.0, 135, 236.0),
-                (155.0, 135, 226.0),
-                (342.0, 135, 209.0),
-                (157.0, 135, 190.0),
-                (182.0, 135, 266.0),
-                (88.0, 135, 245.0),
-                (95.0, 135, 43.0),
-                (350.0, 135, 338.0),
-                (30.0, 135, 109.0),
-                (300.0, 135, 198.0),
-                (154.0, 135, 244.0),
-                (32.0, 135, 235.0),
-                (63.0, 135, 163.0),
-                (186.0, 135, 252.0),
-                (7.0, 135, 224.0),
-                (180.0, 135, 266.0),
-                (277.0, 135, 55.0),
-                (68.0, 135, 144.0),
-                (353.0, 135, 318.0),
-                (191.0, 135, 277.0),
-                (245.0, 135, 256.0),
-                (57.0, 135, 24.0),
-                (339.0, 135, 101.0),
-                (61.0, 135, 37.0),
-                (193.0, 135, 223.0),
-                (197.0, 135, 143.0),
-                (53.0, 135, 134.0),
-                (38.0, 135, 95.0),
-                (234.0, 135, 1.0),
-                (336.0, 135, 209.0),
-                (275.0, 135, 223.0),
-                (204.0, 135, 10.0),
-                (330.0, 135, 104.0),
-                (218.0, 135, 320.0),
-                (276.0, 135, 316.0),
-                (16.0, 135, 60.0),
-                (219.0, 135, 337.0),
-                (95.0, 135, 240.0),
-                (248.0, 135, 293.0),
-                (18.0, 135, 132.0),
-                (344.0, 135, 208.0),
-                (21.0, 135, 338.0),
-                (194.0, 135, 309.0),
-                (327.0, 135, 306.0),
-                (0, 135, 0),
-                (293.0, 135, 176.0),
-                (155.0, 135, 229.0),
-                (328.0, 135, 103.0),
-                (127.0, 135, 106.0),
-                (191.0, 135, 215.0),
-                (326.0, 135, 75.0),
-                (91.0, 135, 187.0),
-                (114.0, 135, 213.0),
-                (181.0, 135, 165.0),
-                (17.0, 135, 83.0),
-                (334.0, 135, 39.0),
-                (187.0, 135, 280.0),
-                (327.0, 135, 267.0),
-                (215.0, 135, 337.0),
-                (156.0, 135, 130.0),
-                (139.0, 135, 251.0),
-                (114.0, 135, 228.0),
-                (57.0, 135, 190.0),
-                (118.0, 135, 233.0),
-                (262.0, 135, 32.0),
-            ]
-        if self.model.experimentinfo.point_group == "-1":
-            final_angle_list = [
-                (268.0, 135, 206.0),
-                (20.0, 135, 69.0),
-                (235.0, 135, 286.0),
-                (184.0, 135, 296.0),
-                (170.0, 135, 355.0),
-                (18.0, 135, 132.0),
-                (57.0, 135, 24.0),
-                (302.0, 135, 272.0),
-                (128.0, 135, 301.0),
-                (32.0, 135, 235.0),
-                (3.0, 135, 354.0),
-                (156.0, 135, 130.0),
-                (334.0, 135, 39.0),
-                (194.0, 135, 133.0),
-                (74.0, 135, 236.0),
-                (234.0, 135, 1.0),
-                (330.0, 135, 301.0),
-                (330.0, 135, 21.0),
-                (193.0, 135, 223.0),
-                (215.0, 135, 337.0),
-                (36.0, 135, 69.0),
-                (37.0, 135, 61.0),
-                (2.0, 135, 140.0),
-                (91.0, 135, 97.0),
-                (328.0, 135, 103.0),
-                (19.0, 135, 13.0),
-                (63.0, 135, 163.0),
-                (28.0, 135, 23.0),
-                (333.0, 135, 101.0),
-                (73.0, 135, 34.0),
-                (153.0, 135, 238.0),
-                (333.0, 135, 107.0),
-                (95.0, 135, 43.0),
-                (75.0, 135, 169.0),
-                (126.0, 135, 249.0),
-                (252.0, 135, 3.0),
-                (329.0, 135, 101.0),
-                (21.0, 135, 338.0),
-                (57.0, 135, 22.0),
-                (238.0, 135, 323.0),
-                (147.0, 135, 141.0),
-                (38.0, 135, 79.0),
-                (262.0, 135, 32.0),
-                (337.0, 135, 39.0),
-                (95.0, 135, 240.0),
-                (293.0, 135, 176.0),
-                (161.0, 135, 259.0),
-                (331.0, 135, 39.0),
-                (0, 135, 0),
-                (191.0, 135, 215.0),
-                (186.0, 135, 252.0),
-                (197.0, 135, 143.0),
-                (343.0, 135, 101.0),
-                (145.0, 135, 152.0),
-                (326.0, 135, 75.0),
-                (17.0, 135, 83.0),
-                (353.0, 135, 318.0),
-                (296.0, 135, 81.0),
-                (337.0, 135, 76.0),
-                (336.0, 135, 209.0),
-                (342.0, 135, 209.0),
-                (61.0, 135, 25.0),
-                (119.0, 135, 201.0),
-                (11.0, 135, 337.0),
-                (0.0, 135, 223.0),
-                (61.0, 135, 146.0),
-                (53.0, 135, 134.0),
-                (175.0, 135, 168.0),
-                (243.0, 135, 168.0),
-                (330.0, 135, 104.0),
-                (69.0, 135, 5.0),
-                (197.0, 135, 285.0),
-                (250.0, 135, 287.0),
-                (155.0, 135, 226.0),
-                (76.0, 135, 182.0),
-                (275.0, 135, 223.0),
-                (7.0, 135, 224.0),
-                (333.0, 135, 110.0),
-                (155.0, 135, 309.0),
-                (300.0, 135, 198.0),
-                (216.0, 135, 275.0),
-                (255.0, 135, 357.0),
-                (327.0, 135, 267.0),
-                (334.0, 135, 196.0),
-                (144.0, 135, 239.0),
-                (343.0, 135, 76.0),
-                (30.0, 135, 109.0),
-                (114.0, 135, 228.0),
-                (115.0, 135, 264.0),
-                (129.0, 135, 100.0),
-                (207.0, 135, 232.0),
-                (326.0, 135, 21.0),
-                (88.0, 135, 245.0),
-                (358.0, 135, 117.0),
-                (91.0, 135, 187.0),
-                (18.0, 135, 132.0),
-                (90.0, 135, 98.0),
-                (164.0, 135, 348.0),
-                (68.0, 135, 144.0),
-                (279.0, 135, 262.0),
-                (187.0, 135, 272.0),
-            ]
-        if self.model.experimentinfo.point_group == "2":
-            final_angle_list = [(28.0, 135, 23.0), (262.0, 135, 26.0), (36.0, 135, 69.0), (337.0, 135, 76.0)]
-        if self.model.experimentinfo.point_group == "m":
-            final_angle_list = [
-                (342.0, 135, 209.0),
-                (142.0, 135, 140.0),
-                (337.0, 135, 76.0),
-                (89.0, 135, 215.0),
-                (73.0, 135, 34.0),
-                (194.0, 135, 133.0),
-                (0, 135, 0),
-                (17.0, 135, 83.0),
-                (333.0, 135, 107.0),
-                (126.0, 135, 249.0),
-            ]
-        if self.model.experimentinfo.point_group == "2/m":
-            final_angle_list = [
-                (36.0, 135, 69.0),
-                (190.0, 135, 220.0),
-                (131.0, 135, 76.0),
-                (327.0, 135, 267.0),
-                (6.0, 135, 316.0),
-            ]
-        if self.model.experimentinfo.point_group == "112":
-            final_angle_list = [
-                (57.0, 135, 190.0),
-                (342.0, 135, 209.0),
-                (181.0, 135, 165.0),
-                (300.0, 135, 58.0),
-                (344.0, 135, 208.0),
-                (21.0, 135, 338.0),
-                (114.0, 135, 228.0),
-                (322.0, 135, 240.0),
-                (37.0, 135, 61.0),
-                (194.0, 135, 309.0),
-                (252.0, 135, 3.0),
-                (142.0, 135, 140.0),
-                (36.0, 135, 235.0),
-                (100.0, 135, 202.0),
-                (215.0, 135, 337.0),
-                (89.0, 135, 215.0),
-                (7.0, 135, 224.0),
-                (234.0, 135, 1.0),
-                (326.0, 135, 21.0),
-                (97.0, 135, 82.0),
-            ]
-        if self.model.experimentinfo.point_group == "11m":
-            final_angle_list = [
-                (128.0, 135, 235.0),
-                (57.0, 135, 22.0),
-                (89.0, 135, 215.0),
-                (252.0, 135, 3.0),
-                (91.0, 135, 187.0),
-                (207.0, 135, 232.0),
-                (27.0, 135, 343.0),
-                (97.0, 135, 82.0),
-                (158.0, 135, 249.0),
-                (16.0, 135, 60.0),
-                (175.0, 135, 168.0),
-                (265.0, 135, 52.0),
-                (147.0, 135, 141.0),
-                (119.0, 135, 201.0),
-                (249.0, 135, 0.0),
-                (275.0, 135, 223.0),
-                (330.0, 135, 301.0),
-                (154.0, 135, 244.0),
-                (10, 135, 0),
-                (142.0, 135, 140.0),
-            ]
-        if self.model.experimentinfo.point_group == "112/m":
-            final_angle_list = [
-                (218.0, 135, 320.0),
-                (76.0, 135, 182.0),
-                (279.0, 135, 262.0),
-                (17.0, 135, 346.0),
-                (170.0, 135, 355.0),
-                (245.0, 135, 256.0),
-                (11.0, 135, 337.0),
-                (170.0, 135, 255.0),
-                (299.0, 135, 191.0),
-                (38.0, 135, 79.0),
-                (57.0, 135, 24.0),
-                (38.0, 135, 95.0),
-                (300.0, 135, 17.0),
-                (10, 135, 0),
-                (180.0, 135, 266.0),
-                (136.0, 135, 124.0),
-                (339.0, 135, 101.0),
-                (71.0, 135, 168.0),
-                (129.0, 135, 100.0),
-                (155.0, 135, 309.0),
-            ]
-        if self.model.experimentinfo.point_group == "222":
-            final_angle_list = [
-                (92.0, 135, 261.0),
-                (251.0, 135, 49.0),
-                (82.0, 135, 208.0),
-                (16.0, 135, 60.0),
-                (327.0, 135, 267.0),
-                (119.0, 135, 201.0),
-                (34.0, 135, 134.0),
-                (10, 135, 0),
-                (197.0, 135, 143.0),
-                (155.0, 135, 309.0),
-            ]
-        if self.model.experimentinfo.point_group == "mm2":
-            final_angle_list = [
-                (331.0, 135, 39.0),
-                (30.0, 135, 161.0),
-                (334.0, 135, 39.0),
-                (158.0, 135, 249.0),
-                (73.0, 135, 34.0),
-            ]
-        if self.model.experimentinfo.point_group == "mmm":
-            final_angle_list = [
-                (65.0, 135, 166.0),
-                (329.0, 135, 101.0),
-                (18.0, 135, 132.0),
-                (343.0, 135, 76.0),
-                (342.0, 135, 209.0),
-            ]
-        if self.model.experimentinfo.point_group == "4":
-            final_angle_list = [
-                (0.0, 135, 119.0),
-                (157.0, 135, 271.0),
-                (75.0, 135, 169.0),
-                (17.0, 135, 346.0),
-                (302.0, 135, 272.0),
-                (157.0, 135, 190.0),
-                (330.0, 135, 100.0),
-                (331.0, 135, 39.0),
-                (129.0, 135, 100.0),
-                (337.0, 135, 39.0),
-            ]
-        if self.model.experimentinfo.point_group == "-4":
-            final_angle_list = [
-                (331.0, 135, 96.0),
-                (32.0, 135, 235.0),
-                (194.0, 135, 309.0),
-                (30.0, 135, 161.0),
-                (277.0, 135, 77.0),
-                (95.0, 135, 240.0),
-                (219.0, 135, 337.0),
-                (82.0, 135, 208.0),
-                (334.0, 135, 196.0),
-                (122.0, 135, 106.0),
-            ]
-        if self.model.experimentinfo.point_group == "4/m":
-            final_angle_list = [
-                (243.0, 135, 168.0),
-                (267.0, 135, 15.0),
-                (158.0, 135, 249.0),
-                (277.0, 135, 55.0),
-                (17.0, 135, 346.0),
-                (288.0, 135, 55.0),
-                (334.0, 135, 196.0),
-                (38.0, 135, 95.0),
-                (97.0, 135, 82.0),
-                (80.0, 135, 210.0),
-            ]
-        if self.model.experimentinfo.point_group == "422":
-            final_angle_list = [
-                (88.0, 135, 245.0),
-                (76.0, 135, 182.0),
-                (36.0, 135, 235.0),
-                (155.0, 135, 229.0),
-                (300.0, 135, 17.0),
-                (170.0, 135, 355.0),
-                (2.0, 135, 140.0),
-                (27.0, 135, 30.0),
-                (204.0, 135, 10.0),
-                (184.0, 135, 296.0),
-            ]
-        if self.model.experimentinfo.point_group == "4mm":
-            final_angle_list = [
-                (252.0, 135, 3.0),
-                (328.0, 135, 103.0),
-                (184.0, 135, 296.0),
-                (211.0, 135, 163.0),
-                (257.0, 135, 157.0),
-                (80.0, 135, 210.0),
-                (344.0, 135, 208.0),
-                (19.0, 135, 13.0),
-                (138.0, 135, 80.0),
-                (331.0, 135, 96.0),
-            ]
-        if self.model.experimentinfo.point_group == "-42m":
-            final_angle_list = [
-                (321.0, 135, 88.0),
-                (6.0, 135, 316.0),
-                (63.0, 135, 163.0),
-                (164.0, 135, 348.0),
-                (71.0, 135, 168.0),
-                (157.0, 135, 103.0),
-                (38.0, 135, 185.0),
-                (57.0, 135, 190.0),
-                (138.0, 135, 80.0),
-                (191.0, 135, 215.0),
-            ]
-        if self.model.experimentinfo.point_group == "-4m2":
-            final_angle_list = [
-                (204.0, 135, 10.0),
-                (249.0, 135, 0.0),
-                (11.0, 135, 337.0),
-                (142.0, 135, 140.0),
-                (156.0, 135, 130.0),
-                (194.0, 135, 133.0),
-                (131.0, 135, 76.0),
-                (28.0, 135, 23.0),
-                (293.0, 135, 176.0),
-                (284.0, 135, 327.0),
-            ]
-        if self.model.experimentinfo.point_group == "4/mmm":
-            final_angle_list = [
-                (153.0, 135, 238.0),
-                (92.0, 135, 261.0),
-                (192.0, 135, 204.0),
-                (187.0, 135, 280.0),
-                (265.0, 135, 52.0),
-                (131.0, 135, 76.0),
-                (17.0, 135, 346.0),
-                (336.0, 135, 209.0),
-                (53.0, 135, 134.0),
-                (18.0, 135, 132.0),
-            ]
-        if self.model.experimentinfo.point_group == "3 r":
-            final_angle_list = [
-                (187.0, 135, 280.0),
-                (353.0, 135, 318.0),
-                (161.0, 135, 259.0),
-                (16.0, 135, 60.0),
-                (350.0, 135, 338.0),
-                (180.0, 135, 266.0),
-            ]
-        if self.model.experimentinfo.point_group == "-3 r":
-            final_angle_list = [
-                (302.0, 135, 272.0),
-                (36.0, 135, 235.0),
-                (89.0, 135, 215.0),
-                (80.0, 135, 210.0),
-                (327.0, 135, 306.0),
-                (127.0, 135, 106.0),
-            ]
-        if self.model.experimentinfo.point_group == "32 r":
-            final_angle_list = [
-                (0, 135, 0),
-                (170.0, 135, 255.0),
-                (161.0, 135, 259.0),
-                (194.0, 135, 133.0),
-                (326.0, 135, 75.0),
-                (290.0, 135, 38.0),
-            ]
-        if self.model.experimentinfo.point_group == "3m r":
-            final_angle_list = [
-                (322.0, 135, 240.0),
-                (358.0, 135, 117.0),
-                (144.0, 135, 239.0),
-                (126.0, 135, 249.0),
-                (136.0, 135, 124.0),
-                (337.0, 135, 39.0),
-            ]
-        if self.model.experimentinfo.point_group == "-3m r":
-            final_angle_list = [
-                (164.0, 135, 348.0),
-                (218.0, 135, 320.0),
-                (19.0, 135, 13.0),
-                (100.0, 135, 202.0),
-                (193.0, 135, 223.0),
-                (144.0, 135, 239.0),
-            ]
-        if self.model.experimentinfo.point_group == "3":
-            final_angle_list = [
-                (243.0, 135, 24.0),
-                (27.0, 135, 343.0),
-                (200.0, 135, 324.0),
-                (157.0, 135, 103.0),
-                (129.0, 135, 100.0),
-                (89.0, 135, 215.0),
-            ]
-        if self.model.experimentinfo.point_group == "-3":
-            final_angle_list = [
-                (333.0, 135, 107.0),
-                (321.0, 135, 88.0),
-                (353.0, 135, 318.0),
-                (251.0, 135, 49.0),
-                (180.0, 135, 266.0),
-                (190.0, 135, 220.0),
-            ]
-        if self.model.experimentinfo.point_group == "312":
-            final_angle_list = [
-                (284.0, 135, 327.0),
-                (73.0, 135, 34.0),
-                (197.0, 135, 285.0),
-                (18.0, 135, 132.0),
-                (136.0, 135, 124.0),
-                (30.0, 135, 109.0),
-            ]
-        if self.model.experimentinfo.point_group == "31m":
-            final_angle_list = [
-                (288.0, 135, 34.0),
-                (17.0, 135, 346.0),
-                (182.0, 135, 266.0),
-                (56.0, 135, 89.0),
-                (343.0, 135, 101.0),
-                (235.0, 135, 286.0),
-            ]
-        if self.model.experimentinfo.point_group == "32":
-            final_angle_list = [
-                (27.0, 135, 30.0),
-                (17.0, 135, 83.0),
-                (218.0, 135, 320.0),
-                (342.0, 135, 209.0),
-                (252.0, 135, 3.0),
-                (277.0, 135, 55.0),
-            ]
-        if self.model.experimentinfo.point_group == "321":
-            final_angle_list = [
-                (300.0, 135, 198.0),
-                (2.0, 135, 140.0),
-                (343.0, 135, 101.0),
-                (267.0, 135, 15.0),
-                (262.0, 135, 32.0),
-                (161.0, 135, 259.0),
-            ]
-        if self.model.experimentinfo.point_group == "3m":
-            final_angle_list = [
-                (235.0, 135, 286.0),
-                (16.0, 135, 60.0),
-                (0.0, 135, 119.0),
-                (170.0, 135, 255.0),
-                (187.0, 135, 280.0),
-                (30.0, 135, 161.0),
-            ]
-        if self.model.experimentinfo.point_group == "-31m":
-            final_angle_list = [
-                (73.0, 135, 34.0),
-                (215.0, 135, 337.0),
-                (89.0, 135, 215.0),
-                (158.0, 135, 249.0),
-                (324.0, 135, 116.0),
-                (293.0, 135, 176.0),
-            ]
-        if self.model.experimentinfo.point_group == "-3m":
-            final_angle_list = [
-                (157.0, 135, 190.0),
-                (339.0, 135, 101.0),
-                (10, 135, 0),
-                (115.0, 135, 264.0),
-                (334.0, 135, 196.0),
-                (330.0, 135, 21.0),
-            ]
-        if self.model.experimentinfo.point_group == "-3m1":
-            final_angle_list = [
-                (75.0, 135, 169.0),
-                (73.0, 135, 78.0),
-                (172.0, 135, 251.0),
-                (321.0, 135, 237.0),
-                (317.0, 135, 78.0),
-                (126.0, 135, 249.0),
-            ]
-        if self.model.experimentinfo.point_group == "6":
-            final_angle_list = [
-                (322.0, 135, 240.0),
-                (161.0, 135, 259.0),
-                (334.0, 135, 209.0),
-                (154.0, 135, 244.0),
-                (328.0, 135, 103.0),
-            ]
-        if self.model.experimentinfo.point_group == "-6":
-            final_angle_list = [
-                (10.0, 135, 26.0),
-                (243.0, 135, 24.0),
-                (322.0, 135, 240.0),
-                (194.0, 135, 309.0),
-                (114.0, 135, 213.0),
-            ]
-        if self.model.experimentinfo.point_group == "6/m":
-            final_angle_list = [
-                (95.0, 135, 43.0),
-                (36.0, 135, 235.0),
-                (218.0, 135, 320.0),
-                (97.0, 135, 82.0),
-                (142.0, 135, 140.0),
-            ]
-        if self.model.experimentinfo.point_group == "622":
-            final_angle_list = [
-                (128.0, 135, 235.0),
-                (325.0, 135, 73.0),
-                (27.0, 135, 30.0),
-                (275.0, 135, 223.0),
-                (336.0, 135, 209.0),
-            ]
-        if self.model.experimentinfo.point_group == "6mm":
-            final_angle_list = [
-                (65.0, 135, 166.0),
-                (317.0, 135, 78.0),
-                (277.0, 135, 77.0),
-                (38.0, 135, 95.0),
-                (250.0, 135, 287.0),
-            ]
-        if self.model.experimentinfo.point_group == "-62m":
-            final_angle_list = [
-                (6.0, 135, 316.0),
-                (342.0, 135, 209.0),
-                (92.0, 135, 261.0),
-                (249.0, 135, 0.0),
-                (95.0, 135, 240.0),
-            ]
-        if self.model.experimentinfo.point_group == "-6m2":
-            final_angle_list = [
-                (238.0, 135, 323.0),
-                (249.0, 135, 0.0),
-                (255.0, 135, 357.0),
-                (200.0, 135, 324.0),
-                (343.0, 135, 101.0),
-            ]
-        if self.model.experimentinfo.point_group == "6/mmm":
-            final_angle_list = [
-                (73.0, 135, 34.0),
-                (219.0, 135, 337.0),
-                (321.0, 135, 88.0),
-                (324.0, 135, 116.0),
-                (288.0, 135, 55.0),
-            ]
-        if self.model.experimentinfo.point_group == "23":
-            final_angle_list = [
-                (30.0, 135, 161.0),
-                (65.0, 135, 166.0),
-                (161.0, 135, 259.0),
-                (300.0, 135, 198.0),
-                (2.0, 135, 140.0),
-            ]
-        if self.model.experimentinfo.point_group == "m-3":
-            final_angle_list = [
-                (353.0, 135, 318.0),
-                (279.0, 135, 262.0),
-                (27.0, 135, 343.0),
-                (161.0, 135, 259.0),
-                (76.0, 135, 182.0),
-            ]
-        if self.model.experimentinfo.point_group == "432":
-            final_angle_list = [
-                (115.0, 135, 264.0),
-                (36.0, 135, 235.0),
-                (147.0, 135, 141.0),
-                (187.0, 135, 280.0),
-                (89.0, 135, 215.0),
-            ]
-        if self.model.experimentinfo.point_group == "-43m":
-            final_angle_list = [
-                (30.0, 135, 161.0),
-                (262.0, 135, 26.0),
-                (264.0, 135, 324.0),
-                (95.0, 135, 43.0),
-                (153.0, 135, 130.0),
-            ]
-        if self.model.experimentinfo.point_group == "m-3m":
-            final_angle_list = [
-                (19.0, 135, 13.0),
-                (344.0, 135, 208.0),
-                (277.0, 135, 55.0),
-                (38.0, 135, 95.0),
-                (11.0, 135, 337.0),
-            ]
+        if self.angleplan_running:
+            print("angle plan optimization already running")
+            return
+        self._angleplan_task = asyncio.create_task(self.run_angleplan_optimization())
+
+    def cancel_angleplan_optimization(self) -> None:
+        if not self.angleplan_running or self.model.angleplan.optimization_status != "running":
+            return
+        # checked by the search before every step, the result of a cancelled job is dropped
+        if self._angleplan_cancel is not None:
+            self._angleplan_cancel.set()
+        self.model.angleplan.optimization_status = "cancelling"
+        self.update_view()
 
+    def stop_angleplan_optimization(self) -> None:
+        if not self.angleplan_running or self.model.angleplan.optimization_status != "running":
+            return
+        # same signal as cancel, but the angles accepted so far are applied as the plan
+        if self._angleplan_cancel is not None:
+            self._angleplan_cancel.set()
+        self.model.angleplan.optimization_status = "stopping"
+        self.update_view()
+
+    def _angleplan_worker(self) -> Tuple[ProcessPoolExecutor, Any, Any]:
+        from .angle_plan import init_angleplan_worker
+
+        if self._angleplan_executor is None:
+            context = multiprocessing.get_context("spawn")
+            self._angleplan_progress = context.Queue()
+            self._angleplan_cancel = context.Event()
+            self._angleplan_executor = ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=context,
+                initializer=init_angleplan_worker,
+                initargs=(self._angleplan_progress, self._angleplan_cancel),
+            )
+        return self._angleplan_executor, self._angleplan_progress, self._angleplan_cancel
+
+    async def run_angleplan_optimization(self) -> None:
+        from ..models.plan_library import PlanLibrary, goniometer_limits
+        from .angle_plan import angleplan_display, angleplan_job, angleplan_settings
+
+        settings = angleplan_settings(self)
+        plan = None
+        # the library holds plans of the default (hexahedron) coverage model
+        if settings["coverage_model"] == "hexahedron":
+            plan = PlanLibrary.load().lookup(
+                settings["instrument"],
+                goniometer_limits(settings["instrument"]),
+                settings["point_group"],
+                settings["centering"],
+            )
+        angleplan = self.model.angleplan
+        angleplan.optimization_status = "running"
+        angleplan.optimization_step = 0
+        angleplan.optimization_coverage = 0.0
+        angleplan.optimization_best_angle = []
+        angleplan.optimization_curve = []
+        self.view_state.is_uninterruptable = True
+        self.update_view()
+        self.update_optimization_curve_figure()
+
+        executor = None
+        loop = asyncio.get_running_loop()
+        try:
+            if plan is not None:
+                # precomputed plans are used as they are: only the panes are built, in this process, and the
+                # optimization worker is not started
+                print("plan library", plan.key, "coverage", plan.coverage, "engine version", plan.engine_version)
+                result = await loop.run_in_executor(None, angleplan_display, settings)
+                result["angles"] = plan.angles
+            else:
+                executor, progress_queue, cancel_event = self._angleplan_worker()
+                cancel_event.clear()
+                future = loop.run_in_executor(executor, angleplan_job, settings)
+                while not future.done():
+                    await asyncio.wait({future}, timeout=self._angleplan_progress_interval)
+                    latest = None
+                    try:
+                        while True:
+                            latest = progress_queue.get_nowait()
+                            angleplan.optimization_curve.append([latest[0], latest[1] * 100])
+                    except queue.Empty:
+                        pass
+                    if latest is not None:
+                        angleplan.optimization_step, coverage, angleplan.optimization_best_angle = latest
+                        angleplan.optimization_coverage = coverage * 100
+                        self.angleplan_bind.update_in_view(angleplan)
+                        self.update_optimization_curve_figure()
+                result = future.result()
+        except Exception as e:
+            print("angle plan optimization failed:", e)
+            angleplan.optimization_status = "failed"
+            if executor is not None:
+                # a crashed worker leaves the pool broken, the next run starts a new one
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._angleplan_executor = None
+        else:
+            if angleplan.optimization_status == "cancelling":
+                angleplan.optimization_status = "cancelled"
+            else:
+                # the rows are built first and swapped in with a single assignment, the table never shows a
+                # partial plan
+                angleplan.qpane_cones = result["qpane_cones"]
+                angleplan.symmetry_operations = result["symmetry_operations"]
+                angleplan.angle_list = self.angle_list_rows(result["angles"], settings["point_group"])
+                angleplan.optimization_status = "done"
+                print("vm optimize done for angle_list", angleplan.angle_list)
+        finally:
+            self.view_state.is_uninterruptable = False
+            self.update_view()
+
+    def angle_list_rows(self, final_angle_list: Sequence[Sequence[float]], point_group: str) -> List[Dict[str, Any]]:
         print(
             "update angle_list",
         )
-        self.model.angleplan.angle_list = []
+        angle_list = []
         for i in range(len(final_angle_list)):
             r = {
                 "id": i + 1,
-                "title": "pg:" + self.model.experimentinfo.point_group + "_" + str(i + 1),
+                "title": "pg:" + point_group + "_" + str(i + 1),
                 "comment": "resetted",
                 "phi": float(final_angle_list[i][0]),
                 "chi": float(final_angle_list[i][1]),
@@ -1162,9 +506,8 @@ class MainViewModel:
                 "wait_for": "PCharge",
                 "value": 1,
             }
-            self.model.angleplan.angle_list.append(r)
-
-        print("vm optimize done for angle_list", self.model.angleplan.angle_list)
+            angle_list.append(r)
+        return angle_list
 
 
 """
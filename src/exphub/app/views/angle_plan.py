@@ -20,6 +20,7 @@ class AnglePlanView:
         self.view_model.angleplan_bind.connect("model_angleplan")
         self.view_model.eiccontrol_bind.connect("model_eiccontrol")
         self.view_model.angleplan_updatefigure_coverage_bind.connect(self.update_figure_coverage)
+        self.view_model.angleplan_updatefigure_curve_bind.connect(self.update_figure_curve)
         self.is_editing = False
         self.fig_c = go.Figure()
         vertices = np.array(
@@ -104,6 +105,10 @@ class AnglePlanView:
         with GridLayout(columns=2, gap="0.5em"):
             InputField(v_model="model_angleplan.plan_name")  # , type="button", label="Upload")
             InputField(v_model="model_angleplan.plan_type", type="select", items="model_angleplan.plan_type_list")
+            InputField(
+                v_model="model_angleplan.coverage_model", type="select", items="model_angleplan.coverage_model_list"
+            )
+            InputField(v_model="model_angleplan.num_workers", type="number")
 
         with HBoxLayout(gap="0.5em"):
             RemoteFileInput(
@@ -246,13 +251,24 @@ class AnglePlanView:
             vuetify.VBtn("Show Coverage", click="trigger('show_coverage')", style="align-self: center;")
             # vuetify.VBtn("Show Coverage", click="trigger('show_coverage',[coverage_fig,])", style="align-self: center;")#noqa
 
+        # coverage against the number of runs, updated live while the optimization runs
+        with HBoxLayout(halign="left", height="25vh", v_show="model_angleplan.optimization_curve.length > 0"):
+            self.figure_curve = plotly.Figure()
+            self.figure_curve.update(self.view_model.model.angleplan.get_figure_optimization_curve())
+
         with HBoxLayout(gap="0.5em", valign="center"):
             RemoteFileInput(v_model="model_eiccontrol.token_file", base_paths=["/HFIR", "/SNS"])
             vuetify.VBtn("Authenticate", click=self.view_model.call_load_token)
             InputField(v_model="model_eiccontrol.is_simulation", type="checkbox")
             # vuetify.VBtn("Update Strategy", click=self.view_model.update_view, style="align-self: center;")
             # html.Div(style="height: 20px;")
+            InputField(v_model="model_eiccontrol.schedule_before_submit", type="checkbox")
             vuetify.VBtn("Submit through EIC", click=self.view_model.submit_angle_plan)
+            html.P(
+                "Motor dead time {{ model_eiccontrol.dead_time_before.toFixed(0) }} s"
+                " -> {{ model_eiccontrol.dead_time_after.toFixed(0) }} s",
+                v_if="model_eiccontrol.schedule_before_submit && model_eiccontrol.dead_time_before > 0",
+            )
             html.P(
                 "Submission Successful.",
                 v_if="model_eiccontrol.eic_submission_success",
@@ -344,3 +360,7 @@ class AnglePlanView:
     def update_figure_coverage(self, fig: go.Figure) -> None:
         self.figure_coverage.update(fig)
         self.figure_coverage.state.flush()
+
+    def update_figure_curve(self, fig: go.Figure) -> None:
+        self.figure_curve.update(fig)
+        self.figure_curve.state.flush()
@@ -50,13 +50,33 @@ class TabContentPanel:
                     )
                     # vuetify.VBtn("OK",  color="primary", block=True)
 
-        with vuetify.VDialog(v_model="controls.is_uninterruptable", max_width="500px"):
+        with vuetify.VDialog(v_model="controls.is_uninterruptable", max_width="500px", persistent=True):
             with vuetify.VCard():
                 with vuetify.VCardTitle("Waiting for Algorithm"):
                     vuetify.VCardText(
                         "Algorithm is running in background, waiting for completion.",
                         classes="text-caption text-center",
                     )
+                vuetify.VCardText(
+                    "{{ model_angleplan.optimization_status }}: step {{ model_angleplan.optimization_step }}, "
+                    "coverage {{ model_angleplan.optimization_coverage.toFixed(1) }} %, "
+                    "last angle {{ model_angleplan.optimization_best_angle }}",
+                    classes="text-caption text-center",
+                )
+                vuetify.VProgressLinear(model_value=("model_angleplan.optimization_coverage", 0))
+                with vuetify.VCardActions():
+                    vuetify.VBtn(
+                        "Stop and Keep Plan",
+                        click=self.view_model.stop_angleplan_optimization,
+                        disabled=("model_angleplan.optimization_status != 'running'",),
+                        color="primary",
+                    )
+                    vuetify.VBtn(
+                        "Cancel",
+                        click=self.view_model.cancel_angleplan_optimization,
+                        disabled=("model_angleplan.optimization_status != 'running'",),
+                        color="primary",
+                    )
 
     #                    with vuetify.VCardActions():
     #                        vuetify.VBtn("OK", click=self.view_model.close_under_development_dialog, color="primary",
@@ -0,0 +1,730 @@
+"""Tests for the angle plan engine."""
+
+import threading
+from itertools import islice, permutations, product
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+import pytest
+
+from exphub.app.models import angle_plan_engine
+from exphub.app.models.angle_plan_engine import (
+    AnglePlanner,
+    CoverageCache,
+    CoverageMask,
+    DetectorInstrument,
+    DetectorPane,
+    DirectionIndex,
+    OrientationMaskCache,
+    ParallelCoverageEvaluator,
+    QGrids,
+    SmoothCoverage,
+    UncoveredPoints,
+    contain_points_in_panes,
+    coverage_counts,
+    covered_chunks,
+    euler_angle_lattice,
+    euler_rotation_matrix,
+    fused_covered_chunks,
+    fused_pane_cover,
+    genetic_algorithm,
+    greedy_order,
+    grid_search,
+    multiplicity_by_shell,
+    optimize_angle_with_fixed_given,
+    orientation_masks,
+    orientation_multiplicities,
+    pane_hits,
+    reflection_hkl,
+)
+
+
+def make_instrument(num_pane: int = 6, coverage_model: str = "hexahedron") -> DetectorInstrument:
+    # flat square panes 40 cm from the sample, spread over two-theta and azimuth like TOPAZ banks
+    det_ins_parameter = []
+    for idx_pane in range(num_pane):
+        two_theta = np.radians(40 + 100 * idx_pane / max(num_pane - 1, 1))
+        az_phi = np.radians(360 * idx_pane / num_pane)
+        center_dir = np.array(
+            [np.sin(two_theta) * np.cos(az_phi), np.sin(two_theta) * np.sin(az_phi), np.cos(two_theta)]
+        )
+        u = np.cross(center_dir, [0.0, 0.0, 1.0])
+        u /= np.linalg.norm(u)
+        v = np.cross(center_dir, u)
+        center = 40 * center_dir
+        half = 7.0
+        pane_vertices = np.array(
+            [
+                center - half * u - half * v,
+                center - half * u + half * v,
+                center + half * u - half * v,
+                center + half * u + half * v,
+            ]
+        )
+        det_ins_parameter.append(
+            {
+                "pane_id": idx_pane,
+                "pane_shape": "rectangle",
+                "pane_parameter": {"vertices": pane_vertices, "t_min": 1000, "t_max": 16000},
+            }
+        )
+    det_ins = DetectorInstrument(det_ins_parameter, coverage_model=coverage_model)
+    det_ins.initialize_detector()
+    return det_ins
+
+
+def make_grids(num_sym: int = 3, num_point: int = 4000, seed: int = 0) -> QGrids:
+    rng = np.random.default_rng(seed)
+    qlist = [rng.uniform(-15, 15, size=(num_point, 3)) for _ in range(num_sym)]
+    return QGrids(grid_mode="input", grid_parameter={"num_sym": num_sym, "qlist": qlist})
+
+
+def cubic_operators() -> np.ndarray:
+    # m-3m: all 48 signed permutation matrices
+    return np.array(
+        [
+            np.diag(signs) @ np.eye(3)[list(perm)]
+            for perm in permutations(range(3))
+            for signs in product((1, -1), repeat=3)
+        ]
+    )
+
+
+def reference_contain_points(pane: DetectorPane, points: np.ndarray) -> np.ndarray:
+    # face by face same-side test against the first vertex of the opposite face
+    in_qvolume = np.zeros(points.shape[0])
+    for idx_face in pane.qfaces:
+        a, b, c = pane.qfaces[idx_face][0:3]
+        q0 = pane.qfaces["%d" % (5 - int(idx_face))][0]
+        face_dir = np.cross(b - a, c - a)
+        in_qvolume += np.sign((points - a) @ face_dir) * np.sign(np.dot(face_dir, q0 - a))
+    return in_qvolume >= len(pane.qfaces) - 1
+
+
+def test_pane_halfspace_test_matches_reference() -> None:
+    det_ins = make_instrument()
+    points = make_grids(num_sym=1, num_point=20000).points[0]
+
+    for pane in det_ins.detector_panes:
+        expected = reference_contain_points(pane, points)
+        assert np.any(expected)
+        np.testing.assert_array_equal(pane.contain_points_in_pane_cone(points), expected)
+
+
+def test_batched_coverage_matches_per_pane_test() -> None:
+    det_ins = make_instrument()
+    grids = make_grids()
+
+    expected_perpane = np.array(
+        [
+            np.any([reference_contain_points(pane, points) for points in grids.rotated_points], axis=0)
+            for pane in det_ins.detector_panes
+        ]
+    )
+    coverage, coverage_perpane = grids.get_coverage(det_ins, per_pane=True)
+
+    assert np.any(coverage)
+    np.testing.assert_array_equal(coverage_perpane, expected_perpane)
+    np.testing.assert_array_equal(coverage, np.any(expected_perpane, axis=0))
+    np.testing.assert_array_equal(grids.get_coverage(det_ins), coverage)
+
+
+def test_batched_kernel_keeps_point_shape() -> None:
+    det_ins = make_instrument(num_pane=3)
+    points = make_grids(num_sym=2, num_point=50).rotated_points
+    planes = det_ins.stack_face_planes()
+
+    assert planes.shape == (3, 6, 4)
+    assert contain_points_in_panes(points, planes).shape == (2, 50)
+    assert contain_points_in_panes(points, planes, per_pane=True).shape == (2, 50, 3)
+
+
+@pytest.mark.parametrize("coverage_model", ["hexahedron", "ewald"])
+def test_fused_kernel_matches_numpy_kernel(coverage_model: str) -> None:
+    # the uncompiled kernel runs as plain Python, so this check does not need numba
+    det_ins = make_instrument(coverage_model=coverage_model)
+    grids = make_grids(num_sym=2, num_point=150)
+    _, flat_points, q_len = grids.flat_points()
+    num_grid_point, owner = grids.point_owner()
+    angles = euler_angle_lattice([[0, 360, 120], [135, 135, 1], [0, 360, 120]])
+
+    for count_hits in (False, True):
+        expected = dict(
+            covered_chunks(det_ins.base_pane_table, flat_points, q_len, owner, num_grid_point, angles, None, count_hits)
+        )
+        fused = dict(
+            fused_covered_chunks(
+                fused_pane_cover,
+                det_ins.base_pane_table,
+                flat_points,
+                q_len,
+                owner,
+                num_grid_point,
+                angles,
+                count_hits=count_hits,
+            )
+        )
+
+        assert fused.keys() == expected.keys()
+        for start, covered in fused.items():
+            assert covered.dtype == (np.uint8 if count_hits else bool) and covered.any()
+            np.testing.assert_array_equal(covered, expected[start])
+
+
+def test_compiled_kernel_matches_numpy_kernel(monkeypatch: pytest.MonkeyPatch) -> None:
+    pytest.importorskip("numba")
+    det_ins = make_instrument()
+    grids = make_grids(num_point=2000)
+    angles = euler_angle_lattice([[0, 360, 30], [135, 135, 1], [0, 360, 30]])
+
+    monkeypatch.setattr(angle_plan_engine, "use_fused_kernel", True)
+    compiled = coverage_counts(det_ins, grids, angles)
+    monkeypatch.setattr(angle_plan_engine, "use_fused_kernel", False)
+    np.testing.assert_array_equal(compiled, coverage_counts(det_ins, grids, angles))
+
+
+def forward_q(pane: DetectorPane, pixel: np.ndarray, tof: np.ndarray) -> np.ndarray:
+    # q = k (x / |x| - beam) of a neutron detected at pixel (fractions along the two edges from vertex 0)
+    a, b, c = pane.rvertices[:3]
+    x = a + pixel[:, :1] * (b - a) + pixel[:, 1:] * (c - a)
+    path = np.linalg.norm(x, axis=1)
+    k = (pane.L1 + path) / tof * angle_plan_engine.vtok
+    return k[:, np.newaxis] * (x / path[:, np.newaxis] - [0.0, 0.0, 1.0])
+
+
+def test_ewald_model_matches_forward_kinematics() -> None:
+    det_ins = make_instrument(coverage_model="ewald")
+    hexahedron = make_instrument()
+    rng = np.random.default_rng(1)
+    num_hexahedron_miss = 0
+
+    for idx_pane, pane in enumerate(det_ins.detector_panes):
+        pane_table = det_ins.pane_table()
+        tof = rng.uniform(1010, 15900, 5000)
+        seen = forward_q(pane, rng.uniform(0.01, 0.99, (5000, 2)), tof)
+        off_pane = forward_q(pane, np.column_stack((rng.uniform(1.01, 1.2, 5000), rng.uniform(0, 1, 5000))), tof)
+        slow = forward_q(pane, rng.uniform(0.01, 0.99, (5000, 2)), rng.uniform(16100, 20000, 5000))
+
+        assert np.all(contain_points_in_panes(seen, pane_table, per_pane=True)[:, idx_pane])
+        assert not np.any(contain_points_in_panes(off_pane, pane_table, per_pane=True)[:, idx_pane])
+        assert not np.any(contain_points_in_panes(slow, pane_table, per_pane=True)[:, idx_pane])
+        num_hexahedron_miss += np.count_nonzero(
+            ~contain_points_in_panes(seen, hexahedron.pane_table(), per_pane=True)[:, idx_pane]
+        )
+    # the flat faces between the corner k-vectors cut off part of the measured volume
+    assert num_hexahedron_miss > 0
+
+    # sample rotations turn the beam with the panes
+    grids = make_grids()
+    euler_angles = (30.0, 135.0, 250.0)
+    expected = contain_points_in_panes(
+        np.asarray(grids.rotated_points) @ euler_rotation_matrix(euler_angles), det_ins.pane_table()
+    )
+    coverage = grids.get_coverage(det_ins, euler_angles=euler_angles)
+    assert np.any(coverage)
+    np.testing.assert_array_equal(coverage, np.any(expected, axis=0))
+
+
+def test_orientation_coverage_rotates_points_not_panes() -> None:
+    det_ins = make_instrument()
+    grids = make_grids()
+    euler_angles = (30.0, 135.0, 250.0)
+    rotation = euler_rotation_matrix(euler_angles)
+
+    coverage = grids.get_coverage(det_ins, euler_angles=euler_angles)
+
+    # rotating the panes by R is the same as testing R^T q against the unrotated panes
+    expected = contain_points_in_panes(np.asarray(grids.rotated_points) @ rotation, det_ins.pane_table())
+    assert np.any(coverage)
+    np.testing.assert_array_equal(coverage, np.any(expected, axis=0))
+    np.testing.assert_array_equal(grids.get_coverage(det_ins, euler_angles=(0, 0, 0)), grids.get_coverage(det_ins))
+
+
+def test_coverage_counts_matches_single_orientations() -> None:
+    det_ins = make_instrument()
+    grids = make_grids()
+    euler_angle_ranges = [[0, 300, 60], [135, 135, 1], [0, 300, 100]]
+    angles = euler_angle_lattice(euler_angle_ranges)
+    base_mask = grids.get_coverage(det_ins, euler_angles=(0, 135, 0))
+
+    counts = coverage_counts(det_ins, grids, angles, base_mask)
+
+    expected = [np.sum(grids.get_coverage(det_ins, euler_angles=a) & ~base_mask) for a in angles]
+    assert angles.shape == (24, 3)
+    np.testing.assert_array_equal(counts, expected)
+    assert grid_search(det_ins, grids, euler_angle_ranges, base_mask) == tuple(angles[np.argmax(expected)])
+
+
+def test_working_set_counts_match_full_grid() -> None:
+    det_ins = make_instrument()
+    grids = make_grids()
+    angles = euler_angle_lattice([[0, 300, 60], [135, 135, 1], [0, 300, 100]])
+    base_mask = grids.get_coverage(det_ins, euler_angles=(0, 135, 0))
+    working_set = UncoveredPoints(grids, base_mask)
+
+    assert working_set.size == np.count_nonzero(~base_mask)
+    np.testing.assert_array_equal(
+        coverage_counts(det_ins, grids, angles, working_set=working_set),
+        coverage_counts(det_ins, grids, angles, base_mask),
+    )
+
+    new_mask = grids.get_coverage(det_ins, euler_angles=angles[5])
+    working_set.update(new_mask)
+    np.testing.assert_array_equal(working_set.index, np.flatnonzero(~(base_mask | new_mask)))
+    np.testing.assert_array_equal(
+        coverage_counts(det_ins, grids, angles, working_set=working_set),
+        coverage_counts(det_ins, grids, angles, base_mask | new_mask),
+    )
+
+
+def test_packed_mask_gain_matches_bool_masks() -> None:
+    det_ins = make_instrument()
+    grids = make_grids(num_point=4003)
+    angles = euler_angle_lattice([[0, 300, 60], [135, 135, 1], [0, 300, 100]])
+    base_mask = grids.get_coverage(det_ins, euler_angles=(0, 135, 0))
+    base = CoverageMask.from_bool(base_mask)
+
+    masks = orientation_masks(det_ins, grids, angles)
+    bool_masks = masks.to_bool()
+
+    assert masks.bits.shape == (24, 501)
+    assert base.count() == np.count_nonzero(base_mask)
+    np.testing.assert_array_equal(masks.count(), np.count_nonzero(bool_masks, axis=1))
+    np.testing.assert_array_equal(base.gain(masks), coverage_counts(det_ins, grids, angles, base_mask))
+    np.testing.assert_array_equal((base | masks[3]).to_bool(), base_mask | bool_masks[3])
+    np.testing.assert_array_equal(masks[3].without(base).to_bool(), bool_masks[3] & ~base_mask)
+
+    working_set = UncoveredPoints(grids, base)
+    partial = orientation_masks(det_ins, grids, angles, working_set)
+    np.testing.assert_array_equal(partial.to_bool(), bool_masks & ~base_mask)
+
+
+def test_lazy_greedy_matches_grid_search_plan() -> None:
+    det_ins = make_instrument()
+    grids = make_grids(num_point=1000)
+    euler_angle_ranges = [[0, 360, 45], [135, 135, 1], [0, 360, 45]]
+
+    start = det_ins.num_coverage_evaluations
+    grid_plan, grid_coverage = optimize_angle_with_fixed_given(
+        grids, det_ins, [(0, 135, 0)], euler_angle_ranges, strategy="grid"
+    )
+    grid_evaluations = det_ins.num_coverage_evaluations - start
+    start = det_ins.num_coverage_evaluations
+    lazy_plan, lazy_coverage = optimize_angle_with_fixed_given(
+        grids, det_ins, [(0, 135, 0)], euler_angle_ranges, strategy="lazy"
+    )
+    lazy_evaluations = det_ins.num_coverage_evaluations - start
+
+    assert len(grid_plan) > 3
+    assert lazy_plan == grid_plan
+    np.testing.assert_array_equal(lazy_coverage, grid_coverage)
+    assert lazy_evaluations < grid_evaluations
+
+
+def test_smooth_surrogate_gradient_matches_finite_differences() -> None:
+    det_ins = make_instrument()
+    surrogate = SmoothCoverage(det_ins, UncoveredPoints(make_grids(num_point=1000)), temperature=0.1)
+    angles = np.array([30.0, 120.0, 70.0])
+
+    value, gradient = surrogate.value_and_gradient(angles)
+    step = 1e-3
+    finite_differences = [
+        (surrogate.value_and_gradient(angles + axis * step)[0] - surrogate.value_and_gradient(angles - axis * step)[0])
+        / (2 * step)
+        for axis in np.eye(3)
+    ]
+
+    assert value > 0
+    np.testing.assert_allclose(gradient, finite_differences, rtol=1e-4, atol=1e-6)
+
+
+def test_smooth_strategy_gains_coverage_with_few_exact_evaluations() -> None:
+    det_ins = make_instrument()
+    grids = make_grids(num_point=1000)
+    euler_angle_ranges = [[0, 360, 45], [135, 135, 1], [0, 360, 45]]
+
+    start = det_ins.num_coverage_evaluations
+    grid_plan, grid_coverage = optimize_angle_with_fixed_given(
+        grids, det_ins, [(0, 135, 0)], euler_angle_ranges, strategy="grid"
+    )
+    grid_evaluations = det_ins.num_coverage_evaluations - start
+    steps = []
+    start = det_ins.num_coverage_evaluations
+    smooth_plan, smooth_coverage = optimize_angle_with_fixed_given(
+        grids,
+        det_ins,
+        [(0, 135, 0)],
+        euler_angle_ranges,
+        strategy="smooth",
+        progress=lambda step, coverage, angle: steps.append(coverage),
+    )
+    smooth_evaluations = det_ins.num_coverage_evaluations - start
+
+    assert np.all(np.diff(steps) > 0)
+    assert all(angle[1] == 135 for angle in smooth_plan)
+    assert np.mean(smooth_coverage) >= np.mean(grid_coverage) - 0.01
+    assert smooth_evaluations < grid_evaluations / 5
+
+
+def test_mask_cache_quantizes_angles_and_evicts_least_recently_used() -> None:
+    det_ins = make_instrument()
+    grids = make_grids(num_point=1000)
+    cache = OrientationMaskCache(det_ins, grids, max_bytes=2 * 125)
+    assert cache.capacity == 2
+
+    masks = cache.masks([[10, 135, 20], [10.001, 135, 20], [370, 135, -340]])
+    assert (cache.hits, cache.misses, len(cache)) == (2, 1, 1)
+    np.testing.assert_array_equal(masks.bits[1:], masks.bits[[0, 0]])
+    np.testing.assert_array_equal(masks.to_bool()[0], grids.get_coverage(det_ins, euler_angles=[10, 135, 20]))
+
+    # 10 is used again after 30, so 30 goes when 50 comes in
+    for angle in ([30, 135, 20], [10, 135, 20], [50, 135, 20]):
+        cache.masks([angle])
+    assert (cache.hits, cache.misses, cache.evictions) == (3, 3, 1)
+    assert set(cache.entries) == set(cache.keys([[10, 135, 20], [50, 135, 20]]))
+
+
+def test_mask_cache_is_shared_by_the_searches_of_a_session() -> None:
+    det_ins = make_instrument()
+    grids = make_grids(num_point=1000)
+    euler_angle_ranges = [[0, 360, 45], [135, 135, 1], [0, 360, 45]]
+    uncached_plan, uncached_coverage = optimize_angle_with_fixed_given(
+        grids, det_ins, [(0, 135, 0)], euler_angle_ranges, strategy="grid"
+    )
+
+    cache = OrientationMaskCache(det_ins, grids)
+    plan, coverage = optimize_angle_with_fixed_given(
+        grids, det_ins, [(0, 135, 0)], euler_angle_ranges, strategy="grid", mask_cache=cache
+    )
+    assert plan == uncached_plan
+    np.testing.assert_array_equal(coverage, uncached_coverage)
+    # phi and omega 0 and 360 are the same orientation: 8 x 8 masks for the 9 x 9 lattice
+    num_lattice = len(euler_angle_lattice(euler_angle_ranges))
+    assert cache.misses == 64
+    assert (cache.hits + cache.misses) % num_lattice == 0 and cache.hits > cache.misses
+    # gains read on the bytes of the working set only
+    lattice = euler_angle_lattice(euler_angle_ranges)
+    working_set = UncoveredPoints(grids, coverage)
+    np.testing.assert_array_equal(
+        cache.gains(CoverageMask.from_bool(coverage), lattice, working_set),
+        coverage_counts(det_ins, grids, lattice, working_set=working_set),
+    )
+    planner = AnglePlanner(grids, det_ins, [(0, 135, 0)], euler_angle_ranges, "grid", max_step=1)
+    list(planner)
+    assert planner.mask_cache is None
+
+    # a later search of the same session starts from the lattice masks already in the cache
+    start = det_ins.num_coverage_evaluations
+    lazy_plan, _ = optimize_angle_with_fixed_given(
+        grids, det_ins, [(0, 135, 0)], euler_angle_ranges, strategy="lazy", mask_cache=cache
+    )
+    assert lazy_plan == plan and cache.misses == 64
+    # only the fixed and the accepted angles are evaluated
+    assert det_ins.num_coverage_evaluations - start == len(plan)
+
+
+def test_genetic_search_scores_whole_plans() -> None:
+    det_ins = make_instrument()
+    grids = make_grids(num_point=1000)
+    candidates = euler_angle_lattice([[0, 360, 45], [135, 135, 1], [0, 360, 45]])
+    base = grids.get_coverage(det_ins, euler_angles=(0, 135, 0))
+    cache = OrientationMaskCache(det_ins, grids)
+
+    plan, covered = genetic_algorithm(
+        det_ins, grids, candidates, 4, base, population_size=32, num_generations=20, mask_cache=cache
+    )
+    masks = orientation_masks(det_ins, grids, candidates[plan])
+    assert covered == np.count_nonzero(base | np.any(masks.to_bool(), axis=0))
+    # greedy order: every prefix is the best extension of the previous one within the plan
+    assert list(plan) == [plan[i] for i in greedy_order(masks, CoverageMask.from_bool(base))]
+    gains = CoverageMask.from_bool(base).gain(masks)
+    assert gains[0] == gains.max()
+
+
+def test_genetic_strategy_is_never_longer_than_greedy() -> None:
+    det_ins = make_instrument()
+    grids = make_grids(num_point=1000)
+    euler_angle_ranges = [[0, 360, 45], [135, 135, 1], [0, 360, 45]]
+    greedy_plan, greedy_coverage = optimize_angle_with_fixed_given(
+        grids, det_ins, [(0, 135, 0)], euler_angle_ranges, strategy="lazy"
+    )
+    steps = []
+
+    plan, coverage = optimize_angle_with_fixed_given(
+        grids,
+        det_ins,
+        [(0, 135, 0)],
+        euler_angle_ranges,
+        strategy="genetic",
+        progress=lambda step, coverage, angle: steps.append((step, angle)),
+    )
+
+    assert plan[0] == (0, 135, 0) and len(plan) <= len(greedy_plan)
+    assert np.count_nonzero(coverage) >= np.count_nonzero(greedy_coverage)
+    np.testing.assert_array_equal(coverage, np.any(orientation_masks(det_ins, grids, plan).to_bool(), axis=0))
+    assert steps == [(step + 1, angle) for step, angle in enumerate(plan[1:])]
+    with pytest.raises(ValueError):
+        optimize_angle_with_fixed_given(
+            grids, det_ins, [(0, 135, 0)], euler_angle_ranges, strategy="genetic", objective="multiplicity"
+        )
+
+
+def test_progress_reports_every_step_and_cancel_stops_the_search() -> None:
+    det_ins = make_instrument()
+    grids = make_grids(num_point=1000)
+    euler_angle_ranges = [[0, 360, 45], [135, 135, 1], [0, 360, 45]]
+    cancel = threading.Event()
+    steps = []
+
+    def progress(step: int, coverage: float, angle: Tuple[float, ...]) -> None:
+        steps.append((step, coverage, angle))
+        if step == 2:
+            cancel.set()
+
+    plan, coverage = optimize_angle_with_fixed_given(
+        grids, det_ins, [(0, 135, 0)], euler_angle_ranges, strategy="lazy", progress=progress, cancel=cancel
+    )
+
+    assert [step for step, _, _ in steps] == [1, 2]
+    assert steps[0][1] < steps[1][1] == np.mean(coverage)
+    assert plan[-2:] == [angle for _, _, angle in steps]
+
+
+def test_anytime_planner_prefix_is_the_full_plan_prefix() -> None:
+    det_ins = make_instrument()
+    grids = make_grids(num_point=1000)
+    euler_angle_ranges = [[0, 360, 45], [135, 135, 1], [0, 360, 45]]
+    full_plan, full_coverage = optimize_angle_with_fixed_given(
+        grids, det_ins, [(0, 135, 0)], euler_angle_ranges, strategy="lazy"
+    )
+
+    planner = AnglePlanner(grids, det_ins, [(0, 135, 0)], euler_angle_ranges, strategy="lazy")
+    steps = list(islice(planner, 3))
+
+    assert [plan_step.step for plan_step in steps] == [1, 2, 3]
+    assert planner.angle_list == full_plan[:5]
+    assert [plan_step.angle for plan_step in steps] == full_plan[2:5]
+    coverage = [plan_step.coverage for plan_step in steps]
+    assert coverage == sorted(coverage) and coverage[-1] == np.mean(planner.current_coverage)
+    gains = [plan_step.gain for plan_step in steps]
+    assert gains == sorted(gains, reverse=True) and min(gains) > 0
+    assert np.count_nonzero(full_coverage) >= np.count_nonzero(planner.current_coverage)
+    assert steps[0].elapsed <= steps[-1].elapsed
+
+
+def test_multiplicity_counts_symmetry_copies_in_the_coverage_pass() -> None:
+    det_ins = make_instrument()
+    grids = make_grids(num_sym=4, num_point=1500)
+    _, flat_points, q_len = grids.flat_points()
+    num_grid_point, owner = grids.point_owner()
+    angles = euler_angle_lattice([[0, 360, 90], [135, 135, 1], [0, 360, 90]])
+
+    multiplicities = orientation_multiplicities(det_ins, grids, angles)
+
+    # every flat point as its own column, then summed per grid point
+    per_copy = np.concatenate(
+        [
+            covered
+            for _, covered in covered_chunks(
+                det_ins.base_pane_table, flat_points, q_len, np.arange(len(q_len)), len(q_len), angles, None, True
+            )
+        ]
+    )
+    expected = np.stack([np.bincount(owner, weights=row, minlength=num_grid_point) for row in per_copy])
+    np.testing.assert_array_equal(multiplicities, expected)
+    assert multiplicities.max() > 1
+    np.testing.assert_array_equal(multiplicities > 0, orientation_masks(det_ins, grids, angles).to_bool())
+
+    shells = multiplicity_by_shell(grids, multiplicities.sum(axis=0), num_shell=4, min_multiplicity=2)
+    assert np.all(shells["d_min"] <= shells["d_max"]) and np.all(shells["d_max"][:-1] <= shells["d_min"][1:])
+    assert np.all((0 <= shells["complete"]) & (shells["complete"] <= 1))
+
+
+def test_multiplicity_objective_plans_for_redundancy() -> None:
+    det_ins = make_instrument()
+    grids = make_grids(num_point=1000)
+    euler_angle_ranges = [[0, 360, 45], [135, 135, 1], [0, 360, 45]]
+    coverage_planner = AnglePlanner(grids, det_ins, [(0, 135, 0)], euler_angle_ranges, strategy="lazy")
+    redundancy_planner = AnglePlanner(
+        grids,
+        det_ins,
+        [(0, 135, 0)],
+        euler_angle_ranges,
+        strategy="lazy",
+        objective="multiplicity",
+        min_multiplicity=2,
+    )
+
+    coverage_steps = list(islice(coverage_planner, 4))
+    redundancy_steps = list(islice(redundancy_planner, 4))
+
+    # the coverage objective only tests accepted angles on the working set, no hit counts
+    assert coverage_planner.multiplicity is None
+    coverage_multiplicity = orientation_multiplicities(det_ins, grids, coverage_planner.angle_list).sum(axis=0)
+    np.testing.assert_array_equal(coverage_planner.current_coverage, coverage_multiplicity > 0)
+    expected = orientation_multiplicities(det_ins, grids, redundancy_planner.angle_list).sum(axis=0)
+    np.testing.assert_array_equal(redundancy_planner.multiplicity, expected)
+    np.testing.assert_array_equal(redundancy_planner.current_coverage, expected > 0)
+    redundant = np.mean(redundancy_planner.multiplicity >= 2)
+    assert redundancy_steps[-1].coverage == redundant
+    assert redundant >= np.mean(coverage_multiplicity >= 2)
+    assert coverage_steps[-1].coverage == np.mean(coverage_planner.current_coverage)
+
+
+def test_parallel_evaluator_matches_serial_search() -> None:
+    det_ins = make_instrument()
+    grids = make_grids(num_point=1000)
+    euler_angle_ranges = [[0, 360, 45], [135, 135, 1], [0, 360, 45]]
+    base_mask = grids.get_coverage(det_ins, euler_angles=(0, 135, 0))
+
+    serial_plan, serial_coverage = optimize_angle_with_fixed_given(
+        grids, det_ins, [(0, 135, 0)], euler_angle_ranges, strategy="grid"
+    )
+    with ParallelCoverageEvaluator(det_ins, grids, num_workers=2) as evaluator:
+        assert grid_search(det_ins, grids, euler_angle_ranges, base_mask, evaluator=evaluator) == grid_search(
+            det_ins, grids, euler_angle_ranges, base_mask
+        )
+        assert evaluator.best_angle(euler_angle_lattice(euler_angle_ranges), np.ones_like(base_mask)) == (None, 0)
+        lattice = euler_angle_lattice(euler_angle_ranges)
+        np.testing.assert_array_equal(evaluator.masks(lattice).bits, orientation_masks(det_ins, grids, lattice).bits)
+    parallel_plan, parallel_coverage = optimize_angle_with_fixed_given(
+        grids, det_ins, [(0, 135, 0)], euler_angle_ranges, strategy="grid", num_workers=2
+    )
+
+    assert parallel_plan == serial_plan
+    np.testing.assert_array_equal(parallel_coverage, serial_coverage)
+    # the lazy search computes its lattice masks on the pool
+    lazy_plan, _ = optimize_angle_with_fixed_given(
+        grids, det_ins, [(0, 135, 0)], euler_angle_ranges, strategy="lazy", num_workers=2
+    )
+    assert lazy_plan == serial_plan
+
+
+def test_parallel_evaluator_unlinks_shared_memory_when_the_pool_fails(monkeypatch: pytest.MonkeyPatch) -> None:
+    det_ins = make_instrument()
+    grids = make_grids(num_point=100)
+    shared_memory_class = angle_plan_engine.shared_memory.SharedMemory
+    created = []
+
+    def tracked_shared_memory(*args, **kwargs):  # type: ignore
+        shm = shared_memory_class(*args, **kwargs)
+        created.append(shm.name)
+        return shm
+
+    def failing_context(method: str) -> None:
+        raise OSError("no processes")
+
+    monkeypatch.setattr(angle_plan_engine.shared_memory, "SharedMemory", tracked_shared_memory)
+    monkeypatch.setattr(angle_plan_engine, "get_context", failing_context)
+    with pytest.raises(OSError):
+        ParallelCoverageEvaluator(det_ins, grids, num_workers=2)
+
+    assert created
+    for name in created:
+        with pytest.raises(FileNotFoundError):
+            shared_memory_class(name=name)
+
+
+def test_coverage_cache_reuses_lattice_masks(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    det_ins = make_instrument()
+    grids = make_grids(num_point=1000)
+    euler_angle_ranges = [[0, 360, 45], [135, 135, 1], [0, 360, 45]]
+    angles = euler_angle_lattice(euler_angle_ranges)
+    cache = CoverageCache(str(tmp_path))
+
+    masks = cache.orientation_masks(det_ins, grids, angles)
+    start = det_ins.num_coverage_evaluations
+    cached = cache.orientation_masks(det_ins, grids, angles)
+    assert det_ins.num_coverage_evaluations == start
+    assert isinstance(cached.bits, np.memmap)
+    np.testing.assert_array_equal(cached.bits, masks.bits)
+    np.testing.assert_array_equal(cached.bits, orientation_masks(det_ins, grids, angles).bits)
+
+    plan, _ = optimize_angle_with_fixed_given(grids, det_ins, [(0, 135, 0)], euler_angle_ranges, strategy="grid")
+    start = det_ins.num_coverage_evaluations
+    cached_plan, _ = optimize_angle_with_fixed_given(
+        grids, det_ins, [(0, 135, 0)], euler_angle_ranges, strategy="lazy", coverage_cache=cache
+    )
+    assert cached_plan == plan
+    # only the fixed angles and the accepted orientations are evaluated, the lattice comes from the cache
+    assert det_ins.num_coverage_evaluations - start == len(plan)
+
+    # bitmaps of another engine version are not reused
+    key = angle_plan_engine.coverage_cache_key(det_ins, grids, angles)
+    monkeypatch.setattr(angle_plan_engine, "engine_version", "0")
+    assert angle_plan_engine.coverage_cache_key(det_ins, grids, angles) != key
+
+    # a different lattice is a new entry; with room for one file the older one is evicted
+    small_cache = CoverageCache(str(tmp_path), max_bytes=masks.bits.nbytes + 1000)
+    small_cache.orientation_masks(det_ins, grids, angles[:10])
+    assert len(list(tmp_path.glob("*.npy"))) == 1
+
+
+def test_direction_index_culls_without_losing_hits() -> None:
+    det_ins = make_instrument()
+    _, flat_points, q_len = make_grids(num_sym=2).flat_points()
+    flat_points[:3] = 0.0
+    q_len[:3] = 0.0
+    rotations = np.array([euler_rotation_matrix(a) for a in [(0, 0, 0), (30, 135, 250), (90, 45, 10)]])
+    panes = det_ins.base_pane_table.rotated_many(rotations)
+    direction_index = DirectionIndex(flat_points, q_len)
+
+    candidate_point, _ = direction_index.candidates(panes)
+    hits = pane_hits(flat_points, panes, q_len)
+    indexed_hits = pane_hits(flat_points, panes, direction_index=direction_index)
+
+    assert candidate_point.size < flat_points.shape[0] * panes.num_pane // 4
+    assert hits[0].size > 0
+    np.testing.assert_array_equal(
+        np.sort(np.ravel_multi_index(indexed_hits, (flat_points.shape[0], panes.num_pane))),
+        np.sort(np.ravel_multi_index(hits, (flat_points.shape[0], panes.num_pane))),
+    )
+
+
+def test_asymmetric_grid_matches_full_symmetry_copies() -> None:
+    det_ins = make_instrument()
+    hkl = np.array(list(product(range(-4, 5), repeat=3)), dtype=float)
+    operators = cubic_operators()
+    ub = 1.7 * euler_rotation_matrix((10.0, 20.0, 30.0))
+    full = QGrids(
+        grid_mode="input",
+        grid_parameter={"num_sym": len(operators), "qlist": [hkl @ op.T @ ub.T for op in operators]},
+    )
+    unit = QGrids(grid_mode="asymmetric", grid_parameter={"hkl": hkl, "symmetry_operators": operators, "ub": ub})
+
+    # the cube is closed under m-3m: every equivalent is a grid point, tested once instead of 48 times
+    assert unit.points.shape == hkl.shape
+    assert unit.unit_index.dtype == np.int32
+    assert unit.num_unit == len({tuple(sorted(np.abs(h))) for h in hkl})
+    for euler_angles in [(0, 135, 0), (30, 135, 250)]:
+        unit_coverage = unit.get_coverage(det_ins, euler_angles=euler_angles)
+        full_coverage = full.get_coverage(det_ins, euler_angles=euler_angles)
+        assert unit_coverage.shape == (unit.num_unit,)
+        np.testing.assert_array_equal(unit_coverage[unit.grid_to_unit], full_coverage)
+
+    angles = euler_angle_lattice([[0, 300, 60], [135, 135, 1], [0, 300, 100]])
+    base_mask = unit.get_coverage(det_ins, euler_angles=(0, 135, 0))
+    np.testing.assert_array_equal(
+        coverage_counts(det_ins, unit, angles, working_set=UncoveredPoints(unit, base_mask)),
+        [np.sum(unit.get_coverage(det_ins, euler_angles=a) & ~base_mask) for a in angles],
+    )
+
+
+def test_reflection_hkl_matches_brute_force_shell() -> None:
+    # monoclinic-like cell, |ub @ hkl| = 1/d
+    ub = np.linalg.inv(np.array([[12.0, 0.0, -1.5], [0.0, 7.0, 0.0], [0.0, 0.0, 9.0]])).T
+    ub = euler_rotation_matrix((20.0, 40.0, 60.0)) @ ub
+    hkl = np.array(list(product(range(-40, 41), repeat=3)), dtype=float)
+    d_spacing = 1 / np.maximum(np.linalg.norm(hkl @ ub.T, axis=1), 1e-12)
+
+    shell = reflection_hkl(ub, 0.7, 6.0)
+    expected = hkl[(d_spacing >= 0.7) & (d_spacing <= 6.0)]
+    assert not np.any(np.all(shell == 0, axis=1))
+    np.testing.assert_array_equal(np.unique(shell, axis=0), np.unique(expected, axis=0))
+
+    # a 1.81 A shortest wavelength only reaches d >= 0.905 A, a 160 degree detector limit raises that further
+    reachable = reflection_hkl(ub, 0.7, 6.0, min_wavelength=1.81, max_wavelength=3.5)
+    assert reachable.shape[0] == np.count_nonzero((d_spacing >= 0.905) & (d_spacing <= 6.0))
+    limited = reflection_hkl(ub, 0.7, 6.0, min_wavelength=1.81, two_theta_range=(20.0, 160.0))
+    assert limited.shape[0] == np.count_nonzero((d_spacing >= 0.905 / np.sin(np.radians(80))) & (d_spacing <= 6.0))
@@ -0,0 +1,149 @@
+"""Tests for the cached instrument geometry."""
+
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pytest
+from test_angle_plan_engine import make_grids, make_instrument
+
+from exphub.app.models.angle_plan_engine import (
+    DetectorInstrument,
+    contain_points_in_panes,
+    euler_angle_lattice,
+    euler_rotation_matrix,
+    orientation_masks,
+    vtok,
+)
+from exphub.app.models.instrument_geometry import GeometryCache, InstrumentGeometry
+
+
+def make_geometry(num_bank: int = 3, num_pixel: int = 32) -> InstrumentGeometry:
+    rng = np.random.default_rng(0)
+    shape = (num_bank, num_pixel, num_pixel)
+    arrays = {
+        "l2": rng.uniform(0.39, 0.41, size=shape),
+        "two_theta": rng.uniform(0.5, 2.5, size=shape),
+        "az_phi": rng.uniform(-np.pi, np.pi, size=shape),
+    }
+    return InstrumentGeometry(arrays, {"instrument": "TOPAZ"})
+
+
+def test_pane_vertices_are_inset_bank_corners() -> None:
+    geometry = make_geometry()
+    l2, two_theta, az_phi = geometry.l2, geometry.two_theta, geometry.az_phi
+    x = l2 * 100 * np.sin(two_theta) * np.cos(az_phi)
+    y = l2 * 100 * np.sin(two_theta) * np.sin(az_phi)
+    z = l2 * 100 * np.cos(two_theta)
+
+    parameters = geometry.detector_parameters(edge=2)
+
+    assert len(parameters) == 3
+    for idx_pane, pane in enumerate(parameters):
+        expected = [
+            [x[idx_pane, i, j], y[idx_pane, i, j], z[idx_pane, i, j]] for i, j in [(2, 2), (2, -3), (-3, 2), (-3, -3)]
+        ]
+        np.testing.assert_allclose(pane["pane_parameter"]["vertices"], expected)
+        assert pane["pane_parameter"]["t_min"] == 1000
+
+
+def test_warm_cache_does_not_load_the_instrument(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    geometry = make_geometry()
+    loads = []
+
+    def from_mantid(instrument: str, cal_filename: str = "") -> InstrumentGeometry:
+        loads.append((instrument, cal_filename))
+        return make_geometry()
+
+    monkeypatch.setattr(InstrumentGeometry, "from_mantid", staticmethod(from_mantid))
+    cal_file = tmp_path / "TOPAZ.DetCal"
+    cal_file.write_text("5 1 256 256 6.3 6.3 0.2 39.5 ...")
+    cache = GeometryCache(str(tmp_path / "geometry"))
+
+    cold = cache.get("TOPAZ", cal_filename=str(cal_file), idf="TOPAZ_Definition.xml")
+    warm = cache.get("TOPAZ", cal_filename=str(cal_file), idf="TOPAZ_Definition.xml")
+    # the pane corners come with the metadata, the per-pixel tables stay on disk until used
+    warm.detector_parameters(edge=10)
+    assert set(warm.arrays.loaded) == {"metadata", "pane_vertices_10"}  # type: ignore
+    assert loads == [("TOPAZ", str(cal_file))]
+    assert warm.metadata["idf_version"] == "TOPAZ_Definition.xml"
+    np.testing.assert_array_equal(warm.pane_vertices(), geometry.pane_vertices())
+    np.testing.assert_array_equal(warm.l2, cold.l2)
+
+    # another IDF version or a changed calibration file is a new entry
+    cache.get("TOPAZ", cal_filename=str(cal_file), idf="TOPAZ_Definition_2026.xml")
+    cal_file.write_text("5 1 256 256 6.3 6.3 0.2 39.6 ...")
+    cache.get("TOPAZ", cal_filename=str(cal_file), idf="TOPAZ_Definition.xml")
+    assert len(loads) == 3
+    assert len(list((tmp_path / "geometry").glob("*.npz"))) == 3
+
+
+def make_flat_geometry(det_ins: DetectorInstrument, num_pixel: int = 64) -> InstrumentGeometry:
+    # pixel centers spanning the panes of det_ins, rows along vertex 0 -> 2, columns along vertex 0 -> 1
+    steps = np.linspace(0, 1, num_pixel)
+    positions = np.stack(
+        [
+            a + steps[:, np.newaxis, np.newaxis] * (c - a) + steps[np.newaxis, :, np.newaxis] * (b - a)
+            for a, b, c, _ in (pane.rvertices for pane in det_ins.detector_panes)
+        ]
+    )
+    l2 = np.linalg.norm(positions, axis=3)
+    arrays = {
+        "l2": l2 / 100,
+        "two_theta": np.arccos(positions[..., 2] / l2),
+        "az_phi": np.arctan2(positions[..., 1], positions[..., 0]),
+    }
+    return InstrumentGeometry(arrays, {"instrument": "TOPAZ"})
+
+
+def make_pixel_instrument(det_ins: DetectorInstrument, **lookup_options: Any) -> DetectorInstrument:
+    lookup = make_flat_geometry(det_ins).pixel_lookup(**lookup_options)
+    pixel = DetectorInstrument(det_ins.detector_parameters_list, coverage_model="pixel", pixel_lookup=lookup)
+    pixel.initialize_detector()
+    return pixel
+
+
+def test_pixel_lookup_masks_edge_and_dead_pixels() -> None:
+    det_ins = make_instrument(num_pane=4)
+    positions = make_flat_geometry(det_ins).pixel_positions()
+    dead_pixels = np.zeros(positions.shape[:3], dtype=bool)
+    dead_pixels[1, 30:40, 30:40] = True
+    pane_table = make_pixel_instrument(det_ins, edge=6, dead_pixels=dead_pixels).pane_table()
+    rng = np.random.default_rng(0)
+
+    for idx_bank in range(4):
+        row, column = rng.integers(0, 64, size=(2, 4000))
+        x = positions[idx_bank, row, column]
+        l2 = np.linalg.norm(x, axis=1)
+        tof = rng.uniform(1010, 15900, len(row))
+        k = (1800 + l2) / tof * vtok
+        q = k[:, np.newaxis] * (x / l2[:, np.newaxis] - [0.0, 0.0, 1.0])
+
+        seen = contain_points_in_panes(q, pane_table, per_pane=True)
+        inner = (row >= 6) & (row < 58) & (column >= 6) & (column < 58) & ~dead_pixels[idx_bank, row, column]
+        np.testing.assert_array_equal(seen[:, idx_bank], inner)
+        assert not np.any(np.delete(seen, idx_bank, axis=1))
+        # too slow for the time-of-flight window
+        assert not np.any(contain_points_in_panes(q * 1010 / 16500, pane_table))
+
+
+def test_pixel_coverage_model_matches_exact_panes() -> None:
+    ewald = make_instrument(coverage_model="ewald")
+    pixel = make_pixel_instrument(make_instrument(), edge=0)
+    grids = make_grids()
+    angles = euler_angle_lattice([[0, 360, 90], [135, 135, 1], [0, 360, 90]])
+
+    exact_masks = orientation_masks(ewald, grids, angles).to_bool()
+    pixel_masks = orientation_masks(pixel, grids, angles).to_bool()
+    assert exact_masks.any()
+    # the pixel centers span the exact panes, the lookup only adds the outer half of the border pixels
+    assert not np.any(exact_masks & ~pixel_masks)
+    assert np.count_nonzero(pixel_masks & ~exact_masks) <= 0.05 * np.count_nonzero(exact_masks)
+
+    # rotated lookups agree with testing R^T q against the unrotated detector
+    euler_angles = (30.0, 135.0, 250.0)
+    expected = contain_points_in_panes(
+        np.asarray(grids.rotated_points) @ euler_rotation_matrix(euler_angles), pixel.pane_table(), per_pane=True
+    )
+    _, coverage_perpane = grids.get_coverage(pixel, per_pane=True, euler_angles=euler_angles)
+    np.testing.assert_array_equal(coverage_perpane, np.any(expected, axis=0).T)
@@ -1,5 +1,6 @@
 """Test package for model classes."""
 
+from exphub.app.models.angle_plan import AnglePlanModel
 from exphub.app.models.main_model import MainModel
 
 
@@ -7,3 +8,12 @@ def test_main_model_defaults() -> None:
     model = MainModel()
     assert model.username == "test_name"
     assert model.password == "test_password"
+
+
+def test_optimization_curve_figure_plots_coverage_per_run() -> None:
+    angleplan = AnglePlanModel()
+    assert len(angleplan.get_figure_optimization_curve().data[0].x) == 0
+
+    angleplan.optimization_curve = [[1, 20.0], [2, 35.5]]
+    trace = angleplan.get_figure_optimization_curve().data[0]
+    assert list(trace.x) == [1, 2] and list(trace.y) == [20.0, 35.5]
@@ -0,0 +1,109 @@
+"""Tests for the precomputed angle plan library."""
+
+from itertools import product
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from test_angle_plan_engine import cubic_operators, make_instrument
+
+from exphub.app.models.angle_plan_engine import CoverageCache, centering_reflections, engine_version
+from exphub.app.models.plan_library import (
+    AnglePlan,
+    PlanLibrary,
+    any_centering,
+    default_goniometer_limits,
+    legacy_engine_version,
+    optimize_plan,
+    precompute_plans,
+)
+
+
+def make_plan(point_group: str, centering: str, angles: List[List[float]]) -> AnglePlan:
+    return AnglePlan(
+        instrument="TOPAZ",
+        goniometer_limits=[list(axis) for axis in default_goniometer_limits],
+        point_group=point_group,
+        centering=centering,
+        angles=angles,
+        coverage=0.5,
+    )
+
+
+def test_packaged_library_has_a_plan_for_every_point_group() -> None:
+    library = PlanLibrary.load()
+    point_groups = {plan.point_group for plan in library.plans.values()}
+    assert len(point_groups) == 47
+
+    plan = library.lookup("TOPAZ", default_goniometer_limits, "m-3m", "F")
+    assert plan is not None
+    assert plan.centering == any_centering
+    assert plan.angles[0] == [19.0, 135.0, 13.0]
+    assert plan.engine_version == legacy_engine_version and not plan.stale
+    assert library.lookup("MANDI", default_goniometer_limits, "m-3m", "F") is None
+    assert library.lookup("TOPAZ", ((0, 180), (135, 135), (0, 360)), "m-3m", "F") is None
+
+
+def test_lookup_prefers_exact_centering_and_round_trips(tmp_path: Path) -> None:
+    library = PlanLibrary([make_plan("mmm", any_centering, [[1, 135, 2]]), make_plan("mmm", "I", [[3, 135, 4]])])
+    path = str(tmp_path / "plans.json")
+    library.save(path)
+    loaded = PlanLibrary.load(path)
+
+    assert loaded.lookup("TOPAZ", default_goniometer_limits, "mmm", "I").angles == [[3, 135, 4]]  # type: ignore
+    assert loaded.lookup("TOPAZ", default_goniometer_limits, "mmm", "C").angles == [[1, 135, 2]]  # type: ignore
+    assert loaded.plans == library.plans
+
+
+def test_lookup_skips_stale_plans() -> None:
+    library = PlanLibrary([make_plan("mmm", any_centering, [[1, 135, 2]]), make_plan("mmm", "I", [[3, 135, 4]])])
+    library.plans[make_plan("mmm", "I", []).key].engine_version = "0"
+
+    assert library.lookup("TOPAZ", default_goniometer_limits, "mmm", "I").angles == [[1, 135, 2]]  # type: ignore
+    library.plans[make_plan("mmm", any_centering, []).key].engine_version = "0"
+    assert library.lookup("TOPAZ", default_goniometer_limits, "mmm", "I") is None
+
+
+def test_precompute_skips_current_plans() -> None:
+    library = PlanLibrary([make_plan("23", "P", [[0, 135, 0]]), make_plan("23", "I", [[0, 135, 0]])])
+    library.plans[make_plan("23", "I", []).key].engine_version = "0"
+    calls = []
+
+    def optimize(point_group: str, centering: str) -> Tuple[List[List[float]], float, Dict[str, Any]]:
+        calls.append((point_group, centering))
+        return [[10.0, 135.0, 20.0]], 0.75, {"mode": "asymmetric"}
+
+    new_plans = precompute_plans(library, "TOPAZ", ["23"], ["P", "I", "F"], default_goniometer_limits, optimize)
+
+    assert calls == [("23", "I"), ("23", "F")]
+    assert [plan.centering for plan in new_plans] == ["I", "F"]
+    plan = library.lookup("TOPAZ", default_goniometer_limits, "23", "I")
+    assert plan is not None and plan.engine_version == engine_version and plan.coverage == 0.75
+
+
+def test_optimize_plan_reports_unique_reflection_coverage(tmp_path: Path) -> None:
+    det_ins = make_instrument(num_pane=8)
+    ub = np.eye(3) / 6.0
+    hkl = np.array(list(product(range(-8, 9), repeat=3)), dtype=float)
+    hkl = centering_reflections(hkl[np.any(hkl != 0, axis=1)], "F")
+    # all even or all odd
+    assert np.all(np.ptp(hkl % 2, axis=1) == 0)
+
+    angles, coverage, grid = optimize_plan(
+        det_ins, hkl, cubic_operators(), ub, ((0, 90), (135, 135), (0, 90)), angle_step=30
+    )
+
+    assert angles[0] == [0.0, 135.0, 0.0]
+    assert len(angles) > 2
+    assert 0 < coverage <= 1
+    assert grid["mode"] == "asymmetric" and grid["num_unit"] < len(hkl)
+
+    # with a coverage cache the lattice masks of a second run are read back
+    cache = CoverageCache(str(tmp_path))
+    optimize_plan(det_ins, hkl, cubic_operators(), ub, ((0, 90), (135, 135), (0, 90)), 30, coverage_cache=cache)
+    start = det_ins.num_coverage_evaluations
+    cached_angles, _, _ = optimize_plan(
+        det_ins, hkl, cubic_operators(), ub, ((0, 90), (135, 135), (0, 90)), 30, coverage_cache=cache
+    )
+    assert cached_angles == angles
+    assert det_ins.num_coverage_evaluations - start == len(angles)
@@ -0,0 +1,49 @@
+"""Tests for the motor-travel ordering of angle plans."""
+
+from itertools import permutations
+
+import numpy as np
+
+from exphub.app.models.plan_schedule import path_time, plan_angles, schedule_plan, travel_times
+
+
+def make_runs(angles: np.ndarray) -> list:
+    return [
+        {"id": idx + 1, "title": "run {}".format(idx + 1), "phi": float(phi), "chi": 135.0, "omega": float(omega)}
+        for idx, (phi, omega) in enumerate(angles)
+    ]
+
+
+def test_travel_time_is_set_by_the_slowest_axis() -> None:
+    angles = np.array([[0.0, 135.0, 0.0], [40.0, 135.0, 10.0], [40.0, 125.0, 10.0]])
+    times, start_times = travel_times(angles, [2.0, 1.0, 4.0], start=[0.0, 135.0, 100.0])
+
+    np.testing.assert_allclose(times[0], [0.0, 20.0, 20.0])
+    np.testing.assert_allclose(times[1, 2], 10.0)
+    np.testing.assert_allclose(times, times.T)
+    np.testing.assert_allclose(start_times, [25.0, 22.5, 22.5])
+
+
+def test_runs_along_one_axis_are_visited_in_sweep_order() -> None:
+    phi = np.array([138.0, 184.0, 145.0, 19.0, 300.0, 90.0, 250.0])
+    runs = make_runs(np.column_stack((phi, np.zeros_like(phi))))
+
+    ordered, before, after = schedule_plan(runs, start={"phi": 0.0, "chi": 135.0, "omega": 0.0})
+
+    assert [run["phi"] for run in ordered] == sorted(phi)
+    assert after == (300.0 - 0.0) / 2.0
+    assert before > after
+    assert sorted(id(run) for run in ordered) == sorted(id(run) for run in runs)
+
+
+def test_schedule_is_close_to_brute_force_and_never_worse() -> None:
+    rng = np.random.default_rng(0)
+    for _ in range(10):
+        runs = make_runs(rng.uniform(0, 360, size=(6, 2)))
+        ordered, before, after = schedule_plan(runs)
+
+        times, start_times = travel_times(plan_angles(runs), [2.0, 1.0, 2.0])
+        optimum = min(path_time(order, times, start_times) for order in permutations(range(len(runs))))
+        assert optimum - 1e-9 <= after <= before
+        assert after <= 1.2 * optimum
+        assert after == path_time([run["id"] - 1 for run in ordered], times, start_times)